@@ -1,8 +1,8 @@
 import ast
 import re
-import pymongo
 import json
-from processor.database.database import COLLECTION, get_documents
+from processor.database.database import COLLECTION
+from processor.comparison.snapshot_cache import get_snapshot_document, read_snapshot_file
 from processor.logging.log_handler import getlogger
 from processor.comparison.comparisonantlr.compare_types import EQ, NEQ, GT, GTE, LT, LTE
 from processor.comparison.comparisonantlr.compare_types import compare_none, compare_int,\
@@ -143,9 +143,8 @@ class RuleInterpreter:
         if isdb_fetch:
             dbname = self.kwargs['dbname']
             coll = self.kwargs['snapshots'][sid] if sid in self.kwargs['snapshots'] else COLLECTION
-            docs = get_documents(coll, {'snapshotId': sid}, dbname,
-                                 sort=[('timestamp', pymongo.DESCENDING)], limit=1)
-            logger.debug('Number of Snapshot Documents: %s', len(docs))
+            snapshot_doc = get_snapshot_document(coll, sid, dbname)
+            docs = [snapshot_doc] if snapshot_doc else []
             if docs and len(docs):
                 doc = docs[0]['json']
                 snapshot = {
@@ -167,7 +166,7 @@ class RuleInterpreter:
             if exists_dir(json_dir):
                 fname = '%s/snapshots/%s' % (json_dir, sid)
                 if exists_file(fname):
-                    json_data = json_from_file(fname)
+                    json_data = read_snapshot_file(fname, json_from_file)
                     if json_data and 'json' in json_data:
                         doc = json_data['json']
                         snapshot_val = {
@@ -11,9 +11,10 @@ import os
 import re
 import pymongo
 import subprocess
-from processor.helper.json.json_utils import get_field_value, json_from_file, save_json_to_file
-from processor.helper.config.config_utils import get_test_json_dir, parsebool, config_value, generateid
-from processor.helper.file.file_utils import exists_file, exists_dir, remove_file
+from collections import defaultdict, OrderedDict
+from processor.helper.json.json_utils import get_field_value, json_from_file
+from processor.helper.config.config_utils import get_test_json_dir, parsebool, parseint, config_value, generateid
+from processor.helper.file.file_utils import exists_file, exists_dir
 from processor.database.database import COLLECTION, get_documents
 from processor.comparison.comparison_functions import equality,\
     less_than, less_than_equal, greater_than, greater_than_equal, exists
@@ -23,6 +24,9 @@ from antlr4.error.ErrorListener import ErrorListener, ConsoleErrorListener
 from processor.comparison.comparisonantlr.comparatorLexer import comparatorLexer
 from processor.comparison.comparisonantlr.comparatorParser import comparatorParser
 from processor.comparison.comparisonantlr.rule_interpreter import RuleInterpreter
+from processor.comparison.opa_server import get_opa_server, query_path
+from processor.comparison.snapshot_cache import get_snapshot_document, read_snapshot_file
+from processor.comparison.rule_cache import cache_rule_text, container_rule_digest, file_rule_digest, load_rule_module, rule_file, rule_text
 from processor.helper.config.rundata_utils import get_dbtests, get_from_currentdata
 from processor.logging.log_handler import getlogger
 import traceback
@@ -44,6 +48,9 @@ OPERATORS = {
 MATHOPERATORS = ['lt', 'le', 'gt', 'ge', 'eq', 'neq']
 TESTCASEV1 = 1
 TESTCASEV2 = 2
+BATCH_SIZE = 100
+BATCH_PACKAGE = 'prancer_batch'
+BATCH_QUERY = 'data.%s.results' % BATCH_PACKAGE
 
 class MyConsoleErrorListener(ErrorListener):
 
@@ -165,6 +172,28 @@ def get_rego_rule_filename(rego_file, container):
     return rego_file_name
 
 
+def opa_eval(opa_exe, rego_files, rule_expr, inputjson):
+    """
+    Run `opa eval` for the input with the rego files, the input is piped over stdin
+    and the output read from stdout. Returns the exit status and the output json.
+    """
+    cmd = [opa_exe, 'eval', '--stdin-input']
+    for rego_file in rego_files:
+        cmd.extend(['-d', rego_file])
+    cmd.append(rule_expr)
+    try:
+        proc = subprocess.run(cmd, input=json.dumps(inputjson).encode('utf-8'), stdout=subprocess.PIPE)
+    except OSError as ex:
+        logger.debug('Failed to run opa eval: %s', ex)
+        return 1, None
+    resultval = None
+    try:
+        resultval = json.loads(proc.stdout.decode('utf-8'), object_pairs_hook=OrderedDict)
+    except ValueError:
+        logger.debug('Invalid opa eval output: %s', proc.stdout)
+    return proc.returncode, resultval
+
+
 def compare(inputjson, rulestr):
    pass
 
@@ -225,6 +254,8 @@ class ComparatorV01:
         rule = get_field_value(testcase, 'rule')
         isrego = get_field_value(testcase, 'type')
         self.snapshots = []
+        self.rego_input = None
+        self.rego_result = None
         if isrego and isrego == 'rego' or isrego == "python":
             self.format = TESTCASEV2
             self.rule = rule
@@ -256,18 +287,16 @@ class ComparatorV01:
             for path in snapshot.get('paths', []):
                 logger.critical('\t\t\t %s', path)
 
-    def process_rego_test_case(self):
-        tid = '%d_%s' % (int(time.time() * 1000000), generateid(None))
-        results = []
-        inputjson = {}
-        result = False
+    def rego_rule_expr(self):
+        """ The eval or evals of the testcase, defaults to data.rule.rulepass """
         rule_expr = get_field_value(self.testcase, 'eval')
         if not rule_expr:
             rule_expr = get_field_value(self.testcase, 'evals')
-            if rule_expr:
-                del self.testcase['evals']
         if not rule_expr:
             rule_expr = 'data.rule.rulepass'
+        return rule_expr
+
+    def rego_test_id(self):
         testId = 'MISSING ID'
         isMasterTest = False
         if 'testId' in self.testcase:
@@ -275,6 +304,55 @@ class ComparatorV01:
         elif 'masterTestId' in self.testcase:
             testId = self.testcase['masterTestId']
             isMasterTest = True
+        return testId, isMasterTest
+
+    def prepare_rego_input(self):
+        """
+        Fetch the snapshots of the testcase and build the input json for the rego rule.
+        Returns the exclusion flag, the input json and the mastersnapshot to snapshots pairs.
+        """
+        if self.rego_input is not None:
+            return self.rego_input
+        testId, isMasterTest = self.rego_test_id()
+        if len(self.testcase['snapshotId'])==1:
+            sid = self.testcase['snapshotId'][0]
+            toExclude, snapshot_doc = self.get_snaphotid_doc(sid, testId, isMasterTest)
+            self.rego_input = (toExclude, snapshot_doc, None)
+            return self.rego_input
+        # ms_id = dict(zip(self.testcase['snapshotId'], self.testcase['masterSnapshotId']))
+        # logger.info("ms_id")
+        # logger.info(ms_id) 
+        self.snapshots = []
+        resource_sid = []
+        for mastersnapshot_id in self.testcase['masterSnapshotId']:
+            msid = []
+            for sid in self.testcase['snapshotId']:
+                if sid.startswith(mastersnapshot_id):
+                    msid.append(sid)
+            resource_sid.append({mastersnapshot_id:msid})
+        inputjson = {}
+        for sid_pair in resource_sid:    
+            for ms_id, s_id_list in sid_pair.items():
+                snapshot_doc_list = []
+                for s_id in s_id_list:
+                    toExclude, snapshot_doc = self.get_snaphotid_doc(s_id, testId, isMasterTest)
+                    if toExclude:
+                        self.rego_input = (True, None, resource_sid)
+                        return self.rego_input
+                    snapshot_doc_list.append(snapshot_doc)
+                input = {ms_id: snapshot_doc_list}
+                inputjson.update(input)
+        self.rego_input = (False, inputjson, resource_sid)
+        return self.rego_input
+
+    def process_rego_test_case(self):
+        results = []
+        inputjson = {}
+        result = False
+        rule_expr = self.rego_rule_expr()
+        if not get_field_value(self.testcase, 'eval') and get_field_value(self.testcase, 'evals'):
+            del self.testcase['evals']
+        testId, isMasterTest = self.rego_test_id()
 
                             
         # logger.critical('\t\tEVAL: %s', rule_expr)
@@ -286,68 +364,29 @@ class ComparatorV01:
             results.append({'eval': 'data.rule.rulepass', 'result': "passed" if result else "failed", 'message': ''})
             return results
 
-        if len(self.testcase['snapshotId'])==1:
-            sid = self.testcase['snapshotId'][0]
-            toExclude, snapshot_doc = self.get_snaphotid_doc(sid, testId, isMasterTest)
-            if toExclude:
-                logger.warn('\t\tWARN: Excluded test case: %s' % testId)
-                logger.warn('\t\tRESULT: SKIPPED')
-                # msg = 'Excluded testcase because of testId: %s' % testId
-                # results.append({'eval': 'data.rule.rulepass', 'result': 'skipped', 'message': msg})
-                return results
-            inputjson = snapshot_doc
-            if inputjson is None:
-                logger.info('\t\tERROR: Missing snapshot')
-            results = []
-            if inputjson:
-                results = self.generating_result_for_rego_testcase(inputjson, tid, testId, opa_exe, rule_expr, results)
-            else:
-                results.append({'eval': rule_expr, 'result': "passed" if result else "failed", 'message': ''})
-                self.log_result(results[-1])
+        toExclude, inputjson, resource_sid = self.prepare_rego_input()
+        if toExclude:
+            logger.warn('\t\tWARN: Excluded test case: %s' % testId)
+            logger.warn('\t\tRESULT: SKIPPED')
+            # msg = 'Excluded testcase because of testId: %s' % testId
+            # results.append({'eval': 'data.rule.rulepass', 'result': 'skipped', 'message': msg})
             return results
+        if resource_sid is None and inputjson is None:
+            logger.info('\t\tERROR: Missing snapshot')
+        results = []
+        if inputjson:
+            results = self.generating_result_for_rego_testcase(inputjson, testId, opa_exe, rule_expr, results, resource_sid)
         else:
-            # ms_id = dict(zip(self.testcase['snapshotId'], self.testcase['masterSnapshotId']))
-            # logger.info("ms_id")
-            # logger.info(ms_id) 
-            self.snapshots = []
-            resource_sid = []
-            for mastersnapshot_id in self.testcase['masterSnapshotId']:
-                msid = []
-                for sid in self.testcase['snapshotId']:
-                    if sid.startswith(mastersnapshot_id):
-                        msid.append(sid)
-                resource_sid.append({mastersnapshot_id:msid})
-            inputjson = {}
-            for sid_pair in resource_sid:    
-                for ms_id, s_id_list in sid_pair.items():
-                    snapshot_doc_list = []
-                    for s_id in s_id_list:
-                        toExclude, snapshot_doc = self.get_snaphotid_doc(s_id, testId, isMasterTest)
-                        if toExclude:
-                            logger.warn('\t\tWARN: Excluded test case: %s' % testId)
-                            logger.warn('\t\tRESULT: SKIPPED')
-                            return results
-                        snapshot_doc_list.append(snapshot_doc)
-                    input = {ms_id: snapshot_doc_list}
-                    inputjson.update(input)
-            # print('inputjson: ', inputjson)
-            if inputjson:
-                results = self.generating_result_for_rego_testcase(inputjson, tid, testId, opa_exe, rule_expr, results, resource_sid)
-            else:
-                results.append({'eval': rule_expr, 'result': "passed" if result else "failed", 'message': ''})
-                self.log_result(results[-1])
-            return results
+            results.append({'eval': rule_expr, 'result': "passed" if result else "failed", 'message': ''})
+            self.log_result(results[-1])
+        return results
 
-    def generating_result_for_rego_testcase(self, inputjson, tid, testId, opa_exe, rule_expr, results, sid_pair=None):
-        save_json_to_file(inputjson, '/tmp/input_%s.json' % tid)
+    def rego_rule_source(self):
+        """ The rule file of the testcase, returns the match of file(...) and the digest of the rule text """
         rego_rule = self.rule
         rego_match=re.match(r'^file\((.*)\)$', rego_rule, re.I)
         if rego_match:
-            rego_file = self.rego_rule_filename(rego_match.groups()[0], self.container)
-            if rego_file:
-                pass
-            else:
-                rego_file = None
+            rule_digest = self.rego_rule_digest(rego_match.groups()[0], self.container)
         else:
             rego_txt = [
                 "package rule",
@@ -356,23 +395,23 @@ class ComparatorV01:
                 "   %s" % rego_rule,
                 "}", ""
             ]
-            rego_file = '/tmp/input_%s.rego' % tid
-            open(rego_file, 'w').write('\n'.join(rego_txt))
-        if rego_file:
-            if isinstance(rule_expr, list):
-                result = os.system('%s eval -i /tmp/input_%s.json -d %s "data.rule" > /tmp/a_%s.json' % (opa_exe, tid, rego_file, tid))
-                if result != 0 :
+            rule_digest = cache_rule_text('\n'.join(rego_txt))
+        return rego_match, rule_digest
+
+    def generating_result_for_rego_testcase(self, inputjson, testId, opa_exe, rule_expr, results, sid_pair=None):
+        rego_match, rule_digest = self.rego_rule_source()
+        if rule_digest:
+            eval_expr = "data.rule" if isinstance(rule_expr, list) else rule_expr
+            resultval = self.rego_result
+            opa_server = get_opa_server(opa_exe) if resultval is None else None
+            if opa_server:
+                resultval = opa_server.evaluate(rule_text(rule_digest), eval_expr, inputjson)
+                if resultval and "errors" in resultval:
                     self.log_compliance_info(testId)
-                    logger.error("\t\tERROR: have problem in running opa binary")
-                    self.log_rego_error(json_from_file("/tmp/a_%s.json" % tid, object_pairs_hook=None))
-            else:
-                result = os.system('%s eval -i /tmp/input_%s.json -d %s "%s" > /tmp/a_%s.json' % (opa_exe, tid, rego_file, rule_expr, tid))
-                if result != 0 :
-                    self.log_compliance_info(testId)
-                    logger.error("\t\tERROR: have problem in running opa binary")
-                    self.log_rego_error(json_from_file("/tmp/a_%s.json" % tid, object_pairs_hook=None))
-
-            resultval = json_from_file('/tmp/a_%s.json' % tid)
+                    logger.error("\t\tERROR: have problem in running opa server")
+                    self.log_rego_error(resultval)
+            if resultval is None:
+                resultval = self.run_opa_binary(opa_exe, rule_file(rule_digest), eval_expr, inputjson, testId)
             if resultval and "errors" in resultval and resultval["errors"]:
                 if isinstance(rule_expr, list):
                     if rule_expr[0] and "eval" in rule_expr[0]:
@@ -440,13 +479,18 @@ class ComparatorV01:
                 logger.warning('\t\tRESULT: SKIPPED')
             # results.append({'eval': rule_expr, 'result': "passed" if result else "failed", 'message': ''})
             # self.log_result(results[-1])
-        remove_file('/tmp/input_%s.json' % tid)
-        remove_file('/tmp/a_%s.json' % tid)
         return results
 
+    def run_opa_binary(self, opa_exe, rego_file, rule_expr, inputjson, testId):
+        """ Evaluate the rule expression for the input using the `opa eval` command """
+        result, resultval = opa_eval(opa_exe, [rego_file], rule_expr, inputjson)
+        if result != 0 :
+            self.log_compliance_info(testId)
+            logger.error("\t\tERROR: have problem in running opa binary")
+            self.log_rego_error(resultval)
+        return resultval
+
     def process_python_test_case(self) -> list:
-        # setting path of tmp to allow import from temp
-        sys.path.append('/tmp/')
         results = []
         inputjson = {}
         result = False
@@ -498,10 +542,11 @@ class ComparatorV01:
 
         if inputjson:
             test_rule = self.rule
+            rule_module = None
             rule_matched = re.match(r'^file\((.*)\)$', test_rule, re.I)
             if rule_matched:
-                rego_file_name = self.rego_rule_filename(rule_matched.groups()[0], self.container)
-                if not rego_file_name:
+                rule_digest = self.rego_rule_digest(rule_matched.groups()[0], self.container)
+                if not rule_digest:
                     python_testcase = "processor.comparison.rules.%s.%s"%(self.snapshots[0]["type"],rule_matched.groups()[0].split(".")[0])
                     module = import_module(python_testcase)
                     if not module and logger.level == logging.DEBUG:
@@ -511,13 +556,18 @@ class ComparatorV01:
                         return results
                 else:
                     python_testcase = rule_matched.groups()[0].split(".")[0]
+                    # The rule files of the collection are executed from the rule cache
+                    rule_module = load_rule_module(rule_digest)
 
             if isinstance(rule_expr, list):
                 for rule in rule_expr:
                     function_name = rule["eval"].rsplit(".", 1)[-1] if "eval" in rule else ""
                     evalmessage = rule['message'].rsplit('.', 1)[-1] if "message" in rule else ""
 
-                    test_function = import_from(python_testcase, function_name)
+                    if rule_module:
+                        test_function = getattr(rule_module, function_name, None)
+                    else:
+                        test_function = import_from(python_testcase, function_name)
                     if not test_function:
                         self.log_compliance_info(testId)
                         logger.info('\t\tERROR: %s missing', rule_matched.groups()[0])
@@ -643,9 +693,8 @@ class ComparatorV01:
         if isdb_fetch:
             dbname = self.dbname
             coll = self.collection_data[sid] if sid in self.collection_data else COLLECTION
-            docs = get_documents(coll, {'snapshotId': sid}, dbname,
-                                 sort=[('timestamp', pymongo.DESCENDING)], limit=1)
-            logger.debug('Number of Snapshot Documents: %s', len(docs))
+            snapshot_doc = get_snapshot_document(coll, sid, dbname)
+            docs = [snapshot_doc] if snapshot_doc else []
             if docs and len(docs):
                 tobeExcluded = self.exclude_test_case(docs[0], testId, isMasterTest)
                 doc = docs[0]['json']
@@ -669,7 +718,7 @@ class ComparatorV01:
             if exists_dir(json_dir):
                 fname = '%s/snapshots/%s' % (json_dir, sid)
                 if exists_file(fname):
-                    json_data = json_from_file(fname)
+                    json_data = read_snapshot_file(fname, json_from_file)
                     if json_data and 'json' in json_data:
                         tobeExcluded = self.exclude_test_case(json_data, testId, isMasterTest)
                         doc = json_data['json']
@@ -696,47 +745,31 @@ class ComparatorV01:
 
 
     def rego_rule_filename(self, rego_file, container):
-        rego_file_name = None
+        """ Path of the rule file, the rules stored in the database are written once in the rule cache """
+        rule_digest = self.rego_rule_digest(rego_file, container)
+        if rule_digest:
+            return rule_file(rule_digest, os.path.splitext(rego_file)[1])
+        return None
+
+    def rego_rule_digest(self, rego_file, container):
+        """ Digest of the rule file content in the rule cache """
         if 'dirpath' in self.testcase and self.testcase['dirpath']:
             rego_file_name = '%s/%s' % (self.testcase['dirpath'], rego_file)
-            if exists_file(rego_file_name):
-                pass
-            else:
-                rego_file_name = None
-            return  rego_file_name
+            return file_rule_digest(rego_file_name)
         isdb_fetch = get_dbtests()
         #It give same value for DB and SNAPSHOT, So for SNAPSHOT, we'll check it in 
         #db first and if file isn't there, then we are fetching it from file path '''
         
         if isdb_fetch:
-            dbname = self.dbname
-            coll = 'structures'
-            docs = get_documents(coll, { 'type': 'others', "container" : container}, dbname,
-                                 sort=[('timestamp', pymongo.DESCENDING)], limit=1)
-            # print('Number of other Documents: %s' % len(docs))
-            logger.debug('Number of other Documents: %s', len(docs))
-            if docs and len(docs):
-                doc = docs[0]['json']
-                if doc and 'file' in doc and isinstance(doc['file'], list):
-                    for file_doc in doc['file']:
-                        name = get_field_value(file_doc, 'name')
-                        # print(name, rego_file)
-                        if name == rego_file:
-                            content = get_field_value(file_doc, 'container_file')
-                            if content:
-                                rego_file_name = '/tmp/%s' % rego_file
-                                open(rego_file_name, 'w', encoding="utf-8").write(content)
-                                return rego_file_name
-                # print(doc)
+            rule_digest = container_rule_digest(self.dbname, container, rego_file)
+            if rule_digest:
+                return rule_digest
 
         json_dir = get_test_json_dir()
         if exists_dir(json_dir):
             rego_file_name = '%s/%s/%s' % (json_dir, container, rego_file)
-            if exists_file(rego_file_name):
-                pass
-            else:
-                rego_file_name = None
-        return rego_file_name
+            return file_rule_digest(rego_file_name)
+        return None
 
     def get_connector_data(self):
         """ get connector data from snapshot """
@@ -770,10 +803,8 @@ class ComparatorV01:
         result_val = [{"result": "failed"}]
         if self.format == TESTCASEV1:
             if self.snapshot_id:
-                docs = get_documents(self.collection, dbname=self.dbname,
-                                     sort=[('timestamp', pymongo.DESCENDING)],
-                                     query={'snapshotId': self.snapshot_id},
-                                     limit=1)
+                snapshot_doc = get_snapshot_document(self.collection, self.snapshot_id, self.dbname)
+                docs = [snapshot_doc] if snapshot_doc else []
                 logger.info('Number of Snapshot Documents: %s', len(docs))
                 if docs and len(docs):
                     self.data = docs[0]['json']
@@ -874,6 +905,111 @@ class ComparatorV02(ComparatorV01):
         return ComparatorV01.validate(self)
 
 
+class RegoBatch:
+    """
+    Evaluate the rego testcases sharing the same rule and evals in one OPA evaluation
+    over a batched input. A wrapper policy maps the eval expression over the input
+    items, the result of every item is set on its comparator and consumed when the
+    comparator is validated. Batches which fail are left to the per testcase evaluation.
+    """
+
+    def __init__(self, comparators, batch_size=None):
+        if batch_size is None:
+            batch_size = parseint(config_value("OPA", "batchsize"), BATCH_SIZE)
+        self.batch_size = batch_size
+        self.groups = defaultdict(list)
+        self.positions = {}
+        self.evaluated = {}
+        if self.batch_size > 1:
+            for index, comparator in enumerate(comparators):
+                comparator = getattr(comparator, 'comparator', comparator)
+                key = self.batch_key(comparator)
+                if key:
+                    self.positions[index] = (key, len(self.groups[key]))
+                    self.groups[key].append(comparator)
+
+    @staticmethod
+    def batch_key(comparator):
+        """ Testcases with the same rule, evals and rule location are evaluated together """
+        if comparator.format != TESTCASEV2 or comparator.type != 'rego':
+            return None
+        rule_expr = comparator.rego_rule_expr()
+        eval_expr = "data.rule" if isinstance(rule_expr, list) else rule_expr
+        if query_path(eval_expr) is None:
+            return None
+        return (comparator.container, comparator.testcase.get('dirpath'), comparator.rule,
+                json.dumps(rule_expr, sort_keys=True))
+
+    def prepare(self, index):
+        """ Evaluate the batch of the comparator at this index, unless already evaluated """
+        if index not in self.positions:
+            return
+        key, position = self.positions[index]
+        evaluated = self.evaluated.get(key, 0)
+        if position < evaluated:
+            return
+        batch = self.groups[key][evaluated:evaluated + self.batch_size]
+        self.evaluated[key] = evaluated + len(batch)
+        # The comparators are released once validated, do not hold them here.
+        self.groups[key][evaluated:evaluated + len(batch)] = [None] * len(batch)
+        if len(batch) > 1:
+            self.evaluate(batch)
+
+    def evaluate(self, batch):
+        opa_exe = opa_binary()
+        if not opa_exe:
+            return
+        items = []
+        comparators = []
+        for comparator in batch:
+            toExclude, inputjson, _ = comparator.prepare_rego_input()
+            if not toExclude and inputjson:
+                items.append(inputjson)
+                comparators.append(comparator)
+        if len(comparators) < 2:
+            return
+        _, rule_digest = comparators[0].rego_rule_source()
+        if not rule_digest:
+            return
+        rule_expr = comparators[0].rego_rule_expr()
+        eval_expr = "data.rule" if isinstance(rule_expr, list) else rule_expr
+        batch_digest = cache_rule_text(batch_policy(eval_expr))
+        resultval = None
+        opa_server = get_opa_server(opa_exe)
+        if opa_server:
+            resultval = opa_server.query(BATCH_QUERY, [rule_text(rule_digest), rule_text(batch_digest)],
+                                         {'items': items})
+        if resultval is None:
+            _, resultval = opa_eval(opa_exe, [rule_file(rule_digest), rule_file(batch_digest)], BATCH_QUERY,
+                                    {'items': items})
+        if not resultval or 'result' not in resultval or resultval.get('errors'):
+            logger.debug('Batch evaluation of %s failed, evaluating the testcases one by one.', comparators[0].rule)
+            return
+        values = resultval['result'][0]['expressions'][0]['value']
+        for index, comparator in enumerate(comparators):
+            if str(index) in values:
+                comparator.rego_result = {
+                    'result': [{
+                        'expressions': [{
+                            'value': values[str(index)],
+                            'text': eval_expr,
+                            'location': {'row': 1, 'col': 1}
+                        }]
+                    }]
+                }
+            else:
+                comparator.rego_result = {}
+
+
+def batch_policy(rule_expr):
+    """ Wrapper policy evaluating the rule expression for every item of the batched input """
+    return '\n'.join([
+        "package %s" % BATCH_PACKAGE,
+        "results = {i: r | some i; item := input.items[i]; r := %s with input as item}" % rule_expr,
+        ""
+    ])
+
+
 def main(container):
     from processor.connector.validation import run_container_validation_tests_filesystem
     try:
@@ -0,0 +1,287 @@
+"""
+Long running local OPA server used to evaluate rego testcases.
+Starting `opa eval` for every testcase pays the OPA process startup and the
+policy compilation each time. In the server mode a single `opa run --server`
+process is started for the run, every rule is loaded once as a policy of its own
+package and the inputs are posted over a keep-alive connection of each thread.
+"""
+import atexit
+import hashlib
+import http.client
+import json
+import multiprocessing.util
+import re
+import socket
+import subprocess
+import threading
+import time
+from processor.helper.config.config_utils import config_value, parsebool, parseint
+from processor.logging.log_handler import getlogger
+
+logger = getlogger()
+OPA_SERVER = None
+OPA_SERVER_LOCK = threading.Lock()
+OPA_HOST = '127.0.0.1'
+POLICY_PREFIX = 'prancer'
+STARTUP_TIMEOUT = 10
+REQUEST_TIMEOUT = 60
+QUERY_REGEX = r'^data(\.[A-Za-z_][A-Za-z0-9_]*)*$'
+PACKAGE_REGEX = r'^(\s*package\s+)([A-Za-z_][A-Za-z0-9_.]*)'
+
+
+def opa_server_enabled():
+    """Server mode is enabled from the OPA section of the config.ini"""
+    return parsebool(config_value("OPA", "opaserver"), False)
+
+
+def query_path(rule_expr):
+    """Convert the rego reference 'data.rule.rulepass' to the data api path 'rule/rulepass'"""
+    if isinstance(rule_expr, str) and re.match(QUERY_REGEX, rule_expr.strip()):
+        return '/'.join(rule_expr.strip().split('.')[1:])
+    return None
+
+
+def policy_prefix(rule_texts):
+    """Package prefix of the rule texts evaluated together, from the digest of the texts."""
+    digest = hashlib.sha256('\0'.join(rule_texts).encode('utf-8')).hexdigest()
+    return '%s_%s' % (POLICY_PREFIX, digest[:24])
+
+
+def prefixed_rule(rule_text, prefix, packages):
+    """
+    The rule text with its package and the references to the packages evaluated
+    with it moved under the prefix, 'package rule' => 'package <prefix>.rule'.
+    """
+    text = re.sub(PACKAGE_REGEX, lambda match: '%s%s.%s' % (match.group(1), prefix, match.group(2)),
+                  rule_text, count=1, flags=re.M)
+    for package in packages:
+        text = re.sub(r'\bdata\.%s\b' % re.escape(package), 'data.%s.%s' % (prefix, package), text)
+    return text
+
+
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind((OPA_HOST, 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+class OpaServer:
+    """
+    Wraps an `opa run --server` process. Every rule is loaded once in a package of
+    its own, prefixed by the digest of the rule text, so the testcases of all the
+    rule files are evaluated without any recompilation. Every thread posts its
+    inputs on its own connection.
+    """
+
+    def __init__(self, opa_exe, port=None, timeout=REQUEST_TIMEOUT):
+        self.opa_exe = opa_exe
+        self.port = port
+        self.timeout = timeout
+        self.process = None
+        self.local = threading.local()
+        self.connections = []
+        self.policy_errors = {}
+        self.lock = threading.Lock()
+        self.policy_lock = threading.Lock()
+
+    def start(self):
+        """Start the server process and wait till it is healthy"""
+        if not self.port:
+            self.port = free_port()
+        cmd = [self.opa_exe, 'run', '--server', '--addr', '%s:%d' % (OPA_HOST, self.port), '--log-level', 'error']
+        try:
+            self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except (OSError, ValueError) as ex:
+            logger.debug('Unable to start the OPA server: %s', ex)
+            self.process = None
+            return False
+        atexit.register(self.stop)
+        started = time.time()
+        while time.time() - started < STARTUP_TIMEOUT:
+            if self.process.poll() is not None:
+                break
+            try:
+                status, _ = self._request('GET', '/health')
+                if status == 200:
+                    logger.debug('OPA server started on port %d', self.port)
+                    return True
+            except (OSError, http.client.HTTPException):
+                pass
+            time.sleep(0.05)
+        logger.debug('OPA server did not start on port %d', self.port)
+        self.stop()
+        return False
+
+    def close_connections(self):
+        """Close the connections of all the threads."""
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+        self.local = threading.local()
+
+    def stop(self):
+        self.close_connections()
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection(OPA_HOST, self.port, timeout=self.timeout)
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
+    def _drop_connection(self, connection):
+        connection.close()
+        self.local.connection = None
+        with self.lock:
+            if connection in self.connections:
+                self.connections.remove(connection)
+
+    def _request(self, method, url, body=None, content_type='application/json'):
+        """Send the request on the keep-alive connection of the thread, reconnect once if it was dropped."""
+        headers = {'Content-Type': content_type} if body is not None else {}
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, url, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (OSError, http.client.HTTPException):
+                self._drop_connection(connection)
+                if attempt:
+                    raise
+        try:
+            data = json.loads(data.decode('utf-8')) if data else {}
+        except ValueError:
+            data = {'message': data.decode('utf-8', errors='replace')}
+        return response.status, data
+
+    def load_policies(self, rule_texts):
+        """
+        Load the rule texts evaluated together under their package prefix, once for
+        the run. Returns the prefix and the compile errors.
+        """
+        prefix = policy_prefix(rule_texts)
+        if prefix not in self.policy_errors:
+            with self.policy_lock:
+                if prefix not in self.policy_errors:
+                    packages = [match.group(2) for match in
+                                [re.search(PACKAGE_REGEX, text, re.M) for text in rule_texts] if match]
+                    errors = None
+                    for index, text in enumerate(rule_texts):
+                        status, data = self._request('PUT', '/v1/policies/%s_%d' % (prefix, index),
+                                                     body=prefixed_rule(text, prefix, packages).encode('utf-8'),
+                                                     content_type='text/plain')
+                        if status != 200:
+                            errors = server_errors(data)
+                            break
+                    self.policy_errors[prefix] = errors
+        return prefix, self.policy_errors[prefix]
+
+    def evaluate(self, rule_text, rule_expr, inputjson):
+        """
+        Evaluate the rule expression for the input and return the result in the
+        same format as the `opa eval` command output. Returns None when the
+        expression cannot be evaluated through the server.
+        """
+        return self.query(rule_expr, [rule_text], inputjson)
+
+    def query(self, rule_expr, rule_texts, inputjson):
+        """Evaluate the rule expression with the rule texts loaded together."""
+        path = query_path(rule_expr)
+        if path is None or not self.running():
+            return None
+        try:
+            prefix, errors = self.load_policies(rule_texts)
+            if errors:
+                return {'errors': errors}
+            body = json.dumps({'input': inputjson}).encode('utf-8')
+            status, data = self._request('POST', '/v1/data/%s' % '/'.join([prefix, path] if path else [prefix]),
+                                         body=body)
+        except (OSError, http.client.HTTPException) as ex:
+            logger.debug('OPA server request failed: %s', ex)
+            return None
+        if status != 200:
+            return {'errors': server_errors(data)}
+        if 'result' not in data:
+            return {}
+        return {
+            'result': [{
+                'expressions': [{
+                    'value': data['result'],
+                    'text': rule_expr,
+                    'location': {'row': 1, 'col': 1}
+                }]
+            }]
+        }
+
+
+def server_errors(data):
+    """The error list from the server response, in the format of the `opa eval` errors."""
+    errors = data.get('errors') if isinstance(data, dict) else None
+    if not errors:
+        errors = [{
+            'code': data.get('code', 'internal_error') if isinstance(data, dict) else 'internal_error',
+            'message': data.get('message', '') if isinstance(data, dict) else str(data)
+        }]
+    return errors
+
+
+def get_opa_server(opa_exe):
+    """
+    Returns the OPA server of this run, starting it on the first call. Returns None
+    if the server mode is disabled or the server could not be started, so the
+    caller continues with the `opa eval` command.
+    """
+    global OPA_SERVER
+    if OPA_SERVER is None:
+        with OPA_SERVER_LOCK:
+            if OPA_SERVER is None:
+                server = False
+                if opa_exe and opa_server_enabled():
+                    port = parseint(config_value("OPA", "opaserverport"), 0)
+                    server = OpaServer(opa_exe, port=port if port else None)
+                    if not server.start():
+                        logger.warning('\t\tWARN: OPA server could not be started, using opa eval.')
+                        server = False
+                OPA_SERVER = server
+    return OPA_SERVER if OPA_SERVER else None
+
+
+def reset_opa_server():
+    """
+    Forget the OPA server inherited by a forked worker process. The inherited
+    connection is closed in the worker only, the server of the parent process is not
+    stopped. The worker starts its own server for its testcases, stopped when the
+    worker process exits.
+    """
+    global OPA_SERVER, OPA_SERVER_LOCK
+    OPA_SERVER_LOCK = threading.Lock()
+    if OPA_SERVER:
+        OPA_SERVER.close_connections()
+    OPA_SERVER = None
+    # The worker processes exit without running the atexit handlers.
+    multiprocessing.util.Finalize(None, stop_opa_server, exitpriority=10)
+
+
+def stop_opa_server():
+    global OPA_SERVER
+    with OPA_SERVER_LOCK:
+        if OPA_SERVER:
+            OPA_SERVER.stop()
+        OPA_SERVER = None
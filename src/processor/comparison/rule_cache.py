@@ -0,0 +1,161 @@
+"""
+Content addressed cache of the rule files used by the rego and python testcases.
+The rule text is kept in memory under the sha256 digest of its content, so the
+same rule is read, written or compiled only once per run whatever the number of
+testcases using it. Rules which are not on the disk are materialized once in a
+private directory of the process when an `opa eval` command needs a file path.
+The rule files of a container saved in the `structures` collection are loaded
+once per run in the container rule repository and indexed by their name.
+"""
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import types
+import pymongo
+from processor.helper.file.file_utils import exists_file
+from processor.helper.json.json_utils import get_field_value
+from processor.database.database import get_documents
+from processor.logging.log_handler import getlogger
+
+logger = getlogger()
+RULE_TEXTS = {}
+RULE_FILES = {}
+RULE_MODULES = {}
+FILE_DIGESTS = {}
+CONTAINER_RULES = {}
+RULE_DIR = None
+RULE_LOCK = threading.RLock()
+
+
+def rule_digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def cache_rule_text(text, path=None):
+    """Add the rule text in the cache, the path is the file on the disk having this text."""
+    digest = rule_digest(text)
+    with RULE_LOCK:
+        RULE_TEXTS[digest] = text
+        if path and digest not in RULE_FILES:
+            RULE_FILES[digest] = path
+    return digest
+
+
+def file_rule_digest(path):
+    """Digest of the rule file on the disk, the file is read again only if it is modified."""
+    if not exists_file(path):
+        return None
+    mtime = os.path.getmtime(path)
+    with RULE_LOCK:
+        cached = FILE_DIGESTS.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    digest = cache_rule_text(text, path)
+    with RULE_LOCK:
+        FILE_DIGESTS[path] = (mtime, digest)
+    return digest
+
+
+def rule_text(digest):
+    return RULE_TEXTS.get(digest)
+
+
+def rule_dir():
+    """Private directory of this process for the rules which are not on the disk."""
+    global RULE_DIR
+    with RULE_LOCK:
+        if not RULE_DIR:
+            RULE_DIR = tempfile.mkdtemp(prefix='prancer_rules_')
+            atexit.register(shutil.rmtree, RULE_DIR, True)
+        return RULE_DIR
+
+
+def rule_file(digest, suffix='.rego'):
+    """Path of a file with the rule text, written only the first time it is needed."""
+    with RULE_LOCK:
+        path = RULE_FILES.get(digest)
+        if path and FILE_DIGESTS.get(path, (None, digest))[1] == digest and exists_file(path):
+            return path
+        text = RULE_TEXTS.get(digest)
+        if text is None:
+            return None
+        path = '%s/%s%s' % (rule_dir(), digest, suffix)
+        with open(path, 'w', encoding="utf-8") as f:
+            f.write(text)
+        RULE_FILES[digest] = path
+        return path
+
+
+def load_rule_module(digest):
+    """Python module executed from the cached rule text, loaded once per content."""
+    with RULE_LOCK:
+        if digest in RULE_MODULES:
+            return RULE_MODULES[digest]
+        text = RULE_TEXTS.get(digest)
+        module = None
+        if text is not None:
+            name = 'prancer_rule_%s' % digest[:16]
+            module = types.ModuleType(name)
+            module.__file__ = RULE_FILES.get(digest, name)
+            try:
+                exec(compile(text, module.__file__, 'exec'), module.__dict__)
+            except Exception as ex:
+                logger.debug('Failed to load the python rule %s: %s', module.__file__, ex)
+                module = None
+        RULE_MODULES[digest] = module
+        return module
+
+
+def _latest_rules_doc(dbname, container, proj=None):
+    docs = get_documents('structures', {'type': 'others', 'container': container}, dbname,
+                         sort=[('timestamp', pymongo.DESCENDING)], limit=1, proj=proj)
+    return docs[0] if docs else None
+
+
+def load_container_rules(dbname, container):
+    """
+    Load all the rule files of the latest `others` structure of the container in the
+    rule cache, returns the repository entry with the name => digest index.
+    """
+    doc = _latest_rules_doc(dbname, container)
+    rules = {}
+    timestamp = doc.get('timestamp') if doc else None
+    files = get_field_value(doc, 'json.file') if doc else None
+    if files and isinstance(files, list):
+        for file_doc in files:
+            name = get_field_value(file_doc, 'name')
+            content = get_field_value(file_doc, 'container_file')
+            if name and content and name not in rules:
+                rules[name] = cache_rule_text(content)
+    logger.debug('Loaded %d rule files of container %s', len(rules), container)
+    entry = {'timestamp': timestamp, 'rules': rules}
+    with RULE_LOCK:
+        CONTAINER_RULES[(dbname, container)] = entry
+    return entry
+
+
+def refresh_container_rules(dbname, container):
+    """Invalidate the rules of the container if a newer structures document is saved."""
+    with RULE_LOCK:
+        entry = CONTAINER_RULES.get((dbname, container))
+    if not entry:
+        return
+    doc = _latest_rules_doc(dbname, container, proj={'timestamp': 1})
+    if (doc.get('timestamp') if doc else None) != entry['timestamp']:
+        logger.debug('Rule files of container %s changed, reloading.', container)
+        with RULE_LOCK:
+            CONTAINER_RULES.pop((dbname, container), None)
+
+
+def container_rule_digest(dbname, container, name):
+    """Digest of the rule file of the container from the structures collection."""
+    with RULE_LOCK:
+        entry = CONTAINER_RULES.get((dbname, container))
+    if not entry:
+        entry = load_container_rules(dbname, container)
+    return entry['rules'].get(name)
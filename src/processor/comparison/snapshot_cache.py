@@ -0,0 +1,129 @@
+"""
+Cache of the snapshot documents used by the comparators of a test file.
+The latest document of every snapshot referenced by the testcases of a test file
+is loaded with one aggregation per collection before the testcases run, so the
+comparators are served from memory instead of querying the database for each
+testcase. In filesystem mode each snapshot file is read from the disk once and
+again only if it is modified. The number of cached documents is bounded by the
+`snapshotcachesize` of the TESTS section in the config.ini, or by the number of
+prefetched snapshots when they are more.
+"""
+import copy
+import os
+import threading
+from collections import OrderedDict
+import pymongo
+from processor.database.database import aggregate_documents, get_documents
+from processor.helper.config.config_utils import config_value, parseint, TESTS
+from processor.helper.json.json_utils import json_from_file
+from processor.logging.log_handler import getlogger
+
+logger = getlogger()
+CACHE_SIZE = 1000
+PREFETCH_SIZE = 500
+SNAPSHOT_DOCS = OrderedDict()
+SNAPSHOT_FILES = OrderedDict()
+SNAPSHOT_LOCK = threading.RLock()
+SNAPSHOT_CACHE = {'enabled': False, 'size': CACHE_SIZE}
+
+
+def snapshot_cache_size():
+    return max(parseint(config_value(TESTS, 'snapshotcachesize'), CACHE_SIZE), 1)
+
+
+def _put(cache, key, value):
+    with SNAPSHOT_LOCK:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > SNAPSHOT_CACHE['size']:
+            cache.popitem(last=False)
+
+
+def _get(cache, key):
+    with SNAPSHOT_LOCK:
+        if key in cache:
+            cache.move_to_end(key)
+            return True, cache[key]
+    return False, None
+
+
+def open_snapshot_cache(dbname=None, snapshots=None):
+    """
+    Enable the cache for the testcases of a test file. The snapshots is a dict of
+    collection => snapshot ids whose latest documents are prefetched from the database.
+    """
+    prefetched = sum(len(set(sids)) for sids in snapshots.values()) if dbname and snapshots else 0
+    with SNAPSHOT_LOCK:
+        SNAPSHOT_DOCS.clear()
+        # The prefetched documents are not evicted before the testcases use them.
+        SNAPSHOT_CACHE['size'] = max(snapshot_cache_size(), prefetched)
+        SNAPSHOT_CACHE['enabled'] = True
+    if dbname and snapshots:
+        prefetch_snapshots(dbname, snapshots)
+
+
+def close_snapshot_cache():
+    with SNAPSHOT_LOCK:
+        SNAPSHOT_CACHE['enabled'] = False
+        SNAPSHOT_DOCS.clear()
+
+
+def prefetch_snapshots(dbname, snapshots):
+    """Load the latest document of the snapshot ids of each collection, in chunks of snapshot ids."""
+    for collection, sids in snapshots.items():
+        sids = sorted(set(sids))
+        for index in range(0, len(sids), PREFETCH_SIZE):
+            chunk = sids[index:index + PREFETCH_SIZE]
+            docs = aggregate_documents(collection, [
+                {'$match': {'snapshotId': {'$in': chunk}}},
+                {'$sort': {'timestamp': pymongo.DESCENDING}},
+                {'$group': {'_id': '$snapshotId', 'doc': {'$first': '$$ROOT'}}}
+            ], dbname)
+            if docs is None:
+                continue
+            found = {}
+            for doc in docs:
+                snapshot_doc = doc['doc']
+                snapshot_doc.pop('_id', None)
+                found[doc['_id']] = snapshot_doc
+            for sid in chunk:
+                _put(SNAPSHOT_DOCS, (dbname, collection, sid), found.get(sid))
+            logger.debug('Prefetched %d of %d snapshots from %s', len(found), len(chunk), collection)
+
+
+def get_snapshot_document(collection, sid, dbname):
+    """
+    Latest document of the snapshot id in the collection, None if it does not exist.
+    The caller gets its own copy as the rules are free to modify their input.
+    """
+    key = (dbname, collection, sid)
+    if SNAPSHOT_CACHE['enabled']:
+        found, doc = _get(SNAPSHOT_DOCS, key)
+        if found:
+            return copy.deepcopy(doc)
+    docs = get_documents(collection, {'snapshotId': sid}, dbname,
+                         sort=[('timestamp', pymongo.DESCENDING)], limit=1)
+    logger.debug('Number of Snapshot Documents: %s', len(docs) if docs else 0)
+    doc = docs[0] if docs else None
+    if SNAPSHOT_CACHE['enabled']:
+        _put(SNAPSHOT_DOCS, key, doc)
+        return copy.deepcopy(doc)
+    return doc
+
+
+def read_snapshot_file(fname, reader=None):
+    """Json of the snapshot file, the file is read from the disk only when modified."""
+    reader = reader if reader else json_from_file
+    if not SNAPSHOT_CACHE['enabled']:
+        return reader(fname)
+    try:
+        stat = os.stat(fname)
+    except OSError:
+        return reader(fname)
+    version = (stat.st_mtime_ns, stat.st_size)
+    found, cached = _get(SNAPSHOT_FILES, fname)
+    if found and cached[0] == version:
+        return copy.deepcopy(cached[1])
+    json_data = reader(fname)
+    _put(SNAPSHOT_FILES, fname, (version, json_data))
+    return copy.deepcopy(json_data)
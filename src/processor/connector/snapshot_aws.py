@@ -19,7 +19,9 @@ import time
 import copy
 import pymongo
 import os
-from boto3 import client
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from boto3 import Session
 from processor.helper.file.file_utils import exists_file
 from processor.logging.log_handler import getlogger
@@ -27,16 +29,140 @@ from processor.helper.config.rundata_utils import put_in_currentdata, get_dbtest
 from processor.helper.json.json_utils import get_field_value, json_from_file,\
     collectiontypes, STRUCTURE, make_snapshots_dir, store_snapshot
 from processor.connector.vault import get_vault_data
-from processor.helper.config.config_utils import config_value, get_test_json_dir, CUSTOMER
+from processor.helper.config.config_utils import config_value, get_test_json_dir, parseint, CUSTOMER,\
+    thread_space_id, set_thread_space_id
 from processor.database.database import insert_one_document, sort_field, get_documents,\
     COLLECTION, DATABASE, DBNAME, get_collection_size, create_indexes
 from processor.helper.httpapi.restapi_azure import json_source
 from processor.helper.httpapi.restapi_azure import get_client_secret
 from processor.connector.snapshot_utils import validate_snapshot_nodes
 from processor.connector.arn_parser import arnparse
+from processor.helper.httpapi.rate_limiter import get_rate_limiter, rate_limited_call, throttle_error
 
 logger = getlogger()
-_valid_service_names = Session().get_available_services()
+REGION_WORKERS = 8
+REGION_TIMEOUT = 600
+DETAIL_WORKERS = 16
+SERVICE_LIMIT = 8
+LIST_TOKENS = [('NextToken', 'NextToken'), ('nextToken', 'nextToken'), ('NextMarker', 'Marker')]
+LIMIT_KEYS = ['MaxResults', 'maxResults', 'MaxItems', 'MaxRecords', 'MaxKeys', 'Limit', 'limit', 'PageSize']
+AWS_SESSION = Session()
+AWS_CLIENTS = {}
+AWS_CLIENTS_LOCK = threading.Lock()
+DETAIL_EXECUTOR = None
+SERVICE_SEMAPHORES = {}
+# Detail methods whose arguments are read from the output of the previous detail methods
+DEPENDENT_METHODS = ['describe_images', 'describe_volumes', 'describe_subnets', 'describe_snapshots',
+                     'describe_snapshot_attribute', 'get_policy_version', 'describe_services', 'get_web_acl']
+_valid_service_names = AWS_SESSION.get_available_services()
+
+
+def client(service_name, **kwargs):
+    """Create a boto3 client from the session shared by the run, so the service models are loaded once."""
+    return AWS_SESSION.client(service_name, **kwargs)
+
+
+def get_aws_client(service_name, region, access_key, secret_access):
+    """
+    The boto3 client of the service in the region for the credentials, created on the
+    first call and shared by the crawler threads, as the boto3 clients are thread-safe.
+    """
+    fingerprint = hashlib.sha256(('%s:%s' % (access_key, secret_access)).encode('utf-8')).hexdigest()
+    key = (service_name, region, fingerprint)
+    with AWS_CLIENTS_LOCK:
+        awsclient = AWS_CLIENTS.get(key)
+        if awsclient is None:
+            awsclient = client(service_name, aws_access_key_id=access_key,
+                               aws_secret_access_key=secret_access, region_name=region)
+            AWS_CLIENTS[key] = awsclient
+    return awsclient
+
+
+def clear_aws_clients():
+    """Close the cached clients and the detail methods executor at the end of the run."""
+    global DETAIL_EXECUTOR
+    with AWS_CLIENTS_LOCK:
+        if DETAIL_EXECUTOR is not None:
+            DETAIL_EXECUTOR.shutdown(wait=False)
+            DETAIL_EXECUTOR = None
+        SERVICE_SEMAPHORES.clear()
+        for awsclient in AWS_CLIENTS.values():
+            close = getattr(awsclient, 'close', None)
+            if callable(close):
+                try:
+                    close()
+                except Exception:
+                    pass
+        AWS_CLIENTS.clear()
+
+
+def _detail_workers():
+    return max(parseint(config_value('AWS', 'detailworkers'), DETAIL_WORKERS), 1)
+
+
+def _service_limit(service):
+    """Concurrent detail calls allowed for the service, from the `servicelimits` list of service:count."""
+    limit = SERVICE_LIMIT
+    for entry in (config_value('AWS', 'servicelimits') or '').split(','):
+        name, _, value = entry.partition(':')
+        if name.strip().lower() == service:
+            limit = max(parseint(value.strip(), SERVICE_LIMIT), 1)
+    return limit
+
+
+def _client_rate_limiter(awsclient, service=None, region=None):
+    """The rate limiter of the service and region of the client."""
+    meta = getattr(awsclient, 'meta', None)
+    if not service:
+        service = getattr(getattr(meta, '_service_model', None), 'service_name', None)
+    if not region:
+        region = getattr(meta, 'region_name', None)
+    return get_rate_limiter('aws', service if isinstance(service, str) else '',
+                            region if isinstance(region, str) else '')
+
+
+def _submit_detail_call(service, region, function_to_call, params):
+    """
+    Call the detail method in the executor shared by the run. The caller waits for a
+    slot of the service, so a throttled service does not hold the executor threads.
+    The calls are rate limited per service and region.
+    """
+    limiter = get_rate_limiter('aws', service, region)
+    global DETAIL_EXECUTOR
+    with AWS_CLIENTS_LOCK:
+        if DETAIL_EXECUTOR is None:
+            DETAIL_EXECUTOR = ThreadPoolExecutor(max_workers=_detail_workers())
+        executor = DETAIL_EXECUTOR
+        semaphore = SERVICE_SEMAPHORES.get(service)
+        if semaphore is None:
+            semaphore = SERVICE_SEMAPHORES[service] = threading.BoundedSemaphore(_service_limit(service))
+
+    def call():
+        try:
+            return rate_limited_call(limiter, function_to_call, **params)
+        finally:
+            semaphore.release()
+
+    semaphore.acquire()
+    try:
+        return executor.submit(call)
+    except Exception:
+        semaphore.release()
+        raise
+
+
+def _detail_method_batches(detail_methods):
+    """
+    Split the detail methods in batches called concurrently, a method using the
+    output of the previous methods starts a new batch.
+    """
+    batches = []
+    for each_method_str in detail_methods:
+        if not batches or each_method_str in DEPENDENT_METHODS:
+            batches.append([])
+        batches[-1].append(each_method_str)
+    return batches
+
 
 def _validate_client_name(client_name):
     """
@@ -161,7 +287,7 @@ def get_node(awsclient, node, snapshot_source, snapshot):
         if function_to_call and callable(function_to_call):
             queryval = get_field_value(node, 'id')
             try:
-                data = function_to_call(**queryval)
+                data = rate_limited_call(_client_rate_limiter(awsclient), function_to_call, **queryval)
                 if data:
                     db_record['json'] = data
                     checksum = get_checksum(data)
@@ -190,24 +316,32 @@ def get_node(awsclient, node, snapshot_source, snapshot):
         arn_obj = arnparse(arn_str)
         client_str = arn_obj.service
         resourceid = arn_obj.resource
+        service = node.get("boto_type", client_str)
         data = {}
-        for each_method_str in detail_methods:
-            function_to_call = getattr(awsclient, each_method_str, None)
-            if function_to_call and callable(function_to_call):
-                kwargs = {"node": node}
-                params = _get_function_kwargs(arn_str, each_method_str, json_to_put, kwargs)
-                # print('params: ', params)
-                try:
-                    data = function_to_call(**params)
-                    if data:
-                        json_to_put.update(data) 
-                except Exception as ex:
-                    logger.warning('Describe function exception: %s', ex)
-                    db_record['error'] = 'Describe function exception: %s' % ex
-            else:
-                logger.info('Invalid function exception: %s', str(function_to_call))
-                db_record['error'] = 'Invalid function exception: %s' % str(function_to_call)
-            set_input_data_in_json(data, json_to_put, client_str, resourceid, arn_str, each_method_str)
+        for batch in _detail_method_batches(detail_methods):
+            calls = []
+            for each_method_str in batch:
+                function_to_call = getattr(awsclient, each_method_str, None)
+                future = None
+                if function_to_call and callable(function_to_call):
+                    kwargs = {"node": node}
+                    params = _get_function_kwargs(arn_str, each_method_str, json_to_put, kwargs)
+                    future = _submit_detail_call(service, db_record["region"], function_to_call, params)
+                calls.append((each_method_str, function_to_call, future))
+            # Merged in the order of the detail methods, as when they were called one by one.
+            for each_method_str, function_to_call, future in calls:
+                if future:
+                    try:
+                        data = future.result()
+                        if data:
+                            json_to_put.update(data) 
+                    except Exception as ex:
+                        logger.warning('Describe function exception: %s', ex)
+                        db_record['error'] = 'Describe function exception: %s' % ex
+                else:
+                    logger.info('Invalid function exception: %s', str(function_to_call))
+                    db_record['error'] = 'Invalid function exception: %s' % str(function_to_call)
+                set_input_data_in_json(data, json_to_put, client_str, resourceid, arn_str, each_method_str)
         db_record['json'] = json_to_put
         checksum = get_checksum(json_to_put)
         if checksum:
@@ -472,8 +606,11 @@ def _get_resources_from_list_function(response, method, service_name=None):
     else:
         return []
         
-def get_all_nodes(awsclient, node, snapshot, connector):
-    """ Fetch all the nodes from the cloned git repository in the given path."""
+def get_all_nodes(awsclient, node, snapshot, connector, deadline=None):
+    """
+    Fetch all the nodes from the cloned git repository in the given path. The listing
+    stops after the current page once the `deadline` time is passed.
+    """
     db_records = []
     arn_string = "arn:aws:%s:%s::%s"
     collection = node['collection'] if 'collection' in node else COLLECTION
@@ -514,15 +651,10 @@ def get_all_nodes(awsclient, node, snapshot, connector):
     if list_function_name:
         list_function = getattr(awsclient, list_function_name, None)
         if list_function and callable(list_function):
-            try:
-                list_kwargs = _get_list_function_kwargs(awsclient.meta._service_model.service_name, list_function_name)
-                response = list_function(**list_kwargs)
-                list_of_resources = _get_resources_from_list_function(response, list_function_name, awsclient.meta._service_model.service_name)
-                # print('list_of_resources: ', list_of_resources)
-            except Exception as ex:
-                list_of_resources = []
+            service_name = awsclient.meta._service_model.service_name
             detail_methods = get_field_value(node, 'detailMethods')
-            for each_resource in list_of_resources:
+            list_kwargs = _get_list_function_kwargs(service_name, list_function_name)
+            for each_resource in _list_resources(awsclient, list_function_name, list_kwargs, deadline):
                 type_list = []
                 if isinstance(each_resource, tuple):
                     resource_arn = each_resource[1]
@@ -530,10 +662,10 @@ def get_all_nodes(awsclient, node, snapshot, connector):
                     if "arn:" in each_resource:
                         resource_arn = each_resource
                     else:
-                        if awsclient.meta._service_model.service_name == "s3":
-                            resource_arn = arn_string %(awsclient.meta._service_model.service_name, "", each_resource)
+                        if service_name == "s3":
+                            resource_arn = arn_string %(service_name, "", each_resource)
                         else:
-                            resource_arn = arn_string %(awsclient.meta._service_model.service_name,
+                            resource_arn = arn_string %(service_name,
                             awsclient.meta.region_name, each_resource)
 
                 if resource_arn in exclude_paths:
@@ -562,6 +694,84 @@ def get_all_nodes(awsclient, node, snapshot, connector):
 
     return db_records
 
+
+def _supports_page_size(awsclient, list_function_name):
+    """True when the input of the list operation has a page size member."""
+    try:
+        operation_name = awsclient.meta.method_to_api_mapping[list_function_name]
+        members = awsclient.meta.service_model.operation_model(operation_name).input_shape.members
+    except Exception:
+        return False
+    return any(key in members for key in LIMIT_KEYS)
+
+
+def _past_deadline(deadline, list_function_name):
+    if deadline and time.time() > deadline:
+        logger.warning('Stopped listing the resources using %s, the deadline is passed', list_function_name)
+        return True
+    return False
+
+
+def _list_function_pages(awsclient, list_function_name, list_kwargs, deadline=None):
+    """
+    Yields the response pages of the list function. The botocore paginator is used
+    when the service defines one, else the NextToken/Marker of the response is
+    passed back till the last page. No page is requested after the deadline.
+    """
+    page_size = parseint(config_value('AWS', 'pagesize'), 0)
+    limiter = _client_rate_limiter(awsclient)
+    can_paginate = getattr(awsclient, 'can_paginate', None)
+    if callable(can_paginate) and can_paginate(list_function_name):
+        paginator = awsclient.get_paginator(list_function_name)
+        pagination_config = {}
+        if page_size and _supports_page_size(awsclient, list_function_name):
+            pagination_config['PageSize'] = page_size
+        pages = iter(paginator.paginate(PaginationConfig=pagination_config, **list_kwargs))
+        while True:
+            if _past_deadline(deadline, list_function_name):
+                return
+            # The paginator cannot resume a failed page, a throttled page only slows the next calls.
+            limiter.acquire()
+            try:
+                page = next(pages)
+            except StopIteration:
+                return
+            except Exception as ex:
+                throttled, retry_after = throttle_error(ex)
+                if throttled:
+                    limiter.throttled(retry_after)
+                raise
+            limiter.success()
+            yield page
+    list_function = getattr(awsclient, list_function_name)
+    kwargs = dict(list_kwargs)
+    tokens = set()
+    while True:
+        if _past_deadline(deadline, list_function_name):
+            return
+        response = rate_limited_call(limiter, list_function, **kwargs)
+        yield response
+        for response_key, request_key in LIST_TOKENS:
+            token = response.get(response_key)
+            if token:
+                break
+        if not token or token in tokens:
+            break
+        tokens.add(token)
+        kwargs[request_key] = token
+
+
+def _list_resources(awsclient, list_function_name, list_kwargs, deadline=None):
+    """Yields the resources of each page as the pages are fetched."""
+    service_name = awsclient.meta._service_model.service_name
+    try:
+        for page in _list_function_pages(awsclient, list_function_name, list_kwargs, deadline):
+            resources = _get_resources_from_list_function(page, list_function_name, service_name)
+            for resource in resources or []:
+                yield resource
+    except Exception as ex:
+        logger.warning("Failed to list the resources using %s: %s", list_function_name, ex)
+
 def get_checksum(data):
     """ Get the checksum for the AWS data fetched."""
     checksum = None
@@ -1066,6 +1276,79 @@ def _get_aws_client_data_from_node(node, default_client=None, default_region=Non
     return client_str, aws_region
 
 
+def _crawl_regions(client_str, regions, access_key, secret_access, node, snapshot, sub_data):
+    """
+    Crawl the resources of the master snapshot node in all the regions concurrently,
+    at most `regionworkers` regions at a time. A region stops listing its resources
+    after the current page once it runs for more than `regiontimeout` seconds, and
+    is skipped. Returns the (region, nodes) pairs in the order of the regions, so
+    the snapshot ids are numbered the same way in every run.
+    """
+    workers = max(parseint(config_value('AWS', 'regionworkers'), REGION_WORKERS), 1)
+    timeout = parseint(config_value('AWS', 'regiontimeout'), REGION_TIMEOUT)
+    space_id = thread_space_id()
+
+    def crawl_region(region):
+        set_thread_space_id(space_id)
+        deadline = time.time() + timeout if timeout else None
+        try:
+            awsclient = get_aws_client(client_str, region, access_key, secret_access)
+        except Exception as ex:
+            logger.info('Unable to create AWS client: %s', ex)
+            return []
+        logger.info(awsclient)
+        nodes = get_all_nodes(awsclient, node, snapshot, sub_data, deadline=deadline)
+        if deadline and time.time() > deadline:
+            logger.warning('Timed out crawling the region %s', region)
+            return []
+        return nodes
+
+    region_nodes = []
+    with ThreadPoolExecutor(max_workers=min(workers, len(regions)) or 1) as executor:
+        futures = [executor.submit(crawl_region, region) for region in regions]
+        for region, future in zip(regions, futures):
+            try:
+                region_nodes.append((region, future.result()))
+            except Exception as ex:
+                logger.warning('Failed to crawl the region %s: %s', region, ex)
+                region_nodes.append((region, []))
+    return region_nodes
+
+
+def _store_node_data(node, data, snapshot_data, dbname, container=None):
+    """Save the snapshot document of the node in the database or the filesystem."""
+    if data:
+        error_str = data.pop('error', None)
+        if get_dbtests():
+            if get_collection_size(data['collection']) == 0:
+                #Creating indexes for collection
+                create_indexes(data['collection'],
+                    config_value(DATABASE, DBNAME), 
+                    [('snapshotId', pymongo.ASCENDING),
+                    ('timestamp', pymongo.DESCENDING)])
+
+                create_indexes(
+                    data['collection'],
+                    config_value(DATABASE, DBNAME), 
+                    [
+                        ('_id', pymongo.DESCENDING),
+                        ('timestamp', pymongo.DESCENDING),
+                        ('snapshotId', pymongo.ASCENDING)
+                    ])
+            check_key = is_check_keys_required(data)
+            insert_one_document(data, data['collection'], dbname, check_key)
+        else:
+            snapshot_dir = make_snapshots_dir(container)
+            if snapshot_dir:
+                store_snapshot(snapshot_dir, data)
+        if 'masterSnapshotId' in node:
+            snapshot_data[node['snapshotId']] = node['masterSnapshotId']
+        else:
+            snapshot_data[node['snapshotId']] = False if error_str else True
+    else:
+        node['status'] = 'inactive'
+
+
 def populate_aws_snapshot(snapshot, container=None):
     """
     This is an entrypoint for populating a snapshot of type aws.
@@ -1119,79 +1402,60 @@ def populate_aws_snapshot(snapshot, container=None):
 
         if access_key and secret_access:
             # existing_aws_client = {}
-            for node in snapshot['nodes']:
-                validate = node['validate'] if 'validate' in node else True
-                mastercode = False
-                if 'snapshotId' in node and validate:
-                    client_str, aws_region = _get_aws_client_data_from_node(node,
-                        default_client=connector_client_str, default_region=region)
-                    if not _validate_client_name(client_str):
-                        logger.error("Invalid Client Name: %s", client_str)
-                        return snapshot_data
-                    try:
-                        awsclient = client(client_str.lower(), aws_access_key_id=access_key,
-                                           aws_secret_access_key=secret_access, region_name=aws_region)
-                    except Exception as ex:
-                        logger.info('Unable to create AWS client: %s', ex)
-                        awsclient = None
-                    if awsclient:
-                        data = get_node(awsclient, node, snapshot_source, snapshot)
-                        if data:
-                            error_str = data.pop('error', None)
-                            if get_dbtests():
-                                if get_collection_size(data['collection']) == 0:
-                                    #Creating indexes for collection
-                                    create_indexes(data['collection'],
-                                        config_value(DATABASE, DBNAME), 
-                                        [('snapshotId', pymongo.ASCENDING),
-                                        ('timestamp', pymongo.DESCENDING)])
-
-                                    create_indexes(
-                                        data['collection'],
-                                        config_value(DATABASE, DBNAME), 
-                                        [
-                                            ('_id', pymongo.DESCENDING),
-                                            ('timestamp', pymongo.DESCENDING),
-                                            ('snapshotId', pymongo.ASCENDING)
-                                        ])
-                                check_key = is_check_keys_required(data)
-                                insert_one_document(data, data['collection'], dbname, check_key)
-                            else:
-                                snapshot_dir = make_snapshots_dir(container)
-                                if snapshot_dir:
-                                    store_snapshot(snapshot_dir, data)
-                            if 'masterSnapshotId' in node:
-                                snapshot_data[node['snapshotId']] = node['masterSnapshotId']
-                            else:
-                                snapshot_data[node['snapshotId']] = False if error_str else True
-                        else:
-                            node['status'] = 'inactive'
-                elif 'masterSnapshotId' in node:
-                    mastercode = True
-                    client_str, aws_region = _get_aws_client_data_from_node(node,
-                        default_client=connector_client_str, default_region=region)
-                    if not _validate_client_name(client_str):
-                        logger.error("Invalid Client Name %s", client_str)
-                        return snapshot_data
-                    if aws_region:
-                        all_regions = [aws_region]
-                    else:
-                        all_regions = Session().get_available_regions(client_str.lower())
-                        if client_str.lower() in ['s3','cloudtrail']:
-                            all_regions = ['us-west-1']
-                    logger.info("Length of all regions is %s"%(str(len(all_regions))))
-                    count = 0
-                    snapshot_data[node['masterSnapshotId']] = []
-                    for each_region in all_regions:
-                        logger.info(each_region)
+            space_id = thread_space_id()
+            window = _detail_workers() * 2
+            fetches = deque()
+
+            def fetch_node(awsclient, node):
+                set_thread_space_id(space_id)
+                return get_node(awsclient, node, snapshot_source, snapshot)
+
+            def store_fetched(count=0):
+                # The nodes are stored in their order, at most `count` fetches are left running.
+                while len(fetches) > count:
+                    node, future = fetches.popleft()
+                    _store_node_data(node, future.result(), snapshot_data, dbname, container)
+
+            with ThreadPoolExecutor(max_workers=_detail_workers()) as executor:
+                for node in snapshot['nodes']:
+                    validate = node['validate'] if 'validate' in node else True
+                    mastercode = False
+                    if 'snapshotId' in node and validate:
+                        client_str, aws_region = _get_aws_client_data_from_node(node,
+                            default_client=connector_client_str, default_region=region)
+                        if not _validate_client_name(client_str):
+                            logger.error("Invalid Client Name: %s", client_str)
+                            store_fetched()
+                            return snapshot_data
                         try:
-                            awsclient = client(client_str.lower(), aws_access_key_id=access_key,
-                                               aws_secret_access_key=secret_access, region_name=each_region)
+                            awsclient = get_aws_client(client_str.lower(), aws_region, access_key, secret_access)
                         except Exception as ex:
                             logger.info('Unable to create AWS client: %s', ex)
-                        logger.info(awsclient)
+                            awsclient = None
                         if awsclient:
-                            all_data = get_all_nodes(awsclient, node, snapshot, sub_data)
+                            fetches.append((node, executor.submit(fetch_node, awsclient, node)))
+                            store_fetched(window)
+                    elif 'masterSnapshotId' in node:
+                        mastercode = True
+                        client_str, aws_region = _get_aws_client_data_from_node(node,
+                            default_client=connector_client_str, default_region=region)
+                        if not _validate_client_name(client_str):
+                            logger.error("Invalid Client Name %s", client_str)
+                            store_fetched()
+                            return snapshot_data
+                        if aws_region:
+                            all_regions = [aws_region]
+                        else:
+                            all_regions = AWS_SESSION.get_available_regions(client_str.lower())
+                            if client_str.lower() in ['s3','cloudtrail']:
+                                all_regions = ['us-west-1']
+                        logger.info("Length of all regions is %s"%(str(len(all_regions))))
+                        count = 0
+                        snapshot_data[node['masterSnapshotId']] = []
+                        region_nodes = _crawl_regions(client_str.lower(), all_regions, access_key,
+                                                      secret_access, node, snapshot, sub_data)
+                        for each_region, all_data in region_nodes:
+                            logger.info(each_region)
                             if all_data:
                                 for data in all_data:
                                     node_data = {
@@ -1209,6 +1473,7 @@ def populate_aws_snapshot(snapshot, container=None):
                                         node_data["boto_type"] = node.get("boto_type")
                                     snapshot_data[node['masterSnapshotId']].append(node_data)
                                     count += 1
+                store_fetched()
             if mastercode:
                 snapshot_data = eliminate_duplicate_snapshots(snapshot_data)
     return snapshot_data
@@ -1220,26 +1485,37 @@ def is_check_keys_required(data):
     except Exception:
         return False
 
+def _snapshot_key(snapshot):
+    detail_methods = snapshot['detailMethods']
+    if isinstance(detail_methods, list):
+        detail_methods = tuple(detail_methods)
+    return snapshot['arn'], detail_methods
+
+
 def eliminate_duplicate_snapshots(snapshot_data):
+    """
+    A resource crawled by more than one master snapshot is kept once. The nodes of a
+    master snapshot matching an accepted node on arn and detail methods add their
+    masterSnapshotId to the accepted node and the master snapshot nodes are dropped.
+    The accepted nodes are indexed on (arn, detailMethods) to find the matches.
+    """
     data = {}
-    is_updated = False
+    index = {}
     for snapshot_id, value in snapshot_data.items():
         is_updated = False
-        for count, snapshot in enumerate(value):
-            for sid, sval in data.items():
-                for cnt, val in enumerate(sval):
-                    if sid == snapshot_id:
-                        continue
-                    if snapshot['arn'] == val['arn'] and snapshot['detailMethods'] == val['detailMethods']:
-                        is_updated = True
-                        s_id = snapshot_data[snapshot_id][count]['masterSnapshotId']
-                        if isinstance(val['masterSnapshotId'], str):
-                            data[sid][cnt]['masterSnapshotId'] = [s_id, val['masterSnapshotId']]
-                        elif isinstance(val['masterSnapshotId'], list):
-                            data[sid][cnt]['masterSnapshotId'].append(s_id)
+        for snapshot in value:
+            for val in index.get(_snapshot_key(snapshot), []):
+                is_updated = True
+                s_id = snapshot['masterSnapshotId']
+                if isinstance(val['masterSnapshotId'], str):
+                    val['masterSnapshotId'] = [s_id, val['masterSnapshotId']]
+                elif isinstance(val['masterSnapshotId'], list):
+                    val['masterSnapshotId'].append(s_id)
 
         if not is_updated:
             data.update({snapshot_id:value})
+            for snapshot in value:
+                index.setdefault(_snapshot_key(snapshot), []).append(snapshot)
     return data
 
 
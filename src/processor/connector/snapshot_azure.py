@@ -10,6 +10,7 @@ import time
 import re
 import pymongo
 import os
+import functools
 from processor.connector.special_crawler.azure_crawler import AzureCrawler
 from processor.connector.special_node_pull.azure_node_pull import AzureNodePull, NODE_PULL_URL
 from processor.helper.file.file_utils import exists_file
@@ -22,7 +23,9 @@ from processor.helper.httpapi.restapi_azure import get_access_token,\
     get_web_client_data, get_client_secret, json_source, GRAPH_TOKEN
 from processor.connector.vault import get_vault_data
 from processor.helper.httpapi.http_utils import http_get_request
-from processor.helper.config.config_utils import config_value, framework_dir, CUSTOMER, EXCLUSION
+from processor.helper.httpapi.rate_limiter import url_rate_limiter, rate_limited_call
+from processor.helper.httpapi.fetch_engine import run_all
+from processor.helper.config.config_utils import config_value, framework_dir, parseint, CUSTOMER, EXCLUSION
 from processor.database.database import insert_one_document, COLLECTION, get_collection_size, create_indexes, \
      DATABASE, DBNAME, sort_field, get_documents
 from processor.connector.snapshot_utils import validate_snapshot_nodes
@@ -31,6 +34,7 @@ from processor.templates.azure.azure_parser import AzureTemplateParser
 
 logger = getlogger()
 apiversions = None
+NODE_WORKERS = 8
 
 def get_api_versions():
     """ get api versions dict """
@@ -66,6 +70,23 @@ def get_version_for_type(node):
         logger.error("Azure API versions are not set or invalid path")
     return version
 
+def get_all_pages(url, hdrs, name='\tRESOURCE LIST'):
+    """
+    GET the list url and the nextLink of each page, returns the status and the values
+    of all the pages, or the status and the response of the request which failed.
+    """
+    values = []
+    urls = set()
+    status, data = None, None
+    while url and url not in urls:
+        urls.add(url)
+        status, data = http_get_request(url, hdrs, name=name)
+        if not (status and isinstance(status, int) and status == 200):
+            return status, data
+        values.extend(data.get('value', []))
+        url = data.get('nextLink')
+    return status, {'value': values}
+
 def get_all_nodes(token, sub_name, sub_id, node, user, snapshot_source):
     """ Fetch all nodes from azure portal using rest API."""
     collection = node['collection'] if 'collection' in node else COLLECTION
@@ -122,7 +143,7 @@ def get_all_nodes(token, sub_name, sub_id, node, user, snapshot_source):
             urlstr = 'https://management.azure.com/subscriptions/%s/resources?api-version=2017-05-10'
             url = urlstr % sub_id
             # logger.info('Get Id REST API invoked!')
-            status, data = http_get_request(url, hdrs, name='\tRESOURCE LIST')
+            status, data = get_all_pages(url, hdrs, name='\tRESOURCE LIST')
             # logger.info('Get Id status: %s', status)
             if status and isinstance(status, int) and status == 200:
                 resources = data['value']
@@ -171,7 +192,7 @@ def export_template(url, hdrs, path, retry_count=3):
         "resources": [ path ],
         "options": "SkipAllParameterization"
     }
-    response = requests.post(url, data=json.dumps(request_data), headers=hdrs)
+    response = rate_limited_call(url_rate_limiter(url), requests.post, url, data=json.dumps(request_data), headers=hdrs)
     data = {}
     if response.status_code and isinstance(response.status_code, int) and response.status_code == 202 and retry_count:
         return export_template(url, hdrs, path, retry_count=retry_count-1)
@@ -333,6 +354,101 @@ def populate_client_secret(client_id, client_secret, snapshot_user):
     
     return client_secret
 
+
+def add_node_data(node, data, snapshot_data, all_data_records):
+    """Add the record of the snapshot node fetched by get_node."""
+    validate = node['validate'] if 'validate' in node else True
+    if data:
+        if validate:
+            all_data_records.append(data)
+            # if get_dbtests():
+            #     if get_collection_size(data['collection']) == 0:
+            #         # Creating indexes for collection
+            #         create_indexes(
+            #             data['collection'], 
+            #             config_value(DATABASE, DBNAME), 
+            #             [
+            #                 ('snapshotId', pymongo.ASCENDING),
+            #                 ('timestamp', pymongo.DESCENDING)
+            #             ]
+            #         )
+
+            #         create_indexes(
+            #             data['collection'], 
+            #             config_value(DATABASE, DBNAME), 
+            #             [
+            #                 ('_id', pymongo.DESCENDING),
+            #                 ('timestamp', pymongo.DESCENDING),
+            #                 ('snapshotId', pymongo.ASCENDING)
+            #             ]
+            #         )
+            #     insert_one_document(data, data['collection'], dbname, check_keys=False)
+            # else:
+            #     snapshot_dir = make_snapshots_dir(container)
+            #     if snapshot_dir:
+            #         store_snapshot(snapshot_dir, data)
+            if 'masterSnapshotId' in node:
+                snapshot_data[node['snapshotId']] = node['masterSnapshotId']
+            else:
+                snapshot_data[node['snapshotId']] = True
+        # else:
+        #     snapshot_data[node['snapshotId']] = False
+        node['status'] = 'active'
+    else:
+        # TODO alert if notification enabled or summary for inactive.
+        node['status'] = 'inactive'
+    logger.debug('Type: %s', type(data))
+
+
+def _path_key(path):
+    return tuple(path) if isinstance(path, list) else path
+
+
+def add_master_snapshot_nodes(node, alldata, snapshot_data, path_index, resource_exclusions,
+                              ignore_node, validate, sub_id):
+    """
+    Add the resources crawled for the master snapshot node in snapshot_data, a resource
+    already added for another master snapshot gets the masterSnapshotId of this node.
+    The path_index maps the path of a resource to its node in each list of snapshot_data.
+    """
+    master_id = node['masterSnapshotId']
+    old_nodes = snapshot_data.get(master_id)
+    if isinstance(old_nodes, list):
+        for item in old_nodes:
+            path_index.get(_path_key(item['path']), {}).pop(master_id, None)
+    snapshot_data[master_id] = []
+    for data in alldata:
+        # insert_one_document(data, data['collection'], dbname)
+        path = _path_key(data['path'])
+        old_records = path_index.get(path)
+        if old_records:
+            for old_record in old_records.values():
+                if master_id not in old_record['masterSnapshotId']:
+                    old_record['masterSnapshotId'].append(master_id)
+            continue
+
+        if isinstance(data['path'], str):
+            key = tuple([data['path']])
+        elif isinstance(data['path'], list):
+            key = tuple(data['path'])
+        else:
+            key = None
+        if key and key in resource_exclusions:
+            logger.warning("Excluded from resource exclusions: %s", data['path'])
+            continue
+        if not ignore_node:
+            item = {
+                'masterSnapshotId': [master_id],
+                'snapshotId': data['snapshotId'],
+                'path': data['path'],
+                'validate': validate,
+                'status': 'active',
+                'subscriptionId': sub_id
+            }
+            snapshot_data[master_id].append(item)
+            path_index.setdefault(path, {})[master_id] = item
+
+
 def populate_azure_snapshot(snapshot, container=None, snapshot_type='azure'):
     """ Populates the resources from azure."""
     dbname = config_value('MONGODB', 'dbname')
@@ -363,51 +479,18 @@ def populate_azure_snapshot(snapshot, container=None, snapshot_type='azure'):
     # snapshot_data, valid_snapshotids = validate_snapshot_nodes(snapshot_nodes)
     if valid_snapshotids and token and snapshot_nodes:
         all_data_records = []
+        path_index = {}
+        workers = max(parseint(config_value('AZURE', 'nodeworkers'), NODE_WORKERS), 1)
+        # The path nodes are fetched as one batch by the fetch engine, the records are added in the order of the nodes.
+        path_nodes = [node for node in snapshot_nodes if 'path' in node]
+        fetched = run_all([functools.partial(get_node, token, sub_name, sub_id, node, snapshot_user,
+                                             snapshot_source, all_data_records) for node in path_nodes], workers)
+        for node, data in zip(path_nodes, fetched):
+            add_node_data(node, data, snapshot_data, all_data_records)
+
         for node in snapshot_nodes:
             validate = node['validate'] if 'validate' in node else True
-            if 'path' in  node:
-                data = get_node(token, sub_name, sub_id, node, snapshot_user, snapshot_source, all_data_records)
-                if data:
-                    if validate:
-                        all_data_records.append(data)
-                        # if get_dbtests():
-                        #     if get_collection_size(data['collection']) == 0:
-                        #         # Creating indexes for collection
-                        #         create_indexes(
-                        #             data['collection'], 
-                        #             config_value(DATABASE, DBNAME), 
-                        #             [
-                        #                 ('snapshotId', pymongo.ASCENDING),
-                        #                 ('timestamp', pymongo.DESCENDING)
-                        #             ]
-                        #         )
-
-                        #         create_indexes(
-                        #             data['collection'], 
-                        #             config_value(DATABASE, DBNAME), 
-                        #             [
-                        #                 ('_id', pymongo.DESCENDING),
-                        #                 ('timestamp', pymongo.DESCENDING),
-                        #                 ('snapshotId', pymongo.ASCENDING)
-                        #             ]
-                        #         )
-                        #     insert_one_document(data, data['collection'], dbname, check_keys=False)
-                        # else:
-                        #     snapshot_dir = make_snapshots_dir(container)
-                        #     if snapshot_dir:
-                        #         store_snapshot(snapshot_dir, data)
-                        if 'masterSnapshotId' in node:
-                            snapshot_data[node['snapshotId']] = node['masterSnapshotId']
-                        else:
-                            snapshot_data[node['snapshotId']] = True
-                    # else:
-                    #     snapshot_data[node['snapshotId']] = False
-                    node['status'] = 'active'
-                else:
-                    # TODO alert if notification enabled or summary for inactive.
-                    node['status'] = 'inactive'
-                logger.debug('Type: %s', type(data))
-            else:
+            if 'path' not in  node:
                 alldata = get_all_nodes(
                     token, sub_name, sub_id, node, snapshot_user, snapshot_source)
                 if alldata:
@@ -429,43 +512,8 @@ def populate_azure_snapshot(snapshot, container=None, snapshot_type='azure'):
                                 if 'paths' in exclusion and isinstance(exclusion['paths'], list):
                                     resourceExclusions[tuple(exclusion['paths'])] = exclusion
 
-                    snapshot_data[node['masterSnapshotId']] = []
-                    for data in alldata:
-                        # insert_one_document(data, data['collection'], dbname)
-                        found_old_record = False
-                        for masterSnapshotId, snapshot_list in snapshot_data.items():
-                            old_record = None
-                            if isinstance(snapshot_list, list):
-                                for item in snapshot_list:
-                                    if item["path"] == data['path']:
-                                        old_record = item
-
-                                if old_record:
-                                    found_old_record = True
-                                    if node['masterSnapshotId'] not in old_record['masterSnapshotId']:
-                                        old_record['masterSnapshotId'].append(
-                                            node['masterSnapshotId'])
-
-                        if not found_old_record:
-                            if isinstance(data['path'], str):
-                                key = tuple([data['path']])
-                            elif isinstance(data['path'], list):
-                                key = tuple(data['path'])
-                            else:
-                                key = None
-                            if key and key in resourceExclusions:
-                                logger.warning("Excluded from resource exclusions: %s", data['path'])
-                                continue
-                            if not ignoreNode:
-                                snapshot_data[node['masterSnapshotId']].append(
-                                    {
-                                        'masterSnapshotId': [node['masterSnapshotId']],
-                                        'snapshotId': data['snapshotId'],
-                                        'path': data['path'],
-                                        'validate': validate,
-                                        'status': 'active',
-                                        'subscriptionId': sub_id
-                                    })
+                    add_master_snapshot_nodes(node, alldata, snapshot_data, path_index, resourceExclusions,
+                                              ignoreNode, validate, sub_id)
 
         for data in all_data_records:
             if get_dbtests():
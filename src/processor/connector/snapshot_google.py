@@ -18,17 +18,24 @@ import time
 import pymongo
 import os
 import re
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
 from googleapiclient import discovery
 from oauth2client.service_account import ServiceAccountCredentials
 from processor.helper.file.file_utils import exists_file
 from processor.logging.log_handler import getlogger
 from processor.helper.httpapi.http_utils import http_get_request
+from processor.helper.httpapi.rate_limiter import url_rate_limiter, rate_limited_call
+from processor.helper.httpapi.fetch_engine import run_all
+from processor.helper.httpapi.restapi_google import get_google_access_token
 from processor.helper.config.rundata_utils import put_in_currentdata, get_dbtests, get_from_currentdata
 from processor.helper.json.json_utils import get_field_value, json_from_file,\
     collectiontypes, STRUCTURE, save_json_to_file, get_field_value_with_default,\
     make_snapshots_dir, store_snapshot
 from processor.connector.vault import get_vault_data
-from processor.helper.config.config_utils import config_value, get_test_json_dir, framework_dir, CUSTOMER, EXCLUSION
+from processor.helper.config.config_utils import config_value, get_test_json_dir, framework_dir, CUSTOMER, EXCLUSION,\
+    thread_space_id, set_thread_space_id
 from processor.database.database import insert_one_document, sort_field, get_documents,\
     COLLECTION, DATABASE, DBNAME, get_collection_size, create_indexes
 from processor.helper.httpapi.restapi_azure import json_source
@@ -217,11 +224,11 @@ def get_request_url_list_method(get_method, list_method, item, project_id=None,
     params = get_params_for_get_method(item , url_var, project_id)
     request_url = requested_get_method_url(request_url, params)
 
-    access_token = credentials.get_access_token().access_token
+    access_token = get_google_access_token(credentials)
     header = {
         "Authorization" : ("Bearer %s" % access_token)
     }
-    list_data_response = requests.get(url=request_url, headers=header)
+    list_data_response = rate_limited_call(url_rate_limiter(request_url), requests.get, url=request_url, headers=header)
     if list_data_response.status_code == 200:
         data = list_data_response.json()
         resource_items =[]
@@ -264,7 +271,7 @@ def get_node(credentials, node, snapshot_source, snapshot):
     }
 
     try:
-        access_token = credentials.get_access_token().access_token
+        access_token = get_google_access_token(credentials)
         header = {
             "Authorization" : ("Bearer %s" % access_token)
         }
@@ -286,7 +293,7 @@ def get_node(credentials, node, snapshot_source, snapshot):
                 base_url = "%s%s" % (base_node_type, ".googleapis.com")
                 request_url = "https://%s/%s" % (base_url, path)
                 logger.info("Invoke request for get snapshot: %s", request_url)
-                temp_data_var = requests.post(url=request_url, headers=header)
+                temp_data_var = rate_limited_call(url_rate_limiter(request_url), requests.post, url=request_url, headers=header)
                 data = temp_data_var.json()
                 status = temp_data_var.status_code
                 logger.info('Get snapshot status: %s', status)
@@ -382,7 +389,7 @@ def get_all_nodes(credentials, node, snapshot_source, snapshot, snapshot_data):
     }
 
     if node_type:
-        access_token = credentials.get_access_token().access_token
+        access_token = get_google_access_token(credentials)
         header = {
             "Authorization" : ("Bearer %s" % access_token)
         }
@@ -400,9 +407,6 @@ def get_all_nodes(credentials, node, snapshot_source, snapshot, snapshot_data):
 
         request_url = generate_request_url(request_url, project_id)
         logger.info("Invoke request for get snapshot: %s", request_url)
-        
-        status, data = http_get_request(request_url, header)
-        logger.info('Get snapshot status: %s', status)
 
         fn_str_list = ""
         if node and 'type' in node and node['type']:
@@ -413,47 +417,109 @@ def get_all_nodes(credentials, node, snapshot_source, snapshot, snapshot_data):
             response_param = fn_str_list[-2]
         elif fn_str_list and len(fn_str_list) == 1:
             response_param = fn_str_list[0]
-        
-        if data:
-            check_node_type = node_type 
-            node_type_list = node_type.split(".")
-            if len(node_type_list) > 1:
-                del node_type_list[-1]
-                check_node_type = ".".join(node_type_list)
-
-            db_record['json'] = data
-            data_filter = response_param.split("/")[-1]
-
-            if "items" in data:
-                if isinstance(data["items"], dict):
-                    for name, scoped_dict in data["items"].items():
-                        if response_param in scoped_dict:
-                            db_record['items'] = db_record['items'] + scoped_dict[check_node_type]
-                        elif data_filter in scoped_dict:
-                            db_record['items'] = db_record['items'] + scoped_dict[data_filter]
-                elif "items" in data and not db_record['items']:
-                    db_record['items'] = data["items"]
-            elif data_filter in data:
-                db_record['items'] = data[data_filter]
-                
-            elif "items" not in data and data_filter not in data:
-                list_var = []
-                list_var.append(data)
-                response_data = {"items" : list_var}
-                db_record['items'] = response_data["items"]
-            
+
+        check_node_type = node_type 
+        node_type_list = node_type.split(".")
+        if len(node_type_list) > 1:
+            del node_type_list[-1]
+            check_node_type = ".".join(node_type_list)
+        data_filter = response_param.split("/")[-1]
+
+        # Each page is added to the snapshot data when it is fetched, the record keeps the first page.
+        count = 0
+        for status, data in get_all_pages(request_url, header):
+            logger.info('Get snapshot status: %s', status)
+            if not data:
+                break
+            items = get_resource_items(node_type, get_page_items(data, response_param, check_node_type, data_filter))
+            if not db_record['json']:
+                db_record['json'] = data
+                db_record['items'] = items
+                checksum = get_checksum(data)
+                if checksum:
+                    db_record['checksum'] = checksum
+
             # snapshot_data["project-id"] = project_id
             # snapshot_data["request_url"] = request_url
             
-            set_snapshot_data(node, db_record['items'], snapshot_data, project_id, credentials)
-
-            checksum = get_checksum(data)
-            if checksum:
-                db_record['checksum'] = checksum
+            set_snapshot_data(node, items, snapshot_data, project_id, credentials, count)
+            count += len(items)
 
     return db_record
 
-def set_snapshot_data(node, items, snapshot_data, project_id=None, credentials=None):
+def page_url(request_url, page_token):
+    """Url of the page of the list request having the page token."""
+    parts = urlparse(request_url)
+    query = [(key, value) for key, value in parse_qsl(parts.query) if key != 'pageToken']
+    query.append(('pageToken', page_token))
+    return urlunparse(parts._replace(query=urlencode(query)))
+
+def get_all_pages(request_url, header):
+    """
+    Generator of the (status, data) of the pages of the list request following the
+    nextPageToken, the next page is fetched while the current page is processed.
+    """
+    space_id = thread_space_id()
+    tokens = set()
+
+    def fetch_page(url):
+        set_thread_space_id(space_id)
+        return http_get_request(url, header)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        status, data = http_get_request(request_url, header)
+        while True:
+            page_token = None
+            if status == 200 and isinstance(data, dict):
+                page_token = data.get('nextPageToken')
+            future = None
+            if page_token and page_token not in tokens:
+                tokens.add(page_token)
+                future = executor.submit(fetch_page, page_url(request_url, page_token))
+            yield status, data
+            if not future:
+                break
+            status, data = future.result()
+
+def get_page_items(data, response_param, check_node_type, data_filter):
+    """Items of a page of the list request."""
+    items = []
+    if "items" in data:
+        if isinstance(data["items"], dict):
+            for name, scoped_dict in data["items"].items():
+                if response_param in scoped_dict:
+                    items = items + scoped_dict[check_node_type]
+                elif data_filter in scoped_dict:
+                    items = items + scoped_dict[data_filter]
+        else:
+            items = data["items"]
+    elif data_filter in data:
+        items = data[data_filter]
+    else:
+        items = [data]
+    return items
+
+def get_resource_items(node_type, items):
+    """Resources of the items, the items of a dict are flattened."""
+    resource_items = []
+    if isinstance(items, dict):
+        for zone, resource in items.items():
+            if 'selfLink' in resource:
+                resource_items.append(resource)
+            else:
+                resource_type = node_type.split("/")[1].split(".")[-2]
+                if resource_type in resource and isinstance(resource[resource_type], list):
+                    if len(resource[resource_type]) > 0 and ('selfLink' in resource[resource_type][0] or "id" in resource[resource_type][0] or "name" in resource[resource_type][0]):
+                        resource_items += resource[resource_type]
+    else:
+        resource_items = items
+    return resource_items
+
+def set_snapshot_data(node, items, snapshot_data, project_id=None, credentials=None, count=0):
+    """
+    Add the master snapshot nodes of the items in the snapshot data, `count` is the
+    number of the items of the previous pages of the list.
+    """
     if node['masterSnapshotId'] not in snapshot_data or not isinstance(snapshot_data[node['masterSnapshotId']], list):
         snapshot_data[node['masterSnapshotId']] =  []
 
@@ -473,19 +539,7 @@ def set_snapshot_data(node, items, snapshot_data, project_id=None, credentials=N
         node_type_list.append("get")
         resource_node_type = ".".join(node_type_list)
 
-    count = 0
-    resource_items = []
-    if isinstance(items, dict):
-        for zone, resource in items.items():
-            if 'selfLink' in resource:
-                resource_items.append(resource)
-            else:
-                resource_type = node_type.split("/")[1].split(".")[-2]
-                if resource_type in resource and isinstance(resource[resource_type], list):
-                    if len(resource[resource_type]) > 0 and ('selfLink' in resource[resource_type][0] or "id" in resource[resource_type][0] or "name" in resource[resource_type][0]):
-                        resource_items += resource[resource_type]
-    else:
-        resource_items = items
+    resource_items = get_resource_items(node_type, items)
 
     includeSnapshotConfig = get_from_currentdata("INCLUDESNAPSHOTS")
     includeSnapshots = get_from_currentdata("SNAPHSHOTIDS")
@@ -639,12 +693,16 @@ def populate_google_snapshot(snapshot, container=None):
             if not credentials:
                 logger.info("No  GCE connection in the snapshot to access Google resource!...")
                 return snapshot_data
+            # The nodes with a snapshotId are fetched as one batch by the fetch engine, stored in the order of the nodes.
+            fetch_nodes = [node for node in snapshot['nodes'] if 'snapshotId' in node and node.get('validate', True)]
+            fetched = iter(run_all([functools.partial(get_node, credentials, node, snapshot_source, snapshot)
+                                    for node in fetch_nodes]))
             for node in snapshot['nodes']:
                 validate = node['validate'] if 'validate' in node else True
                 logger.info(node)
                 if 'snapshotId' in node:
                     if validate:
-                        data = get_node(credentials, node, snapshot_source, snapshot)
+                        data = next(fetched)
                         if data:
                             error_str = data.pop('error', None)
                             if get_dbtests():
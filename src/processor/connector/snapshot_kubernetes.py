@@ -4,15 +4,22 @@ import sys
 import hashlib
 import time
 import os
+import re
 import pymongo
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from processor.helper.config.rundata_utils import get_dbtests, get_from_currentdata
 from processor.helper.json.json_utils import get_field_value,json_from_file,\
     make_snapshots_dir,store_snapshot,get_field_value_with_default,STRUCTURE,\
-    collectiontypes
+    collectiontypes, save_json_to_file
+from processor.helper.file.file_utils import exists_file, mkdir_path
 from processor.logging.log_handler import getlogger
-from processor.helper.config.config_utils import config_value,framework_dir, EXCLUSION
+from processor.helper.config.config_utils import config_value,framework_dir, parseint, parsebool, EXCLUSION,\
+    thread_space_id, set_thread_space_id
 from kubernetes import client,config
+from kubernetes.client.rest import ApiException
+from kubernetes.watch.watch import iter_resp_lines
 import kubernetes.client
 from processor.connector.snapshot_utils import validate_snapshot_nodes
 from processor.database.database import insert_one_document,\
@@ -25,6 +32,44 @@ from processor.connector.vault import get_vault_data
 
 Cache_secret = ""
 Cache_namespace = ""
+LIST_LIMIT = 500
+POOL_SIZE = 10
+KUBE_API_CLIENTS = {}
+KUBE_API_CLIENTS_LOCK = threading.Lock()
+# list function, read function and index of the namespace in the path of every kind
+KUBERNETES_KINDS = {
+    'pod': ('list_namespaced_pod', 'read_namespaced_pod', 3),
+    'deployment': ('list_namespaced_deployment', 'read_namespaced_deployment', 4),
+    'replicaset': ('list_namespaced_replica_set', 'read_namespaced_replica_set', 4),
+    'service': ('list_namespaced_service', 'read_namespaced_service', 3),
+    'networkpolicy': ('list_namespaced_network_policy', 'read_namespaced_network_policy', 4),
+    'podsecuritypolicy': ('list_pod_security_policy', 'read_pod_security_policy', None),
+    'rolebinding': ('list_namespaced_role_binding', 'read_namespaced_role_binding', 4),
+    'role': ('list_namespaced_role', 'read_namespaced_role', 4),
+    'clusterrolebinding': ('list_cluster_role_binding', 'read_cluster_role_binding', None),
+    'clusterrole': ('list_cluster_role', 'read_cluster_role', None),
+    'serviceaccount': ('list_namespaced_service_account', 'read_namespaced_service_account', 3),
+}
+CRAWL_WORKERS = 8
+# path of the objects of the kinds crawled by the master snapshot
+CRAWL_PATHS = {
+    'pod': "api/v1/namespaces/%s/pods/%s",
+    'networkpolicy': "apis/networking.k8s.io/v1/namespaces/%s/networkpolicies/%s",
+    'podsecuritypolicy': "apis/policy/v1beta1/podsecuritypolicies/%s",
+    'role': "apis/rbac.authorization.k8s.io/v1beta1/namespaces/%s/roles/%s",
+    'rolebinding': "apis/rbac.authorization.k8s.io/v1beta1/namespaces/%s/rolebindings/%s",
+    'clusterrole': "apis/rbac.authorization.k8s.io/v1beta1/clusterroles/%s",
+    'clusterrolebinding': "apis/rbac.authorization.k8s.io/v1beta1/clusterrolebindings/%s",
+    'serviceaccount': "api/v1/namespaces/%s/serviceaccounts/%s",
+}
+ALL_NAMESPACES_DENIED = set()
+WATCH_TIMEOUT = 5
+WATCH_STATE_FOLDER = 'rundata/kubernetes'
+HTTP_STATUS_GONE = 410
+# Object of a node which did not change since the snapshot of the previous run
+UNCHANGED = {'unchanged': True}
+# Kinds whose list items are not the complete objects, these are read one by one.
+READ_KINDS = []
 
 
 logger = getlogger()
@@ -139,6 +184,34 @@ def get_client_secret(kubernetes_structure_data,snapshot_serviceAccount,snapshot
 
     return service_account_secret 
 
+def get_kube_api_client(cluster_url, service_account_secret):
+    """
+    ApiClient of the cluster for the service account, created once per run with
+    its own configuration so that the default configuration of the process is
+    not changed and the clusters can be crawled at the same time.
+    """
+    token = '%s' % (service_account_secret)
+    key = (cluster_url, hashlib.sha256(token.encode('utf-8')).hexdigest())
+    with KUBE_API_CLIENTS_LOCK:
+        if key not in KUBE_API_CLIENTS:
+            configuration = kubernetes.client.Configuration()
+            configuration.api_key={"authorization":"Bearer "+ token}
+            configuration.host = cluster_url
+            configuration.verify_ssl=False 
+            configuration.debug = False
+            configuration.connection_pool_maxsize = max(parseint(config_value('KUBERNETES', 'poolsize'), POOL_SIZE), 1)
+            KUBE_API_CLIENTS[key] = client.ApiClient(configuration)
+        return KUBE_API_CLIENTS[key]
+
+def clear_kube_api_clients():
+    """Close the ApiClients of the clusters at the end of the run."""
+    with KUBE_API_CLIENTS_LOCK:
+        for api_client in KUBE_API_CLIENTS.values():
+            api_client.close()
+            api_client.rest_client.pool_manager.clear()
+        KUBE_API_CLIENTS.clear()
+        ALL_NAMESPACES_DENIED.clear()
+
 def create_kube_apiserver_instance_client(cluster_url,service_account_secret,node_type):
     """ 
     Kubernetes library have several core kinds for getting data with cluster api server.
@@ -147,23 +220,18 @@ def create_kube_apiserver_instance_client(cluster_url,service_account_secret,nod
     core instance due to node type.
     """
     node_type=node_type.lower()
-    configuration = kubernetes.client.Configuration()
-    token = '%s' % (service_account_secret)
-    configuration.api_key={"authorization":"Bearer "+ token}
-    configuration.host = cluster_url
-    configuration.verify_ssl=False 
-    configuration.debug = False
-    client.Configuration.set_default(configuration)
+    kube_api_client = get_kube_api_client(cluster_url, service_account_secret)
+    api_client = None
     if node_type in ["pod","service","serviceaccount"]:
-        api_client = client.CoreV1Api()
+        api_client = client.CoreV1Api(kube_api_client)
     if node_type in ["deployment","replicaset"]:
-        api_client = client.AppsV1Api()
+        api_client = client.AppsV1Api(kube_api_client)
     if node_type in ["networkpolicy"]:
-        api_client = client.NetworkingV1Api()
+        api_client = client.NetworkingV1Api(kube_api_client)
     if node_type in ["podsecuritypolicy"]:
-        api_client = client.PolicyV1beta1Api()
+        api_client = client.PolicyV1beta1Api(kube_api_client)
     if node_type in ["rolebinding","role","clusterrole","clusterrolebinding"]:
-        api_client = client.RbacAuthorizationV1beta1Api()
+        api_client = client.RbacAuthorizationV1beta1Api(kube_api_client)
     return api_client
 
 def get_kubernetes_snapshot_data(snapshot,node):
@@ -187,44 +255,44 @@ def get_kubernetes_snapshot_data(snapshot,node):
     try:
         if node_type == "pod":
             snapshot_namespace = path.split("/")[3]
-            api_response = api_instance.read_namespaced_pod(name=object_name,namespace=snapshot_namespace)
+            api_response = api_instance.read_namespaced_pod(name=object_name,namespace=snapshot_namespace,_preload_content=False)
 
         if node_type == "deployment":
             snapshot_namespace = path.split("/")[4]
-            api_response = api_instance.read_namespaced_deployment(name=object_name,namespace=snapshot_namespace)
+            api_response = api_instance.read_namespaced_deployment(name=object_name,namespace=snapshot_namespace,_preload_content=False)
 
         if node_type == "replicaset":
             snapshot_namespace = path.split("/")[4]
-            api_response = api_instance.read_namespaced_replica_set(name=object_name,namespace=snapshot_namespace)
+            api_response = api_instance.read_namespaced_replica_set(name=object_name,namespace=snapshot_namespace,_preload_content=False)
 
         if node_type == "service":
             snapshot_namespace = path.split("/")[3]
-            api_response = api_instance.read_namespaced_service(name=object_name,namespace=snapshot_namespace)
+            api_response = api_instance.read_namespaced_service(name=object_name,namespace=snapshot_namespace,_preload_content=False)
 
         if node_type == "networkpolicy":
             snapshot_namespace = path.split("/")[4]
-            api_response = api_instance.read_namespaced_network_policy(name=object_name,namespace=snapshot_namespace)
+            api_response = api_instance.read_namespaced_network_policy(name=object_name,namespace=snapshot_namespace,_preload_content=False)
 
         if node_type == "podsecuritypolicy":
-            api_response = api_instance.read_pod_security_policy(name=object_name)
+            api_response = api_instance.read_pod_security_policy(name=object_name,_preload_content=False)
 
         if node_type == "rolebinding":
             snapshot_namespace = path.split("/")[4]
-            api_response = api_instance.read_namespaced_role_binding(name=object_name,namespace=snapshot_namespace)
+            api_response = api_instance.read_namespaced_role_binding(name=object_name,namespace=snapshot_namespace,_preload_content=False)
 
         if node_type == "role":
             snapshot_namespace = path.split("/")[4]
-            api_response = api_instance.read_namespaced_role(name=object_name,namespace=snapshot_namespace)
+            api_response = api_instance.read_namespaced_role(name=object_name,namespace=snapshot_namespace,_preload_content=False)
         
         if node_type == "clusterrolebinding":
-            api_response = api_instance.read_cluster_role_binding(name=object_name)
+            api_response = api_instance.read_cluster_role_binding(name=object_name,_preload_content=False)
         
         if node_type == "clusterrole":
-            api_response = api_instance.read_cluster_role(name=object_name)
+            api_response = api_instance.read_cluster_role(name=object_name,_preload_content=False)
         
         if node_type == "serviceaccount":
             snapshot_namespace = path.split("/")[3]
-            api_response = api_instance.read_namespaced_service_account(name=object_name,namespace=snapshot_namespace)
+            api_response = api_instance.read_namespaced_service_account(name=object_name,namespace=snapshot_namespace,_preload_content=False)
 
     except Exception as ex :
         logger.info('\t\tERROR : error in calling api for getting information %s : %s',node_type, object_name)
@@ -232,9 +300,18 @@ def get_kubernetes_snapshot_data(snapshot,node):
         print(traceback.format_exc())
 
         
-    api_response_dict = todict(api_response)  
+    api_response_dict = kubernetes_json(api_response)  
     return api_response_dict
 
+def kubernetes_json(api_response):
+    """
+    Json of the apiserver response. The raw response of a call with _preload_content=False
+    is decoded as it is, without building the model objects of the kubernetes client.
+    """
+    if api_response is None or hasattr(api_response, 'attribute_map') or isinstance(api_response, (dict, list)):
+        return todict(api_response)
+    return json.loads(api_response.data)
+
 def todict(obj):
     """
     todict function convert data to serialized json.
@@ -253,6 +330,255 @@ def todict(obj):
     else:
         return obj
 
+def list_kubernetes_response(api_instance, list_function, **kwargs):
+    """
+    All the items of the list function of the kind and the resourceVersion of the
+    list, the pages of `listlimit` items are followed with the continue token. The
+    apiVersion and kind missing in the list items are set from the list response.
+    """
+    limit = parseint(config_value('KUBERNETES', 'listlimit'), LIST_LIMIT)
+    list_call = getattr(api_instance, list_function)
+    items = []
+    resource_version = None
+    continue_token = None
+    while True:
+        if continue_token:
+            api_response = list_call(limit=limit, _continue=continue_token, _preload_content=False, **kwargs)
+        else:
+            api_response = list_call(limit=limit, _preload_content=False, **kwargs)
+        api_response = kubernetes_json(api_response)
+        api_version = api_response.get('apiVersion')
+        kind = api_response.get('kind')
+        if kind and kind.endswith('List'):
+            kind = kind[:-len('List')]
+        for item in api_response.get('items') or []:
+            if api_version and not item.get('apiVersion'):
+                item['apiVersion'] = api_version
+            if kind and not item.get('kind'):
+                item['kind'] = kind
+            items.append(item)
+        metadata = api_response.get('metadata') or {}
+        resource_version = metadata.get('resourceVersion')
+        continue_token = metadata.get('continue')
+        if not continue_token:
+            break
+    return items, resource_version
+
+def list_kubernetes_items(api_instance, list_function, **kwargs):
+    """All the items of the list function of the kind."""
+    items, _ = list_kubernetes_response(api_instance, list_function, **kwargs)
+    return items
+
+def watch_kubernetes_changes(api_instance, list_function, resource_version, **kwargs):
+    """
+    Objects added or modified and names of the objects deleted since the resource
+    version with the resourceVersion of the last event. The apiserver sends the
+    events since the resource version first, so the watch is caught up at the first
+    bookmark or when it ends after `watchtimeout` seconds. Returns None if the
+    resource version is too old (410 Gone) and the kind has to be listed again.
+    """
+    timeout = parseint(config_value('KUBERNETES', 'watchtimeout'), WATCH_TIMEOUT)
+    list_call = getattr(api_instance, list_function)
+    changed = {}
+    deleted = set()
+    try:
+        response = list_call(watch=True, resource_version=resource_version, timeout_seconds=timeout,
+                             allow_watch_bookmarks=True, _preload_content=False, **kwargs)
+    except ApiException as ex:
+        if ex.status == HTTP_STATUS_GONE:
+            return None
+        raise ex
+    try:
+        for line in iter_resp_lines(response):
+            event = json.loads(line)
+            item = event['object']
+            if event['type'] == 'ERROR':
+                status = item.get('code')
+                if status == HTTP_STATUS_GONE:
+                    return None
+                raise ApiException(status=status, reason=item.get('message'))
+            resource_version = get_field_value(item, 'metadata.resourceVersion') or resource_version
+            if event['type'] == 'BOOKMARK':
+                break
+            name = get_field_value(item, 'metadata.name')
+            if event['type'] == 'DELETED':
+                changed.pop(name, None)
+                deleted.add(name)
+            else:
+                changed[name] = item
+                deleted.discard(name)
+    finally:
+        response.close()
+        response.release_conn()
+    return changed, deleted, resource_version
+
+def kubernetes_snapshot_mode():
+    """`list` builds the nodes from the list responses, `read` reads every object."""
+    mode = config_value('KUBERNETES', 'snapshotmode')
+    return mode.lower() if mode else 'list'
+
+def read_kinds():
+    kinds = config_value('KUBERNETES', 'readkinds')
+    if kinds:
+        return [kind.strip().lower() for kind in kinds.split(',') if kind.strip()]
+    return READ_KINDS
+
+def node_object(node):
+    """Kind, namespace and name of the object of the node, None if the kind is not listed."""
+    node_type = get_field_value(node, 'type')
+    paths = get_field_value(node, 'paths')
+    if node_type not in KUBERNETES_KINDS or node_type in read_kinds() or not paths:
+        return None
+    namespace_index = KUBERNETES_KINDS[node_type][2]
+    path_list = paths[0].split("/")
+    snapshot_namespace = path_list[namespace_index] if namespace_index else None
+    return node_type, snapshot_namespace, path_list[-1]
+
+def get_kubernetes_list_data(snapshot, node, listed_items):
+    """
+    Object of the node from the list of its kind and namespace, the kind is listed
+    once for all the nodes. The object is read from the apiserver if the kind list
+    payload is incomplete or the object is not in the list.
+    """
+    node_object_key = node_object(node)
+    if not node_object_key:
+        return get_kubernetes_snapshot_data(snapshot, node)
+    node_type, snapshot_namespace, object_name = node_object_key
+    key = (node_type, snapshot_namespace)
+    if key not in listed_items:
+        items = {}
+        try:
+            api_instance = create_kube_apiserver_instance(snapshot, node)
+            kwargs = {'namespace': snapshot_namespace} if snapshot_namespace else {}
+            for item in list_kubernetes_items(api_instance, KUBERNETES_KINDS[node_type][0], **kwargs):
+                items[get_field_value(item, 'metadata.name')] = item
+        except Exception as ex:
+            logger.info('\t\tERROR : error in listing %s : %s', node_type, ex)
+            items = None
+        listed_items[key] = items
+    items = listed_items[key]
+    if items and object_name in items:
+        return items.pop(object_name)
+    return get_kubernetes_snapshot_data(snapshot, node)
+
+def watch_state_file(snapshot, container):
+    folder = config_value('KUBERNETES', 'watchstate') or WATCH_STATE_FOLDER
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', '%s_%s' % (container, get_field_value(snapshot, 'source')))
+    return '%s/%s/%s.json' % (framework_dir(), folder, name)
+
+def load_watch_state(snapshot, container):
+    """
+    Watch state of the previous run: the resourceVersion of every kind and namespace
+    and the resourceVersion and snapshotId of the objects saved in the snapshots.
+    """
+    state_file = watch_state_file(snapshot, container)
+    state = json_from_file(state_file) if exists_file(state_file) else None
+    return state if isinstance(state, dict) else {}
+
+def save_watch_state(snapshot, container, state):
+    state_file = watch_state_file(snapshot, container)
+    mkdir_path(os.path.dirname(state_file))
+    save_json_to_file(state, state_file)
+
+def sync_kind(snapshot, node, node_type, snapshot_namespace, entry):
+    """
+    Objects of the kind and namespace changed since the previous run, all the objects
+    when the kind is listed again: on the first run or when the watch gets 410 Gone.
+    """
+    api_instance = create_kube_apiserver_instance(snapshot, node)
+    list_function = KUBERNETES_KINDS[node_type][0]
+    kwargs = {'namespace': snapshot_namespace} if snapshot_namespace else {}
+    changes = None
+    if entry.get('resourceVersion'):
+        changes = watch_kubernetes_changes(api_instance, list_function, entry['resourceVersion'], **kwargs)
+        if changes is None:
+            logger.info('\t\tWatch of %s expired, listing again.', node_type)
+    if changes is None:
+        items, resource_version = list_kubernetes_response(api_instance, list_function, **kwargs)
+        entry['objects'] = {}
+        entry['resourceVersion'] = resource_version
+        return {'full': True, 'changed': {get_field_value(item, 'metadata.name'): item for item in items},
+                'deleted': set()}
+    changed, deleted, resource_version = changes
+    for name in list(changed) + list(deleted):
+        # The snapshots of these objects are outdated
+        entry['objects'].pop(name, None)
+    entry['resourceVersion'] = resource_version
+    return {'full': False, 'changed': changed, 'deleted': deleted}
+
+def watch_key(node_type, snapshot_namespace):
+    return '%s/%s' % (node_type, snapshot_namespace or '')
+
+def sync_watch_key(snapshot, node, node_type, snapshot_namespace, state):
+    """Sync of the kind and namespace, None when it failed and the objects are read one by one."""
+    key = watch_key(node_type, snapshot_namespace)
+    entry = state.setdefault(key, {'resourceVersion': None, 'objects': {}})
+    try:
+        return sync_kind(snapshot, node, node_type, snapshot_namespace, entry)
+    except Exception as ex:
+        logger.info('\t\tERROR : error in watching %s : %s', node_type, ex)
+        state[key] = {'resourceVersion': None, 'objects': {}}
+        return None
+
+def sync_watch_kinds(snapshot, nodes, synced, state):
+    """
+    Sync the kinds and namespaces of the snapshot nodes before the nodes are read,
+    the kinds are watched by the `crawlworkers` workers at the same time.
+    """
+    workers = max(parseint(config_value('KUBERNETES', 'crawlworkers'), CRAWL_WORKERS), 1)
+    space_id = thread_space_id()
+    keys = {}
+    for node in nodes:
+        node_object_key = node_object(node) if 'snapshotId' in node and node.get('validate', True) else None
+        if node_object_key:
+            node_type, snapshot_namespace, _ = node_object_key
+            key = watch_key(node_type, snapshot_namespace)
+            if key not in synced and key not in keys:
+                state.setdefault(key, {'resourceVersion': None, 'objects': {}})
+                keys[key] = (node, node_type, snapshot_namespace)
+
+    def sync(node, node_type, snapshot_namespace):
+        set_thread_space_id(space_id)
+        return sync_watch_key(snapshot, node, node_type, snapshot_namespace, state)
+
+    if not keys:
+        return
+    with ThreadPoolExecutor(max_workers=min(workers, len(keys))) as executor:
+        futures = [(key, executor.submit(sync, *args)) for key, args in keys.items()]
+    for key, future in futures:
+        synced[key] = future.result()
+
+def get_kubernetes_watch_data(snapshot, node, synced, state):
+    """
+    Object of the node in the incremental mode, UNCHANGED if the object is the same
+    as in the snapshot saved by the previous run for this snapshotId.
+    """
+    node_object_key = node_object(node)
+    if not node_object_key:
+        return get_kubernetes_snapshot_data(snapshot, node)
+    node_type, snapshot_namespace, object_name = node_object_key
+    key = watch_key(node_type, snapshot_namespace)
+    if key not in synced:
+        synced[key] = sync_watch_key(snapshot, node, node_type, snapshot_namespace, state)
+    entry = state[key]
+    sync = synced[key]
+    saved = entry['objects'].get(object_name)
+    if sync and object_name in sync['changed']:
+        data = sync['changed'].pop(object_name)
+    elif sync and not sync['full'] and object_name not in sync['deleted'] and saved and \
+            saved.get('snapshotId') == node['snapshotId']:
+        return UNCHANGED
+    elif sync and object_name in sync['deleted']:
+        data = {}
+    else:
+        data = get_kubernetes_snapshot_data(snapshot, node)
+    if data and sync:
+        entry['objects'][object_name] = {
+            'resourceVersion': get_field_value(data, 'metadata.resourceVersion'),
+            'snapshotId': node['snapshotId']
+        }
+    return data
+
 def node_db_record(snapshot,node): 
     """
     node_db_record add additional fields to prepare the data for inserting 
@@ -276,188 +602,120 @@ def node_db_record(snapshot,node):
 
     return data
 
-def get_lits(snapshot,node):
-    node_type = get_field_value(node,'type')
-    master_snapshot_func = {
-        'pod' : get_list_namespaced_pods,
-        'networkpolicy' : get_list_namespaced_network_policy,
-        'podsecuritypolicy' : get_list_namespaced_pod_security_policy,
-        'role':get_list_namespaced_role,
-        'rolebinding' : get_list_namespaced_role_binding,
-        'clusterrole':get_list_cluster_role,
-        'clusterrolebinding' : get_list_cluster_role_binding,
-        'serviceaccount' : get_list_namespaced_service_account,
-    }
-    list_item=[]
-    try:
-         return master_snapshot_func[node_type](snapshot,node)
-
-    except Exception as ex :
-        logger.info('\t\tERROR : error in calling api for getting information %s ',node_type)
-        logger.info('\t\tERROR : %s',ex)
-        print(traceback.format_exc())
-
-    return list_item
-
-def get_list_namespaced_pods(snapshot,node):
+def all_namespaces_function(list_function):
+    """list_namespaced_pod => list_pod_for_all_namespaces"""
+    return 'list_%s_for_all_namespaces' % list_function[len('list_namespaced_'):]
 
-    snapshot_namespaces = get_field_value(snapshot,'namespace')
-    pod_items = []
-    api_instance = create_kube_apiserver_instance(snapshot,node)
-    for snapshot_namespace in snapshot_namespaces:
-        api_response = api_instance.list_namespaced_pod(namespace=snapshot_namespace)
-        api_response_dict = todict(api_response) 
-        api_response_dict_items = get_field_value(api_response_dict,'items')
-        for api_response_dict_item in api_response_dict_items :
-            pod_name = get_field_value(api_response_dict_item,'metadata.name')
-            pod_path = "api/v1/namespaces/%s/pods/%s" % (snapshot_namespace,pod_name)
-            pod_items.append({
-                'namespace': snapshot_namespace,
-                'paths':[
-                    pod_path
-                ]
-            })
-    return pod_items
-
-def get_list_namespaced_network_policy(snapshot,node):
-    snapshot_namespaces = get_field_value(snapshot,'namespace')
-    network_policy_items = []
-    api_instance = create_kube_apiserver_instance(snapshot,node)
-    for snapshot_namespace in snapshot_namespaces:
-        api_response = api_instance.list_namespaced_network_policy(namespace=snapshot_namespace)
-        api_response_dict = todict(api_response) 
-        api_response_dict_items = get_field_value(api_response_dict,'items')
-        for api_response_dict_item in api_response_dict_items :
-            network_policy_name = get_field_value(api_response_dict_item,'metadata.name')
-            network_policy_path = "apis/networking.k8s.io/v1/namespaces/%s/networkpolicies/%s" % (snapshot_namespace,network_policy_name)
-            network_policy_items.append({
-                'namespace': snapshot_namespace,
-                'paths':[
-                    network_policy_path
-                ]
-            })
-    return network_policy_items
-
-def get_list_namespaced_pod_security_policy(snapshot,node):
-    snapshot_namespaces = get_field_value(snapshot,'namespace')
-    pod_security_policy_items = []
-    api_instance = create_kube_apiserver_instance(snapshot,node)
-    for snapshot_namespace in snapshot_namespaces:
-        api_response = api_instance.list_pod_security_policy()
-        api_response_dict = todict(api_response) 
-        api_response_dict_items = get_field_value(api_response_dict,'items')
-        for api_response_dict_item in api_response_dict_items :
-            pod_security_policy_name = get_field_value(api_response_dict_item,'metadata.name')
-            pod_security_policy_path = "apis/policy/v1beta1/podsecuritypolicies/%s" % (pod_security_policy_name)
-            pod_security_policy_items.append({
-                'namespace': snapshot_namespace,
-                'paths':[
-                    pod_security_policy_path
-                ]
-            })
-    return pod_security_policy_items
-
-def get_list_namespaced_role(snapshot,node):
-    snapshot_namespaces = get_field_value(snapshot,'namespace')
-    role_items = []
-    api_instance = create_kube_apiserver_instance(snapshot,node)
-    for snapshot_namespace in snapshot_namespaces:
-        api_response = api_instance.list_namespaced_role(namespace=snapshot_namespace)
-        api_response_dict = todict(api_response) 
-        api_response_dict_items = get_field_value(api_response_dict,'items')
-        for api_response_dict_item in api_response_dict_items :
-            role_binding_name = get_field_value(api_response_dict_item,'metadata.name')
-            role_binding_path = "apis/rbac.authorization.k8s.io/v1beta1/namespaces/%s/roles/%s" % (snapshot_namespace,role_binding_name)
-            role_items.append({
-                'namespace': snapshot_namespace,
-                'paths':[
-                    role_binding_path
-                ]
-            })
-    return role_items
-
-
-def get_list_namespaced_role_binding(snapshot,node):
-    snapshot_namespaces = get_field_value(snapshot,'namespace')
-    role_binding_items = []
-    api_instance = create_kube_apiserver_instance(snapshot,node)
-    for snapshot_namespace in snapshot_namespaces:
-        api_response = api_instance.list_namespaced_role_binding(namespace=snapshot_namespace)
-        api_response_dict = todict(api_response) 
-        api_response_dict_items = get_field_value(api_response_dict,'items')
-        for api_response_dict_item in api_response_dict_items :
-            role_binding_name = get_field_value(api_response_dict_item,'metadata.name')
-            role_binding_path = "apis/rbac.authorization.k8s.io/v1beta1/namespaces/%s/rolebindings/%s" % (snapshot_namespace,role_binding_name)
-            role_binding_items.append({
-                'namespace': snapshot_namespace,
-                'paths':[
-                    role_binding_path
-                ]
-            })
-    return role_binding_items
-
-def get_list_cluster_role(snapshot,node):
-    snapshot_namespaces = get_field_value(snapshot,'namespace')
-    cluster_role_items = []
-    api_instance = create_kube_apiserver_instance(snapshot,node)
-    for snapshot_namespace in snapshot_namespaces:
-        api_response = api_instance.list_cluster_role()
-        api_response_dict = todict(api_response) 
-        api_response_dict_items = get_field_value(api_response_dict,'items')
-        for api_response_dict_item in api_response_dict_items :
-            cluster_role_name = get_field_value(api_response_dict_item,'metadata.name')
-            cluster_role_path = "apis/rbac.authorization.k8s.io/v1beta1/clusterroles/%s" % (cluster_role_name)
-            cluster_role_items.append({
-                'namespace': snapshot_namespace,
+def list_kind_names(snapshot, node, namespace=None, all_namespaces=False):
+    """
+    Names of the objects of the kind of the master node by namespace, the names of
+    a cluster kind are under the None namespace.
+    """
+    node_type = get_field_value(node, 'type')
+    list_function, _, namespace_index = KUBERNETES_KINDS[node_type]
+    api_instance = create_kube_apiserver_instance(snapshot, node)
+    kwargs = {}
+    if namespace_index is None:
+        namespace = None
+    elif all_namespaces:
+        list_function = all_namespaces_function(list_function)
+    else:
+        kwargs['namespace'] = namespace
+    names = {}
+    for item in list_kubernetes_items(api_instance, list_function, **kwargs):
+        item_namespace = get_field_value(item, 'metadata.namespace') if all_namespaces else namespace
+        names.setdefault(item_namespace, []).append(get_field_value(item, 'metadata.name'))
+    return names
+
+def crawl_items(node, namespaces, names):
+    """Items of the master node in the order of the namespaces of the snapshot."""
+    node_type = get_field_value(node, 'type')
+    namespaced = KUBERNETES_KINDS[node_type][2] is not None
+    items = []
+    for namespace in namespaces:
+        for name in names.get(namespace if namespaced else None, []):
+            path = CRAWL_PATHS[node_type] % ((namespace, name) if namespaced else (name, ))
+            items.append({
+                'namespace': namespace,
                 'paths':[
-                    cluster_role_path
+                    path
                 ]
             })
-    return cluster_role_items
+    return items
 
-def get_list_cluster_role_binding(snapshot,node):
-    snapshot_namespaces = get_field_value(snapshot,'namespace')
-    cluster_role_binding_items = []
-    api_instance = create_kube_apiserver_instance(snapshot,node)
-    for snapshot_namespace in snapshot_namespaces:
-        api_response = api_instance.list_cluster_role()
-        api_response_dict = todict(api_response) 
-        api_response_dict_items = get_field_value(api_response_dict,'items')
-        for api_response_dict_item in api_response_dict_items :
-            cluster_role_binding_name = get_field_value(api_response_dict_item,'metadata.name')
-            cluster_role_binding_path = "apis/rbac.authorization.k8s.io/v1beta1/clusterrolebindings/%s" % (cluster_role_binding_name)
-            cluster_role_binding_items.append({
-                'namespace': snapshot_namespace,
-                'paths':[
-                    cluster_role_binding_path
-                ]
-            })
-    return cluster_role_binding_items
+def crawl_master_nodes(snapshot, master_nodes):
+    """
+    Crawl plan of the master nodes, returns the items of every master node.
+    The cluster kinds are listed once and the namespaced kinds are listed for all
+    the namespaces at once when the service account is allowed to, else every
+    (namespace, kind) pair is listed by the `crawlworkers` workers. The items are
+    in the order of the namespaces, so the snapshot ids do not depend on the
+    order the lists complete.
+    """
+    namespaces = get_field_value(snapshot, 'namespace') or []
+    workers = max(parseint(config_value('KUBERNETES', 'crawlworkers'), CRAWL_WORKERS), 1)
+    use_all_namespaces = parsebool(config_value('KUBERNETES', 'allnamespaces'), True)
+    space_id = thread_space_id()
+    names = [{} for _ in master_nodes]
+    failed = set()
+
+    def list_names(index, namespace=None, all_namespaces=False):
+        set_thread_space_id(space_id)
+        try:
+            return list_kind_names(snapshot, master_nodes[index], namespace, all_namespaces)
+        except ApiException as ex:
+            if all_namespaces:
+                logger.info('\t\tListing %s for all namespaces failed (%s), listing every namespace.',
+                            get_field_value(master_nodes[index], 'type'), ex.status)
+                ALL_NAMESPACES_DENIED.add(all_namespaces_key(snapshot, master_nodes[index]))
+                return None
+            raise ex
+
+    def add_names(index, future):
+        try:
+            result = future.result()
+        except Exception as ex:
+            logger.info('\t\tERROR : error in calling api for getting information %s ', get_field_value(master_nodes[index], 'type'))
+            logger.info('\t\tERROR : %s', ex)
+            failed.add(index)
+            return False
+        if result is None:
+            return False
+        names[index].update(result)
+        return True
+
+    crawled = [index for index, node in enumerate(master_nodes)
+               if get_field_value(node, 'type') in CRAWL_PATHS and namespaces]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        first = []
+        for index in crawled:
+            node = master_nodes[index]
+            namespaced = KUBERNETES_KINDS[get_field_value(node, 'type')][2] is not None
+            if not namespaced:
+                first.append((index, executor.submit(list_names, index)))
+            elif use_all_namespaces and len(namespaces) > 1 and \
+                    all_namespaces_key(snapshot, node) not in ALL_NAMESPACES_DENIED:
+                first.append((index, executor.submit(list_names, index, None, True)))
+        listed = set(index for index, future in first if add_names(index, future))
+        pairs = [(index, namespace, executor.submit(list_names, index, namespace))
+                 for index in crawled if index not in listed and index not in failed
+                 for namespace in namespaces]
+        for index, namespace, future in pairs:
+            add_names(index, future)
+    return [crawl_items(node, namespaces, names[index]) if index in crawled and index not in failed else []
+            for index, node in enumerate(master_nodes)]
+
+def all_namespaces_key(snapshot, node):
+    return (get_field_value(snapshot, 'source'), get_field_value(snapshot, 'serviceAccount'), get_field_value(node, 'type'))
 
-def get_list_namespaced_service_account(snapshot,node):
-    snapshot_namespaces = get_field_value(snapshot,'namespace')
-    service_account_items = []
-    api_instance = create_kube_apiserver_instance(snapshot,node)
-    for snapshot_namespace in snapshot_namespaces:
-        api_response = api_instance.list_namespaced_service_account(namespace=snapshot_namespace)
-        api_response_dict = todict(api_response) 
-        api_response_dict_items = get_field_value(api_response_dict,'items')
-        for api_response_dict_item in api_response_dict_items :
-            service_account_name = get_field_value(api_response_dict_item,'metadata.name')
-            service_account_path = "api/v1/namespaces/%s/serviceaccounts/%s" % (snapshot_namespace,service_account_name)
-            service_account_items.append({
-                'namespace': snapshot_namespace,
-                'paths':[
-                    service_account_path
-                ]
-            })
-    return service_account_items
+def get_lits(snapshot,node):
+    return crawl_master_nodes(snapshot, [node])[0]
 
-def generate_crawler_snapshot(snapshot,node,snapshot_data):
+def generate_crawler_snapshot(snapshot,node,snapshot_data,resource_items=None):
     node_type= get_field_value(node,'type')
     node_type = get_field_value_with_default(node, 'type',"")
-    resource_items = []
-    resource_items=get_lits(snapshot=snapshot,node=node)
+    if resource_items is None:
+        resource_items=get_lits(snapshot=snapshot,node=node)
 
     includeSnapshotConfig = get_from_currentdata("INCLUDESNAPSHOTS")
     includeSnapshots = get_from_currentdata("SNAPHSHOTIDS")
@@ -509,14 +767,29 @@ def populate_kubernetes_snapshot(snapshot, container=None):
     dbname = config_value('MONGODB', 'dbname')
     if valid_snapshotids  and snapshot_nodes:
         logger.debug(valid_snapshotids)
+        snapshot_mode = kubernetes_snapshot_mode()
+        listed_items = {}
+        watch_state = load_watch_state(snapshot, container) if snapshot_mode == 'watch' else None
         try :
+            if watch_state is not None:
+                sync_watch_kinds(snapshot, snapshot_nodes, listed_items, watch_state)
+            master_nodes = [node for node in snapshot_nodes if 'snapshotId' not in node and 'masterSnapshotId' in node]
+            crawled_items = iter(crawl_master_nodes(snapshot, master_nodes))
             for node in snapshot_nodes:
                 validate = node['validate'] if 'validate' in node else True
                 logger.info(node)
                 if 'snapshotId' in node:
                     if validate:
-                        kubernetes_snapshot_data = get_kubernetes_snapshot_data(snapshot,node) 
-                        if kubernetes_snapshot_data :
+                        if snapshot_mode == 'watch':
+                            kubernetes_snapshot_data = get_kubernetes_watch_data(snapshot, node, listed_items, watch_state)
+                        elif snapshot_mode == 'list':
+                            kubernetes_snapshot_data = get_kubernetes_list_data(snapshot, node, listed_items)
+                        else:
+                            kubernetes_snapshot_data = get_kubernetes_snapshot_data(snapshot,node) 
+                        if kubernetes_snapshot_data is UNCHANGED:
+                            # The snapshot saved by the previous run is still current
+                            snapshot_data[node['snapshotId']] = node['masterSnapshotId'] if "masterSnapshotId" in node else True
+                        elif kubernetes_snapshot_data :
                             error_str = kubernetes_snapshot_data.pop('error', None)
                             kubernetes_snapshot_template = make_kubernetes_snapshot_template(
                                 snapshot,
@@ -555,7 +828,9 @@ def populate_kubernetes_snapshot(snapshot, container=None):
                         else:
                             node['status'] = 'inactive'
                 elif 'masterSnapshotId' in node:
-                    snapshot_data = generate_crawler_snapshot(snapshot,node,snapshot_data)
+                    snapshot_data = generate_crawler_snapshot(snapshot,node,snapshot_data,next(crawled_items))
+            if watch_state is not None:
+                save_watch_state(snapshot, container, watch_state)
                 
 
 
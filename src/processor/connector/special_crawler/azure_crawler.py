@@ -1,6 +1,7 @@
 from processor.helper.config.rundata_utils import get_from_currentdata, put_in_currentdata
 from processor.connector.special_crawler.base_crawler import BaseCrawler
 from processor.helper.httpapi.http_utils import http_get_request
+from processor.helper.httpapi.fetch_engine import fetch_all
 from processor.helper.httpapi.restapi_azure import get_access_token, GRAPH_TOKEN
 
 class AzureCrawler(BaseCrawler):
@@ -47,15 +48,30 @@ class AzureCrawler(BaseCrawler):
                 self.version = self.apiversions[resource_type]['version']
         return self.version
     
+    def add_resources(self, status, data):
+        if status and isinstance(status, int) and status == 200:
+            for resource in data.get("value", []):
+                put_in_currentdata('resources', resource)
+            self.resources += data.get("value", [])
+
     def call_azure_api(self, url):
         hdrs = {
             'Authorization': 'Bearer %s' % self.token
         }
         status, data = http_get_request(url, hdrs, name='\tRESOURCE:')
-        if status and isinstance(status, int) and status == 200:
-            for resource in data.get("value", []):
-                put_in_currentdata('resources', resource)
-            self.resources += data.get("value", [])
+        self.add_resources(status, data)
+
+    def call_azure_apis(self, urls):
+        """
+        Fetch the urls concurrently through the fetch engine, the resources are
+        added in the order of the urls.
+        """
+        hdrs = {
+            'Authorization': 'Bearer %s' % self.token
+        }
+        results = fetch_all([(url, hdrs) for url in urls], fetch=http_get_request, name='\tRESOURCE:')
+        for status, data in results:
+            self.add_resources(status, data)
             
     def crawl_child_resources(self, child_resource_type):
         """
@@ -67,10 +83,9 @@ class AzureCrawler(BaseCrawler):
             child_resource = "/".join(child_resource_type_list[2:])
             main_resource = "/".join(child_resource_type_list[:2])
             if version:
-                for resource in self.resources:
-                    if resource.get("type") == main_resource:
-                        url = 'https://management.azure.com%s/%s?api-version=%s' % (resource.get("id"), child_resource, version)
-                        self.call_azure_api(url)
+                urls = ['https://management.azure.com%s/%s?api-version=%s' % (resource.get("id"), child_resource, version)
+                        for resource in self.resources if resource.get("type") == main_resource]
+                self.call_azure_apis(urls)
         return self.resources
     
     def crawl_role_definitions(self, resource_type):
@@ -99,17 +114,9 @@ class AzureCrawler(BaseCrawler):
         """        
         version = self.get_version_of_resource_type(resource_type)
         if version:
-            for resource in self.resources:
-                if resource['type'] == "Microsoft.Storage/storageAccounts":
-                    hdrs = {
-                        'Authorization': 'Bearer %s' % self.token
-                    }
-                    url = 'https://management.azure.com%s/blobServices/default/containers?api-version=%s' % (resource['id'], version)
-                    status, data = http_get_request(url, hdrs, name='\tRESOURCE:')
-                    if status and isinstance(status, int) and status == 200:
-                        for resource in data.get("value", []):
-                            put_in_currentdata('resources', resource)
-                        self.resources += data.get("value", [])
+            urls = ['https://management.azure.com%s/blobServices/default/containers?api-version=%s' % (resource['id'], version)
+                    for resource in self.resources if resource['type'] == "Microsoft.Storage/storageAccounts"]
+            self.call_azure_apis(urls)
 
     def crawl_user_registration_details(self, resource_type):
         """
@@ -8,21 +8,63 @@ from time import time
 import pymongo
 import copy 
 
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from processor.logging.log_handler import getlogger
-from processor.comparison.interpreter import Comparator
+from processor.comparison.interpreter import Comparator, RegoBatch
+from processor.comparison.opa_server import reset_opa_server
+from processor.comparison.rule_cache import refresh_container_rules
+from processor.comparison.snapshot_cache import open_snapshot_cache, close_snapshot_cache
 from processor.helper.json.json_utils import get_field_value, get_json_files,\
     json_from_file, TEST, collectiontypes, SNAPSHOT, JSONTEST, MASTERTEST, get_field_value_with_default
 from processor.helper.config.config_utils import config_value, get_test_json_dir,\
-    DATABASE, DBNAME, framework_dir, EXCLUSION
+    DATABASE, DBNAME, TESTS, framework_dir, EXCLUSION, parseint, thread_space_id, set_thread_space_id
 from processor.database.database import create_indexes, COLLECTION,\
-    sort_field, get_documents
+    sort_field, get_documents, clean_mongo_client
 from processor.reporting.json_output import dump_output_results, update_output_testname
-from processor.helper.config.rundata_utils import get_dbtests, get_from_currentdata
+from processor.helper.config.rundata_utils import get_dbtests, get_from_currentdata, checkpoint_currentdata
 from processor.connector.populate_json import pull_json_data
 from processor.connector.special_compliance.compliances import COMPLIANCES
 
 logger = getlogger()
+WORKERS = 'workers'
+WORKERTYPE = 'workertype'
+THREAD_WORKER = 'thread'
+PROCESS_WORKER = 'process'
+
+
+def validation_workers():
+    """
+    Number and type of the workers running the testcases, from the --workers command
+    line option or the TESTS section of the config.ini, 1 runs the testcases serially.
+    """
+    workers = get_from_currentdata(WORKERS)
+    if not workers:
+        workers = config_value(TESTS, WORKERS)
+    workers = max(parseint(workers, 1), 1)
+    workertype = get_from_currentdata(WORKERTYPE)
+    if not workertype:
+        workertype = config_value(TESTS, WORKERTYPE, default=THREAD_WORKER)
+    workertype = PROCESS_WORKER if str(workertype).lower() == PROCESS_WORKER else THREAD_WORKER
+    return workers, workertype
+
+
+def _init_validation_worker(space_id):
+    """
+    The worker process should not share the mongo client and the OPA server
+    connection of the parent process.
+    """
+    clean_mongo_client()
+    reset_opa_server()
+    set_thread_space_id(space_id)
+
+
+def _run_worker_validation_test(space_id, *args):
+    """The config space of the run is per thread, so set it for the worker thread."""
+    if space_id and thread_space_id() != space_id:
+        set_thread_space_id(space_id)
+    return run_validation_test(*args)
+
 
 def get_snapshot_file(snapshot_file, container, dbname, filesystem):
     snapshot_json_data = {}
@@ -70,8 +112,9 @@ def get_snapshot_id_to_collection_dict(snapshot_file, container, dbname, filesys
     return snapshot_data
 
 
-def run_validation_test(version, container, dbname, collection_data, testcase, excludedTestIds, includeTests):
-    comparator = Comparator(version, container, dbname, collection_data, testcase, excludedTestIds, includeTests)
+def run_validation_test(version, container, dbname, collection_data, testcase, excludedTestIds, includeTests, comparator=None):
+    if not comparator:
+        comparator = Comparator(version, container, dbname, collection_data, testcase, excludedTestIds, includeTests)
     results = comparator.validate()
     if isinstance(results, list):
         for result in results:
@@ -157,6 +200,9 @@ def run_json_validation_tests(test_json_data, container, filesystem=True, snapsh
         logger.info("Test json does not contain testset, next!...")
         return resultset
     dbname = config_value(DATABASE, DBNAME)
+    if get_dbtests():
+        # Rule files of the container are reloaded only if the structures document changed.
+        refresh_container_rules(dbname, container)
     # Populate the snapshotId => collection for the snapshot.json in the test file.
     collection_data = get_snapshot_id_to_collection_dict(test_json_data['snapshot'],
                                                          container, dbname, filesystem)
@@ -187,39 +233,126 @@ def run_json_validation_tests(test_json_data, container, filesystem=True, snapsh
                     else:
                         excludedTestIds[exclusion['masterTestID']].extend(exclusion['paths'])
 
+    workers, workertype = validation_workers()
     skip = 0
     limit = 10
     dumpsize = 10
-    for testset in testsets:
-        version = get_field_value(testset, 'version')
-        testcases = get_field_value(testset, 'cases')
-        if not testcases or not isinstance(testcases, list):
-            logger.info("No testcases in testSet!...")
-            continue
-        for testcase in testset['cases']:
-            if "status" in testcase and testcase["status"] == "disable":
+    snapshots = testset_snapshots(testsets, collection_data) if get_dbtests() else None
+    open_snapshot_cache(dbname, snapshots)
+    try:
+        for testset in testsets:
+            version = get_field_value(testset, 'version')
+            testcases = get_field_value(testset, 'cases')
+            if not testcases or not isinstance(testcases, list):
+                logger.info("No testcases in testSet!...")
                 continue
+            enabled_testcases = []
+            for testcase in testset['cases']:
+                if "status" in testcase and testcase["status"] == "disable":
+                    continue
+                else:
+                    testcase["status"] = "enable"
+                if dirpath:
+                    testcase['dirpath'] = dirpath
+                enabled_testcases.append(testcase)
+            comparators = [Comparator(version, container, dbname, collection_data, testcase, excludedTestIds, includeTests)
+                           for testcase in enabled_testcases]
+            rego_batch = RegoBatch(comparators)
+            if workers > 1 and len(enabled_testcases) > 1:
+                testresults = run_parallel_validation_tests(version, container, dbname, collection_data,
+                                                            enabled_testcases, excludedTestIds, includeTests,
+                                                            comparators, rego_batch, workers, workertype)
             else:
-                testcase["status"] = "enable"
-            if dirpath:
-                testcase['dirpath'] = dirpath
-            results = run_validation_test(version, container, dbname, collection_data,
-                                             testcase, excludedTestIds, includeTests)
-            resultset.extend(results)
-            if not filesystem:
-                if len(resultset) >= limit:
-                    dump_output_results(resultset[skip:limit], container, test_file="", snapshot="", filesystem=False)
-                    skip = limit
-                    limit = skip + dumpsize
+                testresults = run_serial_validation_tests(version, container, dbname, collection_data,
+                                                          enabled_testcases, excludedTestIds, includeTests,
+                                                          comparators, rego_batch)
+            for results in testresults:
+                resultset.extend(results)
+                if not filesystem:
+                    if len(resultset) >= limit:
+                        dump_output_results(resultset[skip:limit], container, test_file="", snapshot="", filesystem=False)
+                        skip = limit
+                        limit = skip + dumpsize
         
-        if not filesystem and len(resultset) >= (skip+1):
-            dump_output_results(resultset[skip:], container, test_file="", snapshot="", filesystem=False)
-            skip = len(resultset)
-            limit = skip + dumpsize
+            if not filesystem and len(resultset) >= (skip+1):
+                dump_output_results(resultset[skip:], container, test_file="", snapshot="", filesystem=False)
+                skip = len(resultset)
+                limit = skip + dumpsize
         
+    finally:
+        close_snapshot_cache()
     return resultset
 
 
+def testset_snapshots(testsets, collection_data):
+    """The snapshot ids referenced by the enabled testcases, grouped by their collection."""
+    snapshots = defaultdict(set)
+    for testset in testsets:
+        testcases = get_field_value(testset, 'cases')
+        if not testcases or not isinstance(testcases, list):
+            continue
+        for testcase in testcases:
+            if not isinstance(testcase, dict) or testcase.get("status") == "disable":
+                continue
+            sids = testcase.get('snapshotId')
+            sids = list(sids) if isinstance(sids, list) else [sids] if sids else []
+            rule = testcase.get('rule')
+            if isinstance(rule, str) and testcase.get('type') not in ['rego', 'python']:
+                sids.extend(re.findall(r'\{([a-zA-Z0-9_-]+)\}', rule))
+            for sid in sids:
+                if isinstance(sid, str):
+                    coll = collection_data[sid] if sid in collection_data else COLLECTION
+                    snapshots[coll].add(sid)
+    return snapshots
+
+
+def run_serial_validation_tests(version, container, dbname, collection_data, testcases,
+                                excludedTestIds, includeTests, comparators, rego_batch):
+    """Run the testcases one after the other, yields the results of each testcase."""
+    for index, testcase in enumerate(testcases):
+        rego_batch.prepare(index)
+        results = run_validation_test(version, container, dbname, collection_data,
+                                      testcase, excludedTestIds, includeTests, comparators[index])
+        comparators[index] = None
+        yield results
+
+
+def run_parallel_validation_tests(version, container, dbname, collection_data, testcases, excludedTestIds,
+                                  includeTests, comparators, rego_batch, workers, workertype=THREAD_WORKER):
+    """
+    Run the testcases concurrently in a pool of threads or processes. The results are
+    yielded in the order of the testcases, only a window of testcases is queued
+    ahead of the one being yielded to keep the memory bounded.
+    """
+    space_id = thread_space_id()
+    if workertype == PROCESS_WORKER:
+        # The worker processes load the run data from the rundata file.
+        checkpoint_currentdata()
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_validation_worker,
+                                       initargs=(space_id,))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    window = workers * 2
+    pending = deque()
+    try:
+        for index, testcase in enumerate(testcases):
+            rego_batch.prepare(index)
+            pending.append(executor.submit(_run_worker_validation_test, space_id, version, container,
+                                           dbname, collection_data, testcase, excludedTestIds,
+                                           includeTests, comparators[index]))
+            comparators[index] = None
+            while len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        if workertype == PROCESS_WORKER:
+            checkpoint_currentdata()
+
+
 def run_container_validation_tests(container, dbsystem=True, snapshot_status=None):
     if not snapshot_status:
         snapshot_status = {}
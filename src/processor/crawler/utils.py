@@ -6,6 +6,7 @@ from processor.helper.file.file_utils import exists_file
 from processor.database.database import DATABASE, DBNAME, sort_field, get_documents, find_and_update_document
 from processor.logging.log_handler import getlogger
 from processor.helper.httpapi.http_utils import http_get_request, http_post_request
+from processor.helper.httpapi.restapi_google import get_google_access_token
 from processor.connector.vault import get_vault_data, set_vault_data
 from processor.connector.snapshot_azure import populate_client_secret
 from oauth2client.service_account import ServiceAccountCredentials
@@ -188,7 +189,7 @@ def access_token_from_service_account(private_key_id, private_key, client_email,
         credentials = ServiceAccountCredentials.from_json_keyfile_name(credential_path, scopes)
         if not credentials:
             return access_token
-        return credentials.get_access_token().access_token
+        return get_google_access_token(credentials)
     except:
         return access_token
 
@@ -194,6 +194,16 @@ def get_documents(collection, query=None, dbname=None, sort=None, limit=10, skip
     return docs
 
 
+def aggregate_documents(collection, pipeline, dbname=None):
+    """ Run the aggregation pipeline on the collection """
+    docs = None
+    db = mongodb(dbname)
+    collection = db[collection] if db is not None and collection else None
+    if collection is not None:
+        docs = [result for result in collection.aggregate(pipeline, allowDiskUse=True)]
+    return docs
+
+
 def count_documents(collection, query=None, dbname=None):
     """ Count the documents based on the query """
     count = None
@@ -30,6 +30,8 @@ CRAWL = "CRAWL"
 COMPLIANCE = "COMPLIANCE"
 RUN_TYPE = [CRAWL_AND_COMPLIANCE, CRAWL, COMPLIANCE]
 CACHEDATA = None
+CONFIG_VALUES = {}
+CONFIG_LOCK = threading.Lock()
 
 def generateid(name):
     pwdSize = 5
@@ -84,6 +86,17 @@ def get_cache_data():
 def set_cache_data(ctxdata):
     CACHEDATA = ctxdata
 
+def thread_space_id():
+    """The customer space id of the current thread."""
+    return os.getenv(str(threading.currentThread().ident) + "_SPACE_ID", None)
+
+
+def set_thread_space_id(space_id):
+    """Set the customer space id for the current thread, used by the worker threads."""
+    if space_id:
+        os.environ[str(threading.currentThread().ident) + "_SPACE_ID"] = space_id
+
+
 def framework_currentdata():
     """Return the framework current data."""
     space_id = os.getenv(str(threading.currentThread().ident) + "_SPACE_ID", None)
@@ -148,13 +161,43 @@ def get_config_data(config_file):
     return config_data
 
 
+def get_config_values(config_file):
+    """
+    Parsed sections of the config file as dicts of the lowercase key => value. The
+    file is parsed again only when its modification time or size changes.
+    """
+    try:
+        stat = os.stat(config_file)
+    except (OSError, TypeError, ValueError):
+        return None
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = CONFIG_VALUES.get(config_file)
+    if cached and cached[0] == version:
+        return cached[1]
+    config_values = None
+    config_data = get_config_data(config_file)
+    if config_data:
+        config_values = {}
+        for section in config_data:
+            values = {}
+            for key in config_data[section]:
+                try:
+                    values[key] = config_data.get(section, key)
+                except configparser.Error:
+                    values[key] = config_data.get(section, key, raw=True)
+            config_values[section] = values
+    with CONFIG_LOCK:
+        CONFIG_VALUES[config_file] = (version, config_values)
+    return config_values
+
+
 def config_value(section, key, configfile=None, default=None):
     """Get value for the key from the given config section"""
     if not configfile:
         configfile = framework_config()
-    config_data = get_config_data(configfile)
-    if config_data and section in config_data:
-        return config_data.get(section, key, fallback=default)
+    config_values = get_config_values(configfile)
+    if config_values and section in config_values:
+        return config_values[section].get(key.lower(), default)
     return default
 
 
@@ -1,24 +1,177 @@
 """
 Run time data storage and retrieval.
+The run data is kept in memory in a RunContext per rundata file and written to
+the rundata file only at the checkpoints, for the diagnostics of a crashed run,
+and at the exit of the run.
 """
+import atexit
+import copy
 import time
 import datetime
 import json
 import socket
 import os.path
 import shutil
+import threading
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 from processor.helper.config.config_utils import config_value, framework_currentdata, get_cache_data, \
-    set_cache_data, TESTS, DBTESTS, DBVALUES, SNAPSHOT
+    set_cache_data, parseint, TESTS, DBTESTS, DBVALUES, SNAPSHOT
 from processor.helper.json.json_utils import json_from_file, save_json_to_file
 from processor.logging.log_handler import getlogger, FWLOGFILENAME
 from processor.helper.file.file_utils import remove_file, exists_dir, mkdir_path
 
 exclude_list = ['token', 'clientSecret', 'vaulttoken', 'exclusion', 'apitoken', 'gittoken', 'outputpath']
+CHECKPOINT_INTERVAL = 30
+RUN_CONTEXTS = {}
+RUN_CONTEXTS_LOCK = threading.Lock()
+
+
+class RunContext:
+    """
+    Run data of a rundata file held in memory. The changes are written to the file at
+    the checkpoints, every `rundatacheckpoint` seconds of the LOGGING section of the
+    config.ini (0 writes it only at the exit). The checkpoint merges the changed keys
+    in the file under a file lock, so the worker processes forked during the run write
+    their changes through the file and the run picks them up at its next checkpoint.
+    """
+
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.pid = os.getpid()
+        self.lock = threading.RLock()
+        self.data = json_from_file(path) or {}
+        self.changed = set()
+        self.replaced = False
+        self.writethrough = False
+        self.saved = time.time()
+
+    def _check_process(self):
+        """A forked process reloads the run data and writes its changes through the file."""
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.lock = threading.RLock()
+            self.writethrough = True
+            self.data = json_from_file(self.path) or {}
+            self.changed = set()
+            self.replaced = False
+
+    def has(self, key):
+        self._check_process()
+        return key in self.data
+
+    def get(self, key, default=None):
+        """A copy of the value, so the callers changing it do not change the run data."""
+        self._check_process()
+        with self.lock:
+            return copy.deepcopy(self.data.get(key, default))
+
+    def put(self, key, value):
+        """Set the value of the key, a value is appended if the key has a list value."""
+        self._check_process()
+        with self.lock:
+            val = self.data.get(key)
+            value = copy.deepcopy(value)
+            if isinstance(val, list):
+                val.append(value)
+            else:
+                self.data[key] = value
+            self.changed.add(key)
+        self.write_behind()
+
+    def delete(self, key):
+        self._check_process()
+        with self.lock:
+            if key in self.data:
+                del self.data[key]
+                self.changed.add(key)
+        self.write_behind()
+
+    def replace(self, data):
+        self._check_process()
+        with self.lock:
+            self.data = data
+            self.changed = set()
+            self.replaced = True
+        self.write_behind()
+
+    def copy(self):
+        self._check_process()
+        with self.lock:
+            return copy.deepcopy(self.data)
+
+    def write_behind(self):
+        if self.writethrough or (self.interval > 0 and time.time() - self.saved >= self.interval):
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Merge the changed keys in the rundata file."""
+        self._check_process()
+        with self.lock:
+            lockfile = None
+            try:
+                run_dir = os.path.dirname(self.path)
+                if run_dir and not exists_dir(run_dir):
+                    mkdir_path(run_dir)
+                if fcntl:
+                    lockfile = open(self.path, 'a')
+                    fcntl.flock(lockfile, fcntl.LOCK_EX)
+                if self.replaced:
+                    data = self.data
+                else:
+                    data = json_from_file(self.path) or {}
+                    for key in self.changed:
+                        if key in self.data:
+                            data[key] = self.data[key]
+                        else:
+                            data.pop(key, None)
+                save_json_to_file(data, self.path)
+                self.data = data
+                self.changed = set()
+                self.replaced = False
+                self.saved = time.time()
+            except OSError as ex:
+                getlogger().debug('Failed to save the rundata %s: %s', self.path, ex)
+            finally:
+                if lockfile:
+                    lockfile.close()
+
+
+def get_runcontext(path=None):
+    """The run context of the rundata file of the current run."""
+    path = path if path else framework_currentdata()
+    runctx = RUN_CONTEXTS.get(path)
+    if runctx is None:
+        with RUN_CONTEXTS_LOCK:
+            runctx = RUN_CONTEXTS.get(path)
+            if runctx is None:
+                interval = parseint(config_value('LOGGING', 'rundatacheckpoint'), CHECKPOINT_INTERVAL)
+                runctx = RunContext(path, interval)
+                RUN_CONTEXTS[path] = runctx
+    return runctx
+
+
+def checkpoint_currentdata():
+    """Write the run data of the current run to the rundata file."""
+    get_runcontext().checkpoint()
+
+
+def checkpoint_all_currentdata():
+    for runctx in list(RUN_CONTEXTS.values()):
+        if runctx.pid == os.getpid():
+            runctx.checkpoint()
+
+
+atexit.register(checkpoint_all_currentdata)
+
 
 def get_dbtests():
-    currdata = get_currentdata()
-    if DBTESTS in currdata:
-        dbtests = currdata[DBTESTS]
+    runctx = get_runcontext()
+    if runctx.has(DBTESTS):
+        dbtests = runctx.get(DBTESTS)
     else:
         nodb = config_value(TESTS, DBTESTS)
         if nodb and nodb.upper() in DBVALUES:
@@ -51,47 +204,31 @@ def init_currentdata():
         'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     }
     save_currentdata(run_data)
+    checkpoint_currentdata()
 
 
 def put_in_currentdata(key, value):
     """Adds a value in the current run data"""
     if key:
-        curr_data = get_currentdata()
-        if key in curr_data:
-            val = curr_data[key]
-            if isinstance(val, list):
-                val.append(value)
-            else:
-                curr_data[key] = value
-        else:
-            curr_data[key] = value
-        save_currentdata(curr_data)
+        get_runcontext().put(key, value)
 
 def delete_from_currentdata(key):
     """Remove a key from the current run data"""
     if key:
-        currdata = get_currentdata()
-        if key in currdata:
-            del currdata[key]
-        save_currentdata(currdata)
+        get_runcontext().delete(key)
 
 
 def get_from_currentdata(key):
     """ Get the data for this key from the rundata"""
     data = None
-    currdata = get_currentdata()
-    if key and key in currdata:
-        data = currdata[key]
+    if key:
+        data = get_runcontext().get(key)
     return data
 
 
 def get_currentdata():
-    """Get the current run data, if present else empty json object"""
-    runctx = framework_currentdata()
-    curr_data = json_from_file(runctx)
-    if not curr_data:
-        curr_data = {}
-    return curr_data
+    """Get a copy of the current run data, if present else empty json object"""
+    return get_runcontext().copy()
 
 def put_in_cachedata(key, value):
     """Adds a value in the cache data"""
@@ -120,8 +257,7 @@ def save_currentdata(curr_data):
     """Save the key value rundata for further access, if None store it empty."""
     if not curr_data:
         curr_data = {}
-    runctx = framework_currentdata()
-    save_json_to_file(curr_data, runctx)
+    get_runcontext().replace(curr_data)
 
 
 def delete_currentdata():
@@ -158,6 +294,8 @@ def delete_currentdata():
         logger.info("Uploading data....")
         upload_compliance_results(runctx['container'], runctx['outputpath'], runctx['env'], runctx['company'], runctx['apitoken'])
     run_file = framework_currentdata()
+    with RUN_CONTEXTS_LOCK:
+        RUN_CONTEXTS.pop(run_file, None)
     remove_file(run_file)
 
 
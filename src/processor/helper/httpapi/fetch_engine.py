@@ -0,0 +1,48 @@
+"""
+Fan-out engine of the REST connectors. A batch of requests is run by a pool of at
+most `fetchconcurrency` threads, the requests are sent by the keep-alive pool of
+http_utils. The results are returned in the order of the batch, so the connectors
+keep their synchronous populate functions.
+"""
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from processor.helper.config.config_utils import config_value, parseint, thread_space_id, set_thread_space_id
+from processor.helper.httpapi.http_utils import http_get_request
+from processor.logging.log_handler import getlogger
+
+logger = getlogger()
+FETCH_CONCURRENCY = 16
+
+
+def fetch_concurrency():
+    return max(parseint(config_value('HTTP', 'fetchconcurrency'), FETCH_CONCURRENCY), 1)
+
+
+def run_all(calls, concurrency=None):
+    """
+    Run the calls concurrently, at most `concurrency` at a time, and return their
+    results in their order. The exception of a failed call is raised to the caller.
+    """
+    if not calls:
+        return []
+    concurrency = concurrency or fetch_concurrency()
+    space_id = thread_space_id()
+
+    def run(call):
+        set_thread_space_id(space_id)
+        return call()
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(calls))) as executor:
+        return list(executor.map(run, calls))
+
+
+def fetch_all(requests, fetch=None, name='HTTP GET', concurrency=None):
+    """
+    GET the (url, headers) requests of the batch concurrently, returns the
+    (status, data) of each request in the order of the batch. The connectors
+    pass their own http_get_request as `fetch`.
+    """
+    fetch = fetch or http_get_request
+    logger.debug('Fetching %d urls', len(requests))
+    return run_all([functools.partial(fetch, url, headers, name=name) for url, headers in requests],
+                   concurrency)
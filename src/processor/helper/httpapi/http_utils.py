@@ -1,19 +1,86 @@
 """
-   http utils using urllib default packaged with python3.
+   http utils, the requests are sent by a urllib3 pool of keep-alive connections
+   shared by the run, so the connections to a host are opened once.
 """
 import json
 import copy
+import os
+import threading
 from urllib import request, parse
-from urllib.error import HTTPError, URLError
+import urllib3
+from urllib3.exceptions import HTTPError
 from processor.helper.json.json_utils import json_from_string
 from processor.logging.log_handler import getlogger
 from processor.helper.config.rundata_utils import put_in_currentdata
+from processor.helper.config.config_utils import config_value, parseint
+from processor.helper.httpapi.rate_limiter import url_rate_limiter, rate_limited_call
 
 logger = getlogger()
 hdrs = {
     "Cache-Control": "no-cache",
     "Accept": "application/json"
 }
+POOLS = 20
+POOL_SIZE = 10
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 120
+RETRIES = 3
+RETRY_STATUS = [500, 502, 503, 504]
+HTTP_POOLS = {}
+HTTP_POOL_PID = None
+HTTP_POOL_LOCK = threading.Lock()
+
+
+def url_proxy(url):
+    """Proxy of the url from the HTTP_PROXY/HTTPS_PROXY variables, None when NO_PROXY bypasses it."""
+    parts = parse.urlsplit(url)
+    proxy = request.getproxies().get(parts.scheme)
+    if not proxy or not parts.hostname or request.proxy_bypass(parts.hostname):
+        return None
+    return proxy
+
+
+def proxy_manager(proxy, **kwargs):
+    """Pool manager tunnelling through the proxy, the credentials of the proxy url are sent as basic auth."""
+    parts = parse.urlsplit(proxy if '://' in proxy else 'http://%s' % proxy)
+    proxy_headers = None
+    if parts.username:
+        proxy_headers = urllib3.make_headers(proxy_basic_auth='%s:%s' % (parse.unquote(parts.username),
+                                                                          parse.unquote(parts.password or '')))
+    return urllib3.ProxyManager('%s://%s' % (parts.scheme, parts.netloc.rpartition('@')[2]), proxy_headers=proxy_headers, **kwargs)
+
+
+def get_http_pool(url=None):
+    """
+    The pool manager of the run, created on the first request and again in a forked
+    process. It keeps `poolsize` connections per host, the idempotent requests are
+    retried on the connection errors and the 5xx statuses. The url goes through a
+    proxy manager when the environment sets a proxy for it.
+    """
+    global HTTP_POOL_PID
+    proxy = url_proxy(url) if url else None
+    with HTTP_POOL_LOCK:
+        if HTTP_POOL_PID != os.getpid():
+            HTTP_POOLS.clear()
+            HTTP_POOL_PID = os.getpid()
+        if proxy not in HTTP_POOLS:
+            retries = urllib3.Retry(total=parseint(config_value('HTTP', 'retries'), RETRIES),
+                                    backoff_factor=0.5, status_forcelist=RETRY_STATUS,
+                                    raise_on_status=False)
+            timeout = urllib3.Timeout(connect=parseint(config_value('HTTP', 'connecttimeout'), CONNECT_TIMEOUT),
+                                      read=parseint(config_value('HTTP', 'readtimeout'), READ_TIMEOUT))
+            kwargs = {'num_pools': POOLS, 'maxsize': max(parseint(config_value('HTTP', 'poolsize'), POOL_SIZE), 1),
+                      'block': True, 'retries': retries, 'timeout': timeout}
+            HTTP_POOLS[proxy] = proxy_manager(proxy, **kwargs) if proxy else urllib3.PoolManager(**kwargs)
+        return HTTP_POOLS[proxy]
+
+
+def clear_http_pool():
+    """Close the connections of the pools at the end of the run."""
+    with HTTP_POOL_LOCK:
+        for pool in HTTP_POOLS.values():
+            pool.clear()
+        HTTP_POOLS.clear()
 
 
 def check_and_add_error(status, errmsg):
@@ -32,23 +99,28 @@ def get_request_headers(headers=None):
 
 
 def urlopen_request(urlreq, method):
-    """Common utility to trigger the http request."""
+    """
+    Common utility to trigger the http request, rate limited per host. The gzip and
+    deflate responses are decoded by the pool.
+    """
+    headers = dict(urlreq.header_items())
+    headers.update(urllib3.make_headers(accept_encoding=True))
     try:
-        urlresp = request.urlopen(urlreq)
-        respdata = urlresp.read()
+        urlresp = rate_limited_call(url_rate_limiter(urlreq.full_url), get_http_pool(urlreq.full_url).request,
+                                    urlreq.get_method(), urlreq.full_url, body=urlreq.data, headers=headers)
         st_code = urlresp.status
-        # logger.debug("%s status: %d, response: %s", method, st_code, respdata)
-        check_and_add_error(st_code, "%s Status: %d" % (method, st_code))
-        if isinstance(respdata, bytes):
-            respdata = respdata.decode()
-        data = json_from_string(respdata)
-        logger.debug("%s status: %d", method, st_code)
+        if 200 <= st_code < 300:
+            respdata = urlresp.data
+            # logger.debug("%s status: %d, response: %s", method, st_code, respdata)
+            check_and_add_error(st_code, "%s Status: %d" % (method, st_code))
+            if isinstance(respdata, bytes):
+                respdata = respdata.decode()
+            data = json_from_string(respdata)
+            logger.debug("%s status: %d", method, st_code)
+        else:
+            data = urlresp.reason if method == "POST" else None
+            logger.info("HTTP %s: status: %s, ex:%s ", method, st_code, urlresp.reason)
     except HTTPError as ex:
-        # st_code = ex.code if method == "POST" else None
-        st_code = ex.code
-        data = ex.msg if method == "POST" else None
-        logger.info("HTTP %s: status: %s, ex:%s ", method, st_code, ex)
-    except URLError as ex:
         st_code = 500
         data = str(ex)
         logger.info("HTTP %s: status: %s, ex:%s ", method, st_code, ex)
@@ -0,0 +1,198 @@
+"""
+Rate limiter shared by the connectors for the calls to the cloud APIs.
+Every provider/service/region has a token bucket whose refill rate is adapted
+with AIMD: the rate grows additively after each successful call and is cut by
+half when the call is throttled. A throttled call is retried after the
+Retry-After delay of the response, or an exponential backoff, and the number
+of throttled calls of every bucket is saved in the run stats.
+"""
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib import parse
+from processor.helper.config.config_utils import config_value, parseint
+from processor.helper.config.rundata_utils import put_in_currentdata
+from processor.logging.log_handler import getlogger
+
+logger = getlogger()
+RATE = 10
+MAX_RATE = 100
+MIN_RATE = 0.5
+RATE_INCREASE = 0.5
+RATE_DECREASE = 0.5
+RETRIES = 5
+MAX_BACKOFF = 60
+THROTTLE_STATUS = [429]
+# The throttling error codes retried by botocore
+THROTTLE_CODES = [
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'ProvisionedThroughputExceededException', 'TransactionInProgressException',
+    'RequestLimitExceeded', 'BandwidthLimitExceeded', 'LimitExceededException', 'RequestThrottled',
+    'SlowDown', 'PriorRequestNotComplete', 'EC2ThrottledException'
+]
+PROVIDER_HOSTS = [
+    ('azure', ('.azure.com', '.azure.net', '.windows.net', '.microsoftonline.com', '.microsoft.com')),
+    ('google', ('.googleapis.com',))
+]
+RATE_LIMITERS = {}
+THROTTLES = {}
+RATE_LIMITERS_LOCK = threading.Lock()
+
+
+class RateLimiter:
+    """Token bucket of a provider/service/region, the refill rate is adapted with AIMD."""
+
+    def __init__(self, name, rate=RATE, max_rate=MAX_RATE):
+        self.name = name
+        self.max_rate = max(max_rate, MIN_RATE)
+        self.rate = min(max(rate, MIN_RATE), self.max_rate)
+        self.tokens = float(self.rate)
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for a token of the bucket."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.tokens + (now - self.updated) * self.rate, max(self.rate, 1.0))
+                self.updated = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(delay)
+
+    def success(self):
+        with self.lock:
+            self.rate = min(self.rate + RATE_INCREASE, self.max_rate)
+
+    def throttled(self, retry_after=None):
+        """Halve the rate, the bucket is blocked for the Retry-After seconds of the response."""
+        with self.lock:
+            self.rate = max(self.rate * RATE_DECREASE, MIN_RATE)
+            self.tokens = 0
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        with RATE_LIMITERS_LOCK:
+            THROTTLES[self.name] = THROTTLES.get(self.name, 0) + 1
+            throttles = dict(THROTTLES)
+        put_in_currentdata('throttles', throttles)
+        logger.debug('Throttled %s, rate %.2f calls/s', self.name, self.rate)
+
+
+def get_rate_limiter(provider, service='', region=''):
+    """The rate limiter of the provider/service/region, created on the first call."""
+    name = ':'.join([part for part in (provider, service, region) if part])
+    with RATE_LIMITERS_LOCK:
+        limiter = RATE_LIMITERS.get(name)
+        if limiter is None:
+            limiter = RateLimiter(name, rate=parseint(config_value('RATELIMIT', 'rate'), RATE),
+                                  max_rate=parseint(config_value('RATELIMIT', 'maxrate'), MAX_RATE))
+            RATE_LIMITERS[name] = limiter
+    return limiter
+
+
+def url_rate_limiter(url):
+    """The rate limiter of the host of the url, the provider is found from the host name."""
+    host = parse.urlparse(url).netloc.lower().split('@')[-1].split(':')[0]
+    provider = 'http'
+    for name, suffixes in PROVIDER_HOSTS:
+        if host.endswith(suffixes):
+            provider = name
+    return get_rate_limiter(provider, host)
+
+
+def clear_rate_limiters():
+    with RATE_LIMITERS_LOCK:
+        RATE_LIMITERS.clear()
+        THROTTLES.clear()
+
+
+def parse_retry_after(value):
+    """Seconds to wait from the Retry-After header, given in seconds or as a http date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def header_value(headers, name):
+    """Case insensitive lookup of the header in a dict or a http.client message."""
+    if not headers:
+        return None
+    value = headers.get(name) if hasattr(headers, 'get') else None
+    if value is None and isinstance(headers, dict):
+        for key, val in headers.items():
+            if key.lower() == name.lower():
+                return val
+    return value
+
+
+def throttle_status(status, headers=None):
+    """Returns (throttled, retry after seconds) for the status and headers of a http response."""
+    if status in THROTTLE_STATUS:
+        return True, parse_retry_after(header_value(headers, 'Retry-After'))
+    return False, None
+
+
+def throttle_error(ex):
+    """Returns (throttled, retry after seconds) for a botocore ClientError or a http error."""
+    response = getattr(ex, 'response', None)
+    if isinstance(response, dict):
+        metadata = response.get('ResponseMetadata', {})
+        headers = metadata.get('HTTPHeaders')
+        if response.get('Error', {}).get('Code') in THROTTLE_CODES:
+            return True, parse_retry_after(header_value(headers, 'Retry-After'))
+        return throttle_status(metadata.get('HTTPStatusCode'), headers)
+    status = getattr(ex, 'code', None)
+    return throttle_status(status, getattr(ex, 'headers', None))
+
+
+def throttle_response(response):
+    """Returns (throttled, retry after seconds) for a response of the requests or urllib3 library."""
+    status = getattr(response, 'status_code', None)
+    if status is None:
+        status = getattr(response, 'status', None)
+    return throttle_status(status, getattr(response, 'headers', None))
+
+
+def backoff(attempt):
+    """Exponential backoff with jitter when the throttled response has no Retry-After."""
+    return min(2 ** attempt, MAX_BACKOFF) * random.uniform(0.5, 1)
+
+
+def rate_limited_call(limiter, function, *args, **kwargs):
+    """
+    Call the function through the rate limiter, the throttled calls are retried
+    `retries` times, then the throttle error or response is returned to the caller.
+    """
+    retries = parseint(config_value('RATELIMIT', 'retries'), RETRIES)
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            result = function(*args, **kwargs)
+            throttled, retry_after = throttle_response(result)
+        except Exception as ex:
+            throttled, retry_after = throttle_error(ex)
+            if not throttled or attempt >= retries:
+                if throttled:
+                    limiter.throttled(retry_after)
+                raise
+        if not throttled:
+            limiter.success()
+            return result
+        limiter.throttled(retry_after)
+        if attempt >= retries:
+            return result
+        time.sleep(retry_after if retry_after else backoff(attempt))
+        attempt += 1
@@ -0,0 +1,77 @@
+"""
+Cache of the Google access tokens of the service accounts. The token of a
+service account is shared by all the credentials of this account for the run,
+the crawler and the snapshot of the nodes, and is refreshed `tokenrefresh`
+seconds before it expires. The number of refreshes is saved in the run stats.
+"""
+import threading
+import time
+from processor.helper.config.config_utils import config_value, parseint
+from processor.helper.config.rundata_utils import put_in_currentdata
+from processor.logging.log_handler import getlogger
+
+logger = getlogger()
+TOKEN_REFRESH = 300
+TOKEN_LIFETIME = 3600
+GOOGLE_TOKENS = {}
+TOKEN_LOCKS = {}
+TOKEN_REFRESHES = {}
+GOOGLE_TOKENS_LOCK = threading.Lock()
+
+
+def credentials_key(credentials):
+    """Service account, key and scopes of the credentials, None if it is not a service account."""
+    email = getattr(credentials, 'service_account_email', None)
+    if not email or not isinstance(email, str):
+        return None
+    return email, getattr(credentials, '_private_key_id', None), getattr(credentials, '_scopes', None)
+
+
+def token_lock(key):
+    with GOOGLE_TOKENS_LOCK:
+        if key not in TOKEN_LOCKS:
+            TOKEN_LOCKS[key] = threading.Lock()
+        return TOKEN_LOCKS[key]
+
+
+def refresh_margin():
+    return parseint(config_value('GOOGLE', 'tokenrefresh'), TOKEN_REFRESH)
+
+
+def count_refresh(email):
+    with GOOGLE_TOKENS_LOCK:
+        TOKEN_REFRESHES[email] = TOKEN_REFRESHES.get(email, 0) + 1
+        refreshes = dict(TOKEN_REFRESHES)
+    put_in_currentdata('googleTokenRefreshes', refreshes)
+
+
+def get_google_access_token(credentials):
+    """
+    Access token of the credentials from the cache, a new token is fetched when
+    the cached one expires in less than `tokenrefresh` seconds.
+    """
+    key = credentials_key(credentials)
+    if not key:
+        return credentials.get_access_token().access_token
+    with token_lock(key):
+        cached = GOOGLE_TOKENS.get(key)
+        now = time.time()
+        if cached and cached['expiry'] - refresh_margin() > now:
+            return cached['token']
+        if cached and getattr(credentials, 'access_token', None) == cached['token']:
+            # The credentials hold the expiring token, drop it so that they fetch a new one.
+            credentials.access_token = None
+        token_info = credentials.get_access_token()
+        expires_in = token_info.expires_in if token_info.expires_in is not None else TOKEN_LIFETIME
+        GOOGLE_TOKENS[key] = {'token': token_info.access_token, 'expiry': now + expires_in}
+        logger.debug('Google access token of %s refreshed, expires in %s seconds', key[0], expires_in)
+    count_refresh(key[0])
+    return token_info.access_token
+
+
+def clear_google_tokens():
+    """Drop the cached tokens at the end of the run."""
+    with GOOGLE_TOKENS_LOCK:
+        GOOGLE_TOKENS.clear()
+        TOKEN_LOCKS.clear()
+        TOKEN_REFRESHES.clear()
@@ -251,6 +251,10 @@ Run prancer for a list of snapshots
     cmd_parser.add_argument('--company', action='store', default=None, help='company name of the prancer saas solution (This argument is needed only when the --db is REMOTE)')
     cmd_parser.add_argument('--createsnapshot', action='store_true', default=False, help='To generate all the snapshots after crawler is completed.')
     cmd_parser.add_argument('--mastersnapshotfile', action='store', default="", help='To rum crawler for the specific mastersnapshot file.')
+    cmd_parser.add_argument('--workers', action='store', type=int, default=None, help='Number of workers running the testcases concurrently, 1 runs them serially.')
+    cmd_parser.add_argument('--workertype', action='store', default=None, choices=['thread', 'process'],
+                            help='''thread - Testcases run in threads, for the rules waiting on OPA or the database,
+                            process - Testcases run in processes, for the CPU bound rules.''')
 
     args = cmd_parser.parse_args(arg_vals)
 
@@ -408,6 +412,10 @@ Run prancer for a list of snapshots
             put_in_currentdata("createsnapshot", True)
         if args.mastersnapshotfile:
             put_in_currentdata("mastersnapshotfile", args.mastersnapshotfile)
+        if args.workers:
+            put_in_currentdata("workers", args.workers)
+        if args.workertype:
+            put_in_currentdata("workertype", args.workertype)
 
         
         # if args.db == DBVALUES.index(FULL):
@@ -509,6 +517,17 @@ Run prancer for a list of snapshots
         logger.error("Execution exception: %s", ex)
         print(traceback.format_exc())
         retval = 2
+    finally:
+        from processor.connector.snapshot_aws import clear_aws_clients
+        clear_aws_clients()
+        from processor.helper.httpapi.rate_limiter import clear_rate_limiters
+        clear_rate_limiters()
+        from processor.helper.httpapi.http_utils import clear_http_pool
+        clear_http_pool()
+        from processor.helper.httpapi.restapi_google import clear_google_tokens
+        clear_google_tokens()
+        from processor.connector.snapshot_kubernetes import clear_kube_api_clients
+        clear_kube_api_clients()
 
     # if args.remote:
     #     from processor.helper.utils.compliance_utils import upload_compliance_results
@@ -208,7 +208,7 @@ def test_match_method():
 
 
 def test_match_number(monkeypatch):
-    monkeypatch.setattr('processor.comparison.comparisonantlr.rule_interpreter.get_documents', mock_get_documents)
+    monkeypatch.setattr('processor.comparison.snapshot_cache.get_documents', mock_get_documents)
     monkeypatch.setattr('processor.comparison.comparisonantlr.rule_interpreter.exists_file',
                         mock_exists_file)
     monkeypatch.setattr('processor.comparison.comparisonantlr.rule_interpreter.exists_dir',
@@ -263,7 +263,7 @@ def test_match_number(monkeypatch):
 
 
 def test_match_array_attribute(monkeypatch):
-    monkeypatch.setattr('processor.comparison.comparisonantlr.rule_interpreter.get_documents', mock_get_multiple_documents)
+    monkeypatch.setattr('processor.comparison.snapshot_cache.get_documents', mock_get_multiple_documents)
     monkeypatch.setattr('processor.comparison.comparisonantlr.rule_interpreter.exists_file',
                         mock_exists_file)
     monkeypatch.setattr('processor.comparison.comparisonantlr.rule_interpreter.exists_dir',
@@ -292,7 +292,7 @@ def test_match_array_attribute(monkeypatch):
 
 
 def test_compare(monkeypatch):
-    monkeypatch.setattr('processor.comparison.comparisonantlr.rule_interpreter.get_documents', mock_get_multiple_documents)
+    monkeypatch.setattr('processor.comparison.snapshot_cache.get_documents', mock_get_multiple_documents)
     monkeypatch.setattr('processor.comparison.comparisonantlr.rule_interpreter.exists_file',
                         mock_exists_file)
     monkeypatch.setattr('processor.comparison.comparisonantlr.rule_interpreter.exists_dir',
@@ -313,7 +313,7 @@ def test_compare(monkeypatch):
     assert val == False
 
 def test_get_value(monkeypatch):
-    monkeypatch.setattr('processor.comparison.comparisonantlr.rule_interpreter.get_documents',
+    monkeypatch.setattr('processor.comparison.snapshot_cache.get_documents',
                         mock_get_documents)
     monkeypatch.setattr('processor.comparison.comparisonantlr.rule_interpreter.exists_file',
                         mock_exists_file)
@@ -331,7 +331,7 @@ def test_get_value(monkeypatch):
 
 
 def test_eval_expression(monkeypatch):
-    monkeypatch.setattr('processor.comparison.comparisonantlr.rule_interpreter.get_documents',
+    monkeypatch.setattr('processor.comparison.snapshot_cache.get_documents',
                         mock_get_documents)
     monkeypatch.setattr('processor.comparison.comparisonantlr.rule_interpreter.exists_file',
                         mock_exists_file)
@@ -26,7 +26,7 @@ def mock_get_documents(collection, query=None, dbname=None, sort=None, limit=10)
 def test_interpreter(monkeypatch):
     monkeypatch.setattr('processor.comparison.interpreter.get_documents',
                         mock_get_documents)
-    monkeypatch.setattr('processor.comparison.comparisonantlr.rule_interpreter.get_documents', mock_get_documents)
+    monkeypatch.setattr('processor.comparison.snapshot_cache.get_documents', mock_get_documents)
     from processor.comparison.interpreter import Comparator
     comparator = Comparator('0.1', 'mycontainer1', 'validator', {}, {
                     "testId": "1",
@@ -123,6 +123,7 @@ def test_interpreter(monkeypatch):
 def test_interpreter_1(monkeypatch):
     monkeypatch.setattr('processor.comparison.interpreter.get_documents',
                         mock_zero_get_documents)
+    monkeypatch.setattr('processor.comparison.snapshot_cache.get_documents', mock_zero_get_documents)
     from processor.comparison.interpreter import Comparator
     comparator = Comparator('0.1', 'mycontainer1', 'validator', {}, {
         "testId": "4",
@@ -179,3 +180,50 @@ def atest_comparator():
     print(comparator.validate())
     comparator = Comparator('0.1', {'a': 'b', 'c': {'d': 10}}, 'c.d', 'gtw 10')
     print(comparator.validate())
+
+
+def test_rego_batch(monkeypatch):
+    evaluations = []
+
+    def mock_opa_eval(opa_exe, rego_files, rule_expr, inputjson):
+        evaluations.append((rego_files, rule_expr, inputjson))
+        values = {str(i): item['rulepass'] for i, item in enumerate(inputjson['items']) if 'rulepass' in item}
+        return 0, {'result': [{'expressions': [{'value': values}]}]}
+
+    def mock_get_snaphotid_doc(self, sid, testId, isMasterTest=False):
+        self.snapshots.append({'id': sid, 'paths': ['/%s' % sid]})
+        return False, {'sid': sid, 'rulepass': sid != 'S2'} if sid != 'S3' else {'sid': sid}
+
+    monkeypatch.setattr('processor.comparison.interpreter.opa_binary', lambda: 'opa')
+    monkeypatch.setattr('processor.comparison.interpreter.get_opa_server', lambda opa_exe: None)
+    monkeypatch.setattr('processor.comparison.interpreter.opa_eval', mock_opa_eval)
+    monkeypatch.setattr('processor.comparison.interpreter.ComparatorV01.get_snaphotid_doc', mock_get_snaphotid_doc)
+    monkeypatch.setattr('processor.comparison.interpreter.ComparatorV01.rego_rule_digest',
+                        lambda self, rego_file, container: cache_rule_text('package rule'))
+    monkeypatch.setattr('processor.comparison.interpreter.ComparatorV01.get_connector_data', lambda self: {})
+    from processor.comparison.interpreter import Comparator, RegoBatch
+    from processor.comparison.rule_cache import cache_rule_text
+    comparators = []
+    for sid in ['S1', 'S2', 'S3']:
+        comparators.append(Comparator('0.1', 'mycontainer1', 'validator', {}, {
+            "masterTestId": "TEST_1",
+            "type": "rego",
+            "rule": "file(rule.rego)",
+            "snapshotId": [sid],
+            "eval": "data.rule.rulepass"
+        }, {}, []))
+    comparators.append(Comparator('0.1', 'mycontainer1', 'validator', {}, {
+        "testId": "2",
+        "snapshotId": "1",
+        "attribute": "id",
+        "comparison": "gt 10"
+    }, {}, {}))
+    rego_batch = RegoBatch(comparators, batch_size=10)
+    for index in range(3):
+        rego_batch.prepare(index)
+    assert len(evaluations) == 1
+    assert evaluations[0][1] == 'data.prancer_batch.results'
+    assert [item['sid'] for item in evaluations[0][2]['items']] == ['S1', 'S2', 'S3']
+    assert ['passed', 'failed'] == [comparator.validate()[0]['result'] for comparator in comparators[:2]]
+    assert [] == comparators[2].validate()
+    assert len(evaluations) == 1
@@ -0,0 +1,185 @@
+""" Tests for the OPA server mode"""
+import os
+import sys
+import stat
+import tempfile
+
+FAKE_OPA = '''#!%s
+import json
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+POLICY = {}
+PUTS = []
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_GET(self):
+        self.reply(200, {'puts': PUTS})
+
+    def do_PUT(self):
+        text = self.body().decode('utf-8')
+        if 'package prancer_' not in text:
+            self.reply(400, {'code': 'invalid_parameter', 'errors': [{'code': 'rego_parse_error', 'message': 'package expected'}]})
+            return
+        POLICY[self.path] = text
+        PUTS.append(self.path)
+        self.reply(200, {})
+
+    def do_POST(self):
+        data = json.loads(self.body())
+        path = self.path[len('/v1/data/'):]
+        value = data['input'].get(path.rsplit('/', 1)[-1])
+        self.reply(200, {'result': value} if value is not None else {})
+
+if sys.argv[1:3] == ['run', '--server']:
+    host, port = sys.argv[4].split(':')
+    ThreadingHTTPServer((host, int(port)), Handler).serve_forever()
+'''
+
+
+def create_fake_opa():
+    fname = '%s/opa' % tempfile.mkdtemp()
+    with open(fname, 'w') as f:
+        f.write(FAKE_OPA % sys.executable)
+    os.chmod(fname, os.stat(fname).st_mode | stat.S_IEXEC)
+    return fname
+
+
+def test_query_path():
+    from processor.comparison.opa_server import query_path
+    assert 'rule/rulepass' == query_path('data.rule.rulepass')
+    assert 'rule' == query_path('data.rule')
+    assert '' == query_path('data')
+    assert query_path('data.rule.rulepass == true') is None
+    assert query_path(None) is None
+
+
+def test_opa_server_evaluate():
+    from processor.comparison.opa_server import OpaServer
+    server = OpaServer(create_fake_opa())
+    assert server.start()
+    try:
+        rule = 'package rule\ndefault rulepass = false\n'
+        val = server.evaluate(rule, 'data.rule.rulepass', {'rulepass': True})
+        assert val == {'result': [{'expressions': [{'value': True, 'text': 'data.rule.rulepass',
+                                                    'location': {'row': 1, 'col': 1}}]}]}
+        val = server.evaluate(rule, 'data.rule.rulepass', {})
+        assert val == {}
+        val = server.evaluate(rule, 'data.rule.rulepass == true', {})
+        assert val is None
+        val = server.evaluate('rulepass = true', 'data.rule.rulepass', {'rulepass': True})
+        assert val['errors'][0]['code'] == 'rego_parse_error'
+    finally:
+        server.stop()
+    assert not server.running()
+    assert server.evaluate('package rule', 'data.rule.rulepass', {}) is None
+
+
+def test_opa_server_start_failure():
+    from processor.comparison.opa_server import OpaServer
+    server = OpaServer('/tmp/nonexistent/opa')
+    assert not server.start()
+    assert server.evaluate('package rule', 'data.rule.rulepass', {}) is None
+
+
+def test_get_opa_server_disabled(monkeypatch):
+    monkeypatch.setattr('processor.comparison.opa_server.OPA_SERVER', None)
+    monkeypatch.setattr('processor.comparison.opa_server.opa_server_enabled', lambda: False)
+    from processor.comparison.opa_server import get_opa_server
+    assert get_opa_server('opa') is None
+
+
+def worker_opa_server(opa_exe):
+    from processor.comparison import opa_server
+    inherited = opa_server.OPA_SERVER
+    server = opa_server.get_opa_server(opa_exe)
+    val = server.evaluate('package rule\n', 'data.rule.rulepass', {'rulepass': True})
+    return inherited is None, os.getpid(), server.port, server.process.pid, val
+
+
+def test_get_opa_server_forked_worker(monkeypatch):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    monkeypatch.setattr('processor.comparison.opa_server.OPA_SERVER', None)
+    monkeypatch.setattr('processor.comparison.opa_server.opa_server_enabled', lambda: True)
+    monkeypatch.setattr('processor.comparison.opa_server.config_value', lambda section, key: None)
+    from processor.comparison.opa_server import get_opa_server, stop_opa_server
+    from processor.connector.validation import _init_validation_worker
+    opa_exe = create_fake_opa()
+    server = get_opa_server(opa_exe)
+    try:
+        assert server.evaluate('package rule\n', 'data.rule.rulepass', {'rulepass': True})
+        assert server.connections
+        executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork'),
+                                       initializer=_init_validation_worker, initargs=(None,))
+        try:
+            reset, pid, port, opa_pid, val = executor.submit(worker_opa_server, opa_exe).result()
+        finally:
+            executor.shutdown(wait=True)
+        assert reset
+        assert pid != os.getpid()
+        assert port != server.port
+        assert True is val['result'][0]['expressions'][0]['value']
+        # The worker stopped its own server when it exited.
+        try:
+            os.kill(opa_pid, 0)
+            assert False, 'OPA server of the worker is still running'
+        except ProcessLookupError:
+            pass
+        # The server of the parent and its connection are untouched.
+        assert server is get_opa_server(opa_exe)
+        assert server.running()
+        val = server.evaluate('package rule\n', 'data.rule.rulepass', {'rulepass': False})
+        assert False is val['result'][0]['expressions'][0]['value']
+    finally:
+        stop_opa_server()
+
+
+def test_opa_server_policies():
+    import threading
+    from processor.comparison.opa_server import OpaServer, prefixed_rule, policy_prefix
+    assert 'package p_1.rule\nx = data.p_1.rule.y\nz = data.rules.y\n' == \
+        prefixed_rule('package rule\nx = data.rule.y\nz = data.rules.y\n', 'p_1', ['rule'])
+    server = OpaServer(create_fake_opa())
+    assert server.start()
+    try:
+        rules = ['package rule\ndefault rulepass = false\n', 'package rule\nrulepass = true\n']
+        # The testcases of the rule files alternate, every rule is loaded once.
+        for _ in range(3):
+            for rule in rules:
+                val = server.evaluate(rule, 'data.rule.rulepass', {'rulepass': True})
+                assert True is val['result'][0]['expressions'][0]['value']
+        _, data = server._request('GET', '/puts')
+        assert ['/v1/policies/%s_0' % policy_prefix([rule]) for rule in rules] == data['puts']
+        results = []
+
+        def evaluate():
+            for rule in rules:
+                results.append(server.evaluate(rule, 'data.rule.rulepass', {'rulepass': True}))
+
+        threads = [threading.Thread(target=evaluate) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert 8 == len(results)
+        assert all(True is val['result'][0]['expressions'][0]['value'] for val in results)
+        assert 1 < len(server.connections)
+    finally:
+        server.stop()
+    assert [] == server.connections
@@ -0,0 +1,74 @@
+""" Tests for the rule cache"""
+import os
+
+
+def test_cache_rule_text():
+    from processor.comparison.rule_cache import cache_rule_text, rule_text, rule_file
+    digest = cache_rule_text('package rule\ndefault rulepass = false\n')
+    assert digest == cache_rule_text('package rule\ndefault rulepass = false\n')
+    assert 'package rule\ndefault rulepass = false\n' == rule_text(digest)
+    fname = rule_file(digest)
+    assert fname.endswith('%s.rego' % digest)
+    with open(fname) as f:
+        assert 'package rule\ndefault rulepass = false\n' == f.read()
+    assert fname == rule_file(digest)
+    assert rule_file('missing') is None
+
+
+def test_file_rule_digest(create_temp_dir):
+    from processor.comparison.rule_cache import file_rule_digest, rule_text, rule_file
+    newpath = create_temp_dir()
+    fname = '%s/rule.rego' % newpath
+    with open(fname, 'w') as f:
+        f.write('package rule_file_digest')
+    digest = file_rule_digest(fname)
+    assert 'package rule_file_digest' == rule_text(digest)
+    assert fname == rule_file(digest)
+    assert digest == file_rule_digest(fname)
+    with open(fname, 'w') as f:
+        f.write('package rule_file_digest\n')
+    os.utime(fname, (0, 0))
+    assert digest != file_rule_digest(fname)
+    assert file_rule_digest('%s/missing.rego' % newpath) is None
+
+
+def test_load_rule_module():
+    from processor.comparison.rule_cache import cache_rule_text, load_rule_module
+    digest = cache_rule_text('def rulepass(data, kwargs={}):\n    return {"issue": not data.get("ok")}\n')
+    module = load_rule_module(digest)
+    assert module is load_rule_module(digest)
+    assert {'issue': False} == module.rulepass({'ok': True})
+    assert load_rule_module(cache_rule_text('def broken(:')) is None
+
+
+def test_container_rules(monkeypatch):
+    docs = [{
+        'timestamp': 1,
+        'json': {'file': [{'name': 'rule.rego', 'container_file': 'package rule_container'},
+                          {'name': 'empty.rego', 'container_file': ''}]}
+    }]
+    calls = []
+
+    def mock_get_documents(collection, query=None, dbname=None, sort=None, limit=10, skip=0, proj=None, _id=False):
+        calls.append(proj)
+        return docs
+
+    monkeypatch.setattr('processor.comparison.rule_cache.get_documents', mock_get_documents)
+    monkeypatch.setattr('processor.comparison.rule_cache.CONTAINER_RULES', {})
+    from processor.comparison.rule_cache import container_rule_digest, refresh_container_rules, rule_text
+    digest = container_rule_digest('validator', 'container1', 'rule.rego')
+    assert 'package rule_container' == rule_text(digest)
+    assert container_rule_digest('validator', 'container1', 'empty.rego') is None
+    assert container_rule_digest('validator', 'container1', 'missing.rego') is None
+    assert 1 == len(calls)
+    refresh_container_rules('validator', 'container1')
+    assert digest == container_rule_digest('validator', 'container1', 'rule.rego')
+    assert 2 == len(calls)
+    docs[0] = {
+        'timestamp': 2,
+        'json': {'file': [{'name': 'rule.rego', 'container_file': 'package rule_changed'}]}
+    }
+    refresh_container_rules('validator', 'container1')
+    digest = container_rule_digest('validator', 'container1', 'rule.rego')
+    assert 'package rule_changed' == rule_text(digest)
+    assert 4 == len(calls)
@@ -0,0 +1,97 @@
+""" Tests for the snapshot cache"""
+import json
+
+
+def mock_snapshot_doc(sid, timestamp=1):
+    return {'snapshotId': sid, 'timestamp': timestamp, 'json': {'id': sid}}
+
+
+def test_prefetch_snapshots(monkeypatch):
+    pipelines = []
+    fetched = []
+
+    def mock_aggregate_documents(collection, pipeline, dbname=None):
+        pipelines.append((collection, pipeline))
+        sids = pipeline[0]['$match']['snapshotId']['$in']
+        return [{'_id': sid, 'doc': dict(mock_snapshot_doc(sid), _id='objid')} for sid in sids if sid != 'missing']
+
+    def mock_get_documents(collection, query=None, dbname=None, sort=None, limit=10, skip=0, proj=None, _id=False):
+        fetched.append(query['snapshotId'])
+        return [mock_snapshot_doc(query['snapshotId'])]
+
+    monkeypatch.setattr('processor.comparison.snapshot_cache.aggregate_documents', mock_aggregate_documents)
+    monkeypatch.setattr('processor.comparison.snapshot_cache.get_documents', mock_get_documents)
+    monkeypatch.setattr('processor.comparison.snapshot_cache.snapshot_cache_size', lambda: 3)
+    from processor.comparison.snapshot_cache import open_snapshot_cache, close_snapshot_cache, \
+        get_snapshot_document
+    open_snapshot_cache('validator', {'microsoftcompute': ['1', '2', 'missing']})
+    try:
+        assert 1 == len(pipelines)
+        assert 'microsoftcompute' == pipelines[0][0]
+        assert mock_snapshot_doc('1') == get_snapshot_document('microsoftcompute', '1', 'validator')
+        assert get_snapshot_document('microsoftcompute', 'missing', 'validator') is None
+        assert [] == fetched
+        doc = get_snapshot_document('microsoftcompute', '2', 'validator')
+        doc['json']['id'] = 'changed'
+        assert mock_snapshot_doc('2') == get_snapshot_document('microsoftcompute', '2', 'validator')
+        # Least recently used snapshot is evicted and fetched again.
+        assert mock_snapshot_doc('3') == get_snapshot_document('microsoftcompute', '3', 'validator')
+        assert mock_snapshot_doc('1') == get_snapshot_document('microsoftcompute', '1', 'validator')
+        assert ['3', '1'] == fetched
+    finally:
+        close_snapshot_cache()
+    get_snapshot_document('microsoftcompute', '2', 'validator')
+    assert ['3', '1', '2'] == fetched
+
+
+def test_read_snapshot_file(create_temp_dir):
+    from processor.comparison.snapshot_cache import open_snapshot_cache, close_snapshot_cache, \
+        read_snapshot_file
+    reads = []
+
+    def reader(fname):
+        reads.append(fname)
+        with open(fname) as f:
+            return json.load(f)
+
+    fname = '%s/snapshot1' % create_temp_dir()
+    with open(fname, 'w') as f:
+        json.dump(mock_snapshot_doc('1'), f)
+    open_snapshot_cache()
+    try:
+        assert mock_snapshot_doc('1') == read_snapshot_file(fname, reader)
+        assert mock_snapshot_doc('1') == read_snapshot_file(fname, reader)
+        assert 1 == len(reads)
+        with open(fname, 'w') as f:
+            json.dump(mock_snapshot_doc('1', 12345), f)
+        assert mock_snapshot_doc('1', 12345) == read_snapshot_file(fname, reader)
+        assert 2 == len(reads)
+    finally:
+        close_snapshot_cache()
+
+
+def test_prefetch_snapshots_size(monkeypatch):
+    fetched = []
+
+    def mock_aggregate_documents(collection, pipeline, dbname=None):
+        sids = pipeline[0]['$match']['snapshotId']['$in']
+        return [{'_id': sid, 'doc': mock_snapshot_doc(sid)} for sid in sids]
+
+    def mock_get_documents(collection, query=None, dbname=None, sort=None, limit=10, skip=0, proj=None, _id=False):
+        fetched.append(query['snapshotId'])
+        return [mock_snapshot_doc(query['snapshotId'])]
+
+    monkeypatch.setattr('processor.comparison.snapshot_cache.aggregate_documents', mock_aggregate_documents)
+    monkeypatch.setattr('processor.comparison.snapshot_cache.get_documents', mock_get_documents)
+    monkeypatch.setattr('processor.comparison.snapshot_cache.snapshot_cache_size', lambda: 2)
+    from processor.comparison.snapshot_cache import open_snapshot_cache, close_snapshot_cache, \
+        get_snapshot_document
+    sids = ['1', '2', '3', '4', '5']
+    open_snapshot_cache('validator', {'microsoftcompute': sids})
+    try:
+        # The prefetched snapshots are kept even when they are more than the cache size.
+        assert [mock_snapshot_doc(sid) for sid in sids] == \
+            [get_snapshot_document('microsoftcompute', sid, 'validator') for sid in sids]
+        assert [] == fetched
+    finally:
+        close_snapshot_cache()
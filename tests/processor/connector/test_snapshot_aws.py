@@ -1,4 +1,5 @@
 """ Tests for snapshot azure"""
+import pytest
 from unittest.mock import Mock
 
 snapshot = {
@@ -316,6 +317,7 @@ def test_populate_aws_snapshot(monkeypatch):
     monkeypatch.setattr('processor.connector.snapshot_aws.json_source', mock_db_json_source)
     monkeypatch.setattr('processor.connector.snapshot_aws.get_vault_data', mock_get_vault_data)
     monkeypatch.setattr('processor.connector.snapshot_aws.client', mock_client)
+    monkeypatch.setattr('processor.connector.snapshot_aws.AWS_CLIENTS', {})
     monkeypatch.setattr('processor.connector.snapshot_aws.insert_one_document', mock_insert_one_document)
     monkeypatch.setattr('processor.connector.snapshot_aws.get_collection_size', mock_get_collection_size)
     from processor.connector.snapshot_aws import populate_aws_snapshot
@@ -328,8 +330,9 @@ def test_populate_aws_snapshot_with_mastersnapshot(monkeypatch):
     monkeypatch.setattr('processor.connector.snapshot_aws.json_source', mock_db_json_source)
     monkeypatch.setattr('processor.connector.snapshot_aws.get_vault_data', mock_get_vault_data)
     monkeypatch.setattr('processor.connector.snapshot_aws.client', mock_client)
+    monkeypatch.setattr('processor.connector.snapshot_aws.AWS_CLIENTS', {})
     monkeypatch.setattr('processor.connector.snapshot_aws.insert_one_document', mock_insert_one_document)
-    monkeypatch.setattr('processor.connector.snapshot_aws.Session', MockSession)
+    monkeypatch.setattr('processor.connector.snapshot_aws.AWS_SESSION', MockSession)
     monkeypatch.setattr('processor.connector.snapshot_aws.get_collection_size', mock_get_collection_size)
     from processor.connector.snapshot_aws import populate_aws_snapshot
     val = populate_aws_snapshot(master_snapshot, 'mycontainer1')
@@ -341,6 +344,7 @@ def test_exception_populate_aws_snapshot(monkeypatch):
     monkeypatch.setattr('processor.connector.snapshot_aws.json_source', mock_db_json_source)
     monkeypatch.setattr('processor.connector.snapshot_aws.get_vault_data', mock_get_vault_data)
     monkeypatch.setattr('processor.connector.snapshot_aws.client', mock_invalid_client)
+    monkeypatch.setattr('processor.connector.snapshot_aws.AWS_CLIENTS', {})
     monkeypatch.setattr('processor.connector.snapshot_aws.insert_one_document', mock_insert_one_document)
     monkeypatch.setattr('processor.connector.snapshot_aws.get_collection_size', mock_get_collection_size)
     from processor.connector.snapshot_aws import populate_aws_snapshot
@@ -354,6 +358,7 @@ def test_client_acceptance_from_snapshot(monkeypatch):
     monkeypatch.setattr('processor.connector.snapshot_aws.json_source', mock_db_json_source)
     monkeypatch.setattr('processor.connector.snapshot_aws.get_vault_data', mock_get_vault_data)
     monkeypatch.setattr('processor.connector.snapshot_aws.client', mock_client)
+    monkeypatch.setattr('processor.connector.snapshot_aws.AWS_CLIENTS', {})
     monkeypatch.setattr('processor.connector.snapshot_aws.insert_one_document', mock_insert_one_document)
     monkeypatch.setattr('processor.connector.snapshot_aws.get_collection_size', mock_get_collection_size)
     from processor.connector.snapshot_aws import populate_aws_snapshot
@@ -366,6 +371,7 @@ def test_client_acceptance_from_snapshot_negative(monkeypatch):
     monkeypatch.setattr('processor.connector.snapshot_aws.json_source', mock_db_json_source)
     monkeypatch.setattr('processor.connector.snapshot_aws.get_vault_data', mock_get_vault_data)
     monkeypatch.setattr('processor.connector.snapshot_aws.client', mock_client)
+    monkeypatch.setattr('processor.connector.snapshot_aws.AWS_CLIENTS', {})
     monkeypatch.setattr('processor.connector.snapshot_aws.insert_one_document', mock_insert_one_document)
     monkeypatch.setattr('processor.connector.snapshot_aws.get_collection_size', mock_get_collection_size)
     from processor.connector.snapshot_aws import populate_aws_snapshot
@@ -440,3 +446,207 @@ def test_get_function_kwargs(monkeypatch):
 
 
 
+
+
+def test_get_all_nodes_paginated(monkeypatch):
+    import boto3
+    from botocore.stub import Stubber
+    from processor.connector.snapshot_aws import get_all_nodes
+    monkeypatch.setattr('processor.connector.snapshot_aws.config_value',
+                        lambda section, key, default=None: '1' if key == 'pagesize' else default)
+    awsclient = boto3.client('iam', region_name='us-east-1', aws_access_key_id='a', aws_secret_access_key='b')
+    stubber = Stubber(awsclient)
+    role = {'Path': '/', 'RoleId': 'AROAEXAMPLEID1234567', 'CreateDate': '2020-01-01'}
+    stubber.add_response('list_roles', {
+        'Roles': [dict(role, RoleName='role1', Arn='arn:aws:iam::123456789012:role/role1')],
+        'IsTruncated': True, 'Marker': 'page2'}, {'MaxItems': 1})
+    stubber.add_response('list_roles', {
+        'Roles': [dict(role, RoleName='role2', Arn='arn:aws:iam::123456789012:role/role2')],
+        'IsTruncated': False}, {'MaxItems': 1, 'Marker': 'page2'})
+    node = {
+        'masterSnapshotId': 'AWS_IAM_01', 'listMethod': 'list_roles', 'detailMethods': ['get_role'],
+        'exclude': {'paths': ['arn:aws:iam::123456789012:role/role2']}
+    }
+    with stubber:
+        val = get_all_nodes(awsclient, node, master_snapshot, {})
+    assert ['arn:aws:iam::123456789012:role/role1'] == [record['arn'] for record in val]
+    stubber.assert_no_pending_responses()
+
+
+def test_get_all_nodes_deadline(monkeypatch):
+    import time
+    import boto3
+    from botocore.stub import Stubber
+    from processor.connector.snapshot_aws import get_all_nodes
+    monkeypatch.setattr('processor.connector.snapshot_aws.config_value',
+                        lambda section, key, default=None: '1' if key == 'pagesize' else default)
+    awsclient = boto3.client('iam', region_name='us-east-1', aws_access_key_id='a', aws_secret_access_key='b')
+    stubber = Stubber(awsclient)
+    role = {'Path': '/', 'RoleId': 'AROAEXAMPLEID1234567', 'CreateDate': '2020-01-01'}
+    stubber.add_response('list_roles', {
+        'Roles': [dict(role, RoleName='role1', Arn='arn:aws:iam::123456789012:role/role1')],
+        'IsTruncated': True, 'Marker': 'page2'}, {'MaxItems': 1})
+    stubber.add_response('list_roles', {
+        'Roles': [dict(role, RoleName='role2', Arn='arn:aws:iam::123456789012:role/role2')],
+        'IsTruncated': False}, {'MaxItems': 1, 'Marker': 'page2'})
+    node = {'masterSnapshotId': 'AWS_IAM_01', 'listMethod': 'list_roles', 'detailMethods': ['get_role']}
+    # The first page lasts past the deadline, the second page is never requested.
+    awsclient.meta.events.register('after-call.iam.ListRoles', lambda **kwargs: time.sleep(0.2))
+    with stubber:
+        assert [] == get_all_nodes(awsclient, node, master_snapshot, {}, deadline=time.time() - 1)
+        val = get_all_nodes(awsclient, node, master_snapshot, {}, deadline=time.time() + 0.1)
+        assert ['arn:aws:iam::123456789012:role/role1'] == [record['arn'] for record in val]
+        with pytest.raises(AssertionError):
+            stubber.assert_no_pending_responses()
+
+
+def test_crawl_regions(monkeypatch):
+    import random
+    import time
+    from processor.connector.snapshot_aws import _crawl_regions
+
+    def mock_region_client(client_str, aws_access_key_id=None, aws_secret_access_key=None, region_name=None):
+        if region_name == 'bad-region':
+            raise Exception('Unknown region')
+        return region_name
+
+    def mock_get_all_nodes(awsclient, node, snapshot, connector, deadline=None):
+        assert deadline
+        time.sleep(2 if awsclient == 'slow-region' else random.random() / 100)
+        return [{'arn': '%s-%d' % (awsclient, idx)} for idx in range(2)]
+
+    monkeypatch.setattr('processor.connector.snapshot_aws.client', mock_region_client)
+
+    monkeypatch.setattr('processor.connector.snapshot_aws.AWS_CLIENTS', {})
+    monkeypatch.setattr('processor.connector.snapshot_aws.get_all_nodes', mock_get_all_nodes)
+    monkeypatch.setattr('processor.connector.snapshot_aws.config_value',
+                        lambda section, key, default=None: {'regionworkers': '3', 'regiontimeout': '1'}.get(key))
+    regions = ['region%d' % idx for idx in range(6)] + ['bad-region', 'slow-region']
+    val = _crawl_regions('ec2', regions, 'access', 'secret', {}, {}, {})
+    assert regions == [region for region, _ in val]
+    assert ['region0-0', 'region0-1'] == [data['arn'] for data in val[0][1]]
+    assert ['region5-0', 'region5-1'] == [data['arn'] for data in val[5][1]]
+    assert [] == val[6][1]
+    assert [] == val[7][1]
+
+
+def test_get_aws_client(monkeypatch):
+    from processor.connector.snapshot_aws import get_aws_client, clear_aws_clients, AWS_CLIENTS
+    monkeypatch.setattr('processor.connector.snapshot_aws.AWS_CLIENTS', {})
+    created = []
+
+    def mock_created_client(*args, **kwargs):
+        created.append(kwargs['region_name'])
+        return MyMock()
+
+    monkeypatch.setattr('processor.connector.snapshot_aws.client', mock_created_client)
+    awsclient = get_aws_client('ec2', 'us-east-1', 'access', 'secret')
+    assert awsclient is get_aws_client('ec2', 'us-east-1', 'access', 'secret')
+    assert awsclient is not get_aws_client('ec2', 'us-east-1', 'access', 'secret2')
+    assert awsclient is not get_aws_client('ec2', 'us-west-1', 'access', 'secret')
+    assert ['us-east-1', 'us-east-1', 'us-west-1'] == created
+    clear_aws_clients()
+    get_aws_client('ec2', 'us-east-1', 'access', 'secret')
+    assert 4 == len(created)
+
+
+def test_detail_method_batches():
+    from processor.connector.snapshot_aws import _detail_method_batches
+    val = _detail_method_batches(['describe_instances', 'monitor_instances', 'describe_images',
+                                  'describe_security_groups', 'describe_volumes'])
+    assert [['describe_instances', 'monitor_instances'], ['describe_images', 'describe_security_groups'],
+            ['describe_volumes']] == val
+
+
+def test_get_node_concurrent_detail_methods(monkeypatch):
+    import threading
+    import time
+    from processor.connector.snapshot_aws import get_node, clear_aws_clients
+    running = {'count': 0, 'max': 0}
+    lock = threading.Lock()
+
+    class DetailClient:
+        def __getattr__(self, name):
+            if not name.startswith('get_bucket_'):
+                raise AttributeError(name)
+
+            def detail_method(**kwargs):
+                with lock:
+                    running['count'] += 1
+                    running['max'] = max(running['max'], running['count'])
+                time.sleep(0.05)
+                with lock:
+                    running['count'] -= 1
+                if name == 'get_bucket_error':
+                    raise Exception('Access denied')
+                return {name: kwargs['Bucket'], 'Last': name}
+            return detail_method
+
+    monkeypatch.setattr('processor.connector.snapshot_aws.SERVICE_SEMAPHORES', {})
+    monkeypatch.setattr('processor.connector.snapshot_aws.DETAIL_EXECUTOR', None)
+    monkeypatch.setattr('processor.connector.snapshot_aws.config_value',
+                        lambda section, key, default=None: {'detailworkers': '8', 'servicelimits': 's3:3'}.get(key))
+    methods = ['get_bucket_%d' % idx for idx in range(6)] + ['get_bucket_error', 'get_bucket_last']
+    node = {'snapshotId': '1', 'arn': 'arn:aws:s3:::mybucket', 'detailMethods': methods}
+    try:
+        data = get_node(DetailClient(), node, 'awsStructure.json', {})
+    finally:
+        clear_aws_clients()
+    assert 3 == running['max']
+    assert 'Describe function exception: Access denied' == data['error']
+    assert 'get_bucket_last' == data['json']['Last']
+    assert 'mybucket' == data['json']['BucketName']
+    for method in methods[:6]:
+        assert 'mybucket' == data['json'][method]
+
+
+def eliminate_duplicate_snapshots_pairwise(snapshot_data):
+    """The pairwise comparison of all the nodes, the reference for the indexed implementation."""
+    data = {}
+    for snapshot_id, value in snapshot_data.items():
+        is_updated = False
+        for count, snapshot in enumerate(value):
+            for sid, sval in data.items():
+                for cnt, val in enumerate(sval):
+                    if sid == snapshot_id:
+                        continue
+                    if snapshot['arn'] == val['arn'] and snapshot['detailMethods'] == val['detailMethods']:
+                        is_updated = True
+                        s_id = snapshot_data[snapshot_id][count]['masterSnapshotId']
+                        if isinstance(val['masterSnapshotId'], str):
+                            data[sid][cnt]['masterSnapshotId'] = [s_id, val['masterSnapshotId']]
+                        elif isinstance(val['masterSnapshotId'], list):
+                            data[sid][cnt]['masterSnapshotId'].append(s_id)
+        if not is_updated:
+            data.update({snapshot_id: value})
+    return data
+
+
+def test_eliminate_duplicate_snapshots():
+    import copy
+    import random
+    from processor.connector.snapshot_aws import eliminate_duplicate_snapshots
+    methods = [['get_bucket_acl'], ['get_bucket_acl', 'get_bucket_policy'], ['describe_instances']]
+    for seed in range(5):
+        rand = random.Random(seed)
+        snapshot_data = {}
+        for master in range(rand.randint(20, 60)):
+            master_id = 'AWS_MASTER_%d' % master
+            snapshot_data[master_id] = [{
+                'snapshotId': '%s%d' % (master_id, count),
+                'arn': 'arn:aws:s3:::bucket%d' % rand.randint(0, 400),
+                'detailMethods': list(rand.choice(methods)),
+                'masterSnapshotId': master_id
+            } for count in range(rand.randint(0, 40))]
+        expected = eliminate_duplicate_snapshots_pairwise(copy.deepcopy(snapshot_data))
+        assert expected == eliminate_duplicate_snapshots(snapshot_data)
+        assert any(isinstance(node['masterSnapshotId'], list) for nodes in expected.values() for node in nodes)
+
+
+def test_supports_page_size():
+    import boto3
+    from processor.connector.snapshot_aws import _supports_page_size
+    iam = boto3.client('iam', region_name='us-east-1', aws_access_key_id='a', aws_secret_access_key='b')
+    assert _supports_page_size(iam, 'list_roles')
+    assert not _supports_page_size(iam, 'get_account_summary')
+    assert not _supports_page_size(iam, 'unknown_method')
@@ -211,3 +211,66 @@ def test_populate_azure_snapshot_crawler(monkeypatch):
     from processor.connector.snapshot_azure import populate_azure_snapshot
     val = populate_azure_snapshot(snapshot_crawler, 'azure')
     assert val == {'31': [{'masterSnapshotId': ['31'], 'path': 'test_id', 'snapshotId': '310', 'status': 'active', 'validate': True,'subscriptionId': 'sub_id'}]}
+
+
+def test_get_all_pages(monkeypatch):
+    pages = {
+        'https://list': {'value': [{'id': '1'}, {'id': '2'}], 'nextLink': 'https://list?page=2'},
+        'https://list?page=2': {'value': [{'id': '3'}], 'nextLink': 'https://list?page=3'},
+        'https://list?page=3': {'value': [{'id': '4'}], 'nextLink': 'https://list?page=2'},
+    }
+    monkeypatch.setattr('processor.connector.snapshot_azure.http_get_request',
+                        lambda url, headers=None, name="": (200, pages[url]) if url in pages else (404, {'error': url}))
+    from processor.connector.snapshot_azure import get_all_pages
+    status, data = get_all_pages('https://list', {})
+    assert 200 == status
+    assert ['1', '2', '3', '4'] == [value['id'] for value in data['value']]
+    pages['https://list?page=3']['nextLink'] = 'https://list?page=4'
+    assert (404, {'error': 'https://list?page=4'}) == get_all_pages('https://list', {})
+
+
+def test_populate_azure_snapshot_node_order(monkeypatch):
+    import copy
+    import random
+    import time
+    inserted = []
+
+    def mock_get_node(token, sub_name, sub_id, node, user, snapshot_source, all_data_records):
+        time.sleep(random.random() / 50)
+        return {'snapshotId': node['snapshotId'], 'collection': 'microsoftcompute'}
+
+    monkeypatch.setattr('processor.connector.snapshot_azure.get_node', mock_get_node)
+    monkeypatch.setattr('processor.connector.snapshot_azure.get_dbtests', lambda: True)
+    monkeypatch.setattr('processor.connector.snapshot_azure.get_access_token', mock_get_access_token)
+    monkeypatch.setattr('processor.connector.snapshot_azure.insert_one_document',
+                        lambda doc, collection, dbname, check_keys=True: inserted.append(doc['snapshotId']))
+    monkeypatch.setattr('processor.connector.snapshot_azure.get_web_client_data', mock1_get_web_client_data)
+    monkeypatch.setattr('processor.connector.snapshot_azure.get_collection_size', mock_get_collection_size)
+    from processor.connector.snapshot_azure import populate_azure_snapshot
+    nodes_snapshot = copy.deepcopy(snapshot)
+    nodes_snapshot['testUser'] = 'user'
+    nodes_snapshot['nodes'] = [dict(snapshot['nodes'][0], snapshotId=str(idx)) for idx in range(40)]
+    val = populate_azure_snapshot(nodes_snapshot, 'azure')
+    assert [str(idx) for idx in range(40)] == inserted
+    assert all(val[str(idx)] for idx in range(40))
+
+
+def test_add_master_snapshot_nodes():
+    from processor.connector.snapshot_azure import add_master_snapshot_nodes
+    snapshot_data = {'1': False}
+    path_index = {}
+    add_master_snapshot_nodes({'masterSnapshotId': 'M1'}, [
+        {'snapshotId': 'M10', 'path': '/a'}, {'snapshotId': 'M11', 'path': '/b'}, {'snapshotId': 'M12', 'path': '/a'}
+    ], snapshot_data, path_index, {}, False, True, 'sub_id')
+    add_master_snapshot_nodes({'masterSnapshotId': 'M2'}, [
+        {'snapshotId': 'M20', 'path': '/b'}, {'snapshotId': 'M21', 'path': '/c'}, {'snapshotId': 'M22', 'path': '/d'}
+    ], snapshot_data, path_index, {('/d',): {}}, False, True, 'sub_id')
+    add_master_snapshot_nodes({'masterSnapshotId': 'M3'}, [
+        {'snapshotId': 'M30', 'path': '/e'}, {'snapshotId': 'M31', 'path': '/c'}
+    ], snapshot_data, path_index, {}, True, True, 'sub_id')
+    assert ['/a', '/b'] == [item['path'] for item in snapshot_data['M1']]
+    assert [['M1'], ['M1', 'M2']] == [item['masterSnapshotId'] for item in snapshot_data['M1']]
+    assert ['/c'] == [item['path'] for item in snapshot_data['M2']]
+    assert ['M2', 'M3'] == snapshot_data['M2'][0]['masterSnapshotId']
+    assert [] == snapshot_data['M3']
+    assert False == snapshot_data['1']
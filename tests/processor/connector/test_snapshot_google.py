@@ -420,6 +420,42 @@ def test_get_all_nodes(monkeypatch):
     val = get_all_nodes(MyMockCredentialNoData(), node, "file.file", snapshot, {})
     assert val['json'] == {}
 
+def test_get_all_nodes_pages(monkeypatch):
+    pages = {
+        None: {"items": {"zones/us-west1-a": {"instances": [dict(instanse_data, selfLink="https://compute.googleapis.com/compute/v1/projects/p/zones/a/instances/1")]},
+                         "zones/us-west1-b": {"warning": {"code": "NO_RESULTS_ON_PAGE"}}},
+               "nextPageToken": "page2"},
+        "page2": {"items": {"zones/us-west1-b": {"instances": [dict(instanse_data, selfLink="https://compute.googleapis.com/compute/v1/projects/p/zones/b/instances/2")]}},
+                  "nextPageToken": "page3"},
+        "page3": {"items": {"zones/us-west1-c": {"instances": [dict(instanse_data, selfLink="https://compute.googleapis.com/compute/v1/projects/p/zones/c/instances/3")]}}}
+    }
+    urls = []
+
+    def mock_pages_http_get_request(url, headers):
+        urls.append(url)
+        token = url.split('pageToken=')[1] if 'pageToken=' in url else None
+        return 200, pages[token]
+
+    params = {"GoogleApis": {
+        "instances.aggregatedList": "https://compute.googleapis.com/compute/v1/projects/{project}/aggregated/instances?maxResults=1"
+    }}
+    monkeypatch.setattr('processor.connector.snapshot_google.http_get_request', mock_pages_http_get_request)
+    monkeypatch.setattr('processor.connector.snapshot_google.get_from_currentdata', mock_get_from_currentdata)
+    monkeypatch.setattr('processor.connector.snapshot_google.get_google_parameters', lambda: params)
+    from processor.connector.snapshot_google import get_all_nodes
+    node = {"masterSnapshotId": "1", "type": "compute/instances.aggregatedList", "collection": "instances"}
+    snapshot_data = {}
+    val = get_all_nodes(MyMockCredentialCrawler(), node, "file.file", snapshot, snapshot_data)
+    assert val['json'] == pages[None]
+    assert [
+        "https://compute.googleapis.com/compute/v1/projects/liquproj/aggregated/instances?maxResults=1",
+        "https://compute.googleapis.com/compute/v1/projects/liquproj/aggregated/instances?maxResults=1&pageToken=page2",
+        "https://compute.googleapis.com/compute/v1/projects/liquproj/aggregated/instances?maxResults=1&pageToken=page3"
+    ] == urls
+    assert ["compute/v1/projects/p/zones/a/instances/1", "compute/v1/projects/p/zones/b/instances/2",
+            "compute/v1/projects/p/zones/c/instances/3"] == [item['path'] for item in snapshot_data["1"]]
+    assert ["11", "12", "13"] == [item['snapshotId'] for item in snapshot_data["1"]]
+
 def test_set_snapshot_data(monkeypatch):
     monkeypatch.setattr('processor.connector.snapshot_google.get_from_currentdata', mock_get_from_currentdata)
     from processor.connector.snapshot_google import set_snapshot_data
@@ -0,0 +1,286 @@
+""" Tests for snapshot kubernetes"""
+from kubernetes import client
+
+snapshot = {
+    "source": "kubernetesStructure",
+    "type": "kubernetes",
+    "serviceAccount": "default",
+    "namespace": ["default"],
+    "nodes": []
+}
+
+
+def mock_config_value(section, key, default=None):
+    return {'listlimit': '2'}.get(key)
+
+
+class MockRawResponse:
+
+    def __init__(self, data):
+        import json
+        self.data = json.dumps(data).encode('utf-8')
+
+
+class MockCoreV1Api:
+
+    def __init__(self, names):
+        self.names = names
+        self.calls = []
+
+    def list_namespaced_pod(self, namespace, limit=None, _continue=None, _preload_content=True):
+        self.calls.append(('list', namespace, limit, _continue))
+        start = int(_continue) if _continue else 0
+        end = start + limit
+        pods = [{'metadata': {'name': name, 'namespace': namespace}} for name in self.names[start:end]]
+        metadata = {'continue': str(end)} if end < len(self.names) else {}
+        return MockRawResponse({'apiVersion': 'v1', 'kind': 'PodList', 'items': pods, 'metadata': metadata})
+
+    def read_namespaced_pod(self, name, namespace, _preload_content=True):
+        self.calls.append(('read', namespace, name))
+        return MockRawResponse({'apiVersion': 'v1', 'kind': 'Pod', 'metadata': {'name': name, 'namespace': namespace}})
+
+
+def pod_node(name):
+    return {
+        "snapshotId": name,
+        "type": "pod",
+        "collection": "pods",
+        "paths": ["api/v1/namespaces/default/pods/%s" % name]
+    }
+
+
+def test_list_kubernetes_items(monkeypatch):
+    monkeypatch.setattr('processor.connector.snapshot_kubernetes.config_value', mock_config_value)
+    from processor.connector.snapshot_kubernetes import list_kubernetes_items
+    api_instance = MockCoreV1Api(['pod1', 'pod2', 'pod3', 'pod4', 'pod5'])
+    items = list_kubernetes_items(api_instance, 'list_namespaced_pod', namespace='default')
+    assert ['pod1', 'pod2', 'pod3', 'pod4', 'pod5'] == [item['metadata']['name'] for item in items]
+    assert {'v1'} == set(item['apiVersion'] for item in items)
+    assert {'Pod'} == set(item['kind'] for item in items)
+    assert [('list', 'default', 2, None), ('list', 'default', 2, '2'), ('list', 'default', 2, '4')] == api_instance.calls
+
+
+def test_get_kubernetes_list_data(monkeypatch):
+    api_instance = MockCoreV1Api(['pod1', 'pod2', 'pod3'])
+    monkeypatch.setattr('processor.connector.snapshot_kubernetes.config_value', mock_config_value)
+    monkeypatch.setattr('processor.connector.snapshot_kubernetes.create_kube_apiserver_instance',
+                        lambda snapshot, node: api_instance)
+    from processor.connector.snapshot_kubernetes import get_kubernetes_list_data
+    listed_items = {}
+    data = get_kubernetes_list_data(snapshot, pod_node('pod2'), listed_items)
+    assert {'apiVersion': 'v1', 'kind': 'Pod', 'metadata': {'name': 'pod2', 'namespace': 'default'}} == data
+    data = get_kubernetes_list_data(snapshot, pod_node('pod3'), listed_items)
+    assert 'pod3' == data['metadata']['name']
+    # The object missing in the list is read from the apiserver
+    data = get_kubernetes_list_data(snapshot, pod_node('pod9'), listed_items)
+    assert 'pod9' == data['metadata']['name']
+    assert ['list', 'list', 'read'] == [call[0] for call in api_instance.calls]
+
+
+def test_create_kube_apiserver_instance_client(monkeypatch):
+    monkeypatch.setattr('processor.connector.snapshot_kubernetes.KUBE_API_CLIENTS', {})
+    monkeypatch.setattr('processor.connector.snapshot_kubernetes.config_value',
+                        lambda section, key: {'poolsize': '4'}.get(key))
+    from processor.connector.snapshot_kubernetes import create_kube_apiserver_instance_client, \
+        clear_kube_api_clients, KUBE_API_CLIENTS
+    default_host = client.Configuration().host
+    pod_api = create_kube_apiserver_instance_client('https://cluster1:443', 'secret1', 'pod')
+    role_api = create_kube_apiserver_instance_client('https://cluster1:443', 'secret1', 'Role')
+    other_api = create_kube_apiserver_instance_client('https://cluster2:443', 'secret2', 'pod')
+    assert isinstance(pod_api, client.CoreV1Api)
+    assert isinstance(role_api, client.RbacAuthorizationV1beta1Api)
+    assert pod_api.api_client is role_api.api_client
+    assert pod_api.api_client is not other_api.api_client
+    assert 'https://cluster2:443' == other_api.api_client.configuration.host
+    assert 4 == pod_api.api_client.configuration.connection_pool_maxsize
+    assert default_host == client.Configuration().host
+    clear_kube_api_clients()
+    assert not KUBE_API_CLIENTS
+
+
+class MockClusterApi:
+
+    def __init__(self, pods, allow_all_namespaces=True):
+        self.pods = pods
+        self.allow_all_namespaces = allow_all_namespaces
+        self.calls = []
+
+    def pod_list(self, pods):
+        return client.V1PodList(api_version='v1', kind='PodList', metadata=client.V1ListMeta(), items=[
+            client.V1Pod(metadata=client.V1ObjectMeta(name=name, namespace=namespace)) for namespace, name in pods])
+
+    def list_namespaced_pod(self, namespace, limit=None, _preload_content=True):
+        self.calls.append(('list_namespaced_pod', namespace))
+        return self.pod_list([pod for pod in self.pods if pod[0] == namespace])
+
+    def list_pod_for_all_namespaces(self, limit=None, _preload_content=True):
+        from kubernetes.client.rest import ApiException
+        self.calls.append(('list_pod_for_all_namespaces', None))
+        if not self.allow_all_namespaces:
+            raise ApiException(status=403, reason='Forbidden')
+        return self.pod_list(sorted(self.pods))
+
+    def list_cluster_role(self, limit=None, _preload_content=True):
+        self.calls.append(('list_cluster_role', None))
+        return client.V1beta1ClusterRoleList(metadata=client.V1ListMeta(), items=[
+            client.V1beta1ClusterRole(metadata=client.V1ObjectMeta(name='admin'))])
+
+
+def test_crawl_master_nodes(monkeypatch):
+    pods = [('ns2', 'pod3'), ('ns1', 'pod1'), ('ns1', 'pod2'), ('ns3', 'pod4')]
+    crawl_snapshot = dict(snapshot, namespace=['ns1', 'ns2'])
+    master_nodes = [
+        {"masterSnapshotId": "POD_", "type": "pod", "collection": "pods"},
+        {"masterSnapshotId": "CR_", "type": "clusterrole", "collection": "clusterroles"},
+        {"masterSnapshotId": "DEP_", "type": "deployment", "collection": "deployments"}
+    ]
+    expected = [
+        [{'namespace': 'ns1', 'paths': ['api/v1/namespaces/ns1/pods/pod1']},
+         {'namespace': 'ns1', 'paths': ['api/v1/namespaces/ns1/pods/pod2']},
+         {'namespace': 'ns2', 'paths': ['api/v1/namespaces/ns2/pods/pod3']}],
+        [{'namespace': 'ns1', 'paths': ['apis/rbac.authorization.k8s.io/v1beta1/clusterroles/admin']},
+         {'namespace': 'ns2', 'paths': ['apis/rbac.authorization.k8s.io/v1beta1/clusterroles/admin']}],
+        []
+    ]
+    monkeypatch.setattr('processor.connector.snapshot_kubernetes.config_value', lambda section, key: None)
+    monkeypatch.setattr('processor.connector.snapshot_kubernetes.ALL_NAMESPACES_DENIED', set())
+    from processor.connector.snapshot_kubernetes import crawl_master_nodes
+    api_instance = MockClusterApi(pods)
+    monkeypatch.setattr('processor.connector.snapshot_kubernetes.create_kube_apiserver_instance',
+                        lambda snapshot, node: api_instance)
+    assert expected == crawl_master_nodes(crawl_snapshot, master_nodes)
+    assert sorted(api_instance.calls) == [('list_cluster_role', None), ('list_pod_for_all_namespaces', None)]
+
+    # Listing all the namespaces is forbidden, every namespace is listed.
+    api_instance = MockClusterApi(pods, allow_all_namespaces=False)
+    monkeypatch.setattr('processor.connector.snapshot_kubernetes.create_kube_apiserver_instance',
+                        lambda snapshot, node: api_instance)
+    assert expected == crawl_master_nodes(crawl_snapshot, master_nodes)
+    assert expected == crawl_master_nodes(crawl_snapshot, master_nodes)
+    assert 1 == api_instance.calls.count(('list_pod_for_all_namespaces', None))
+    assert 2 == api_instance.calls.count(('list_namespaced_pod', 'ns1'))
+
+
+class MockWatchResponse:
+
+    def __init__(self, events):
+        self.events = events
+
+    def read_chunked(self, decode_content=False):
+        import json
+        for event in self.events:
+            yield ('%s\n' % json.dumps(event)).encode('utf-8')
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class MockWatchApi:
+
+    def __init__(self, names):
+        self.names = names
+        self.events = []
+        self.version = '100'
+        self.gone = False
+        self.calls = []
+
+    def list_namespaced_pod(self, namespace, limit=None, watch=False, resource_version=None,
+                            timeout_seconds=None, allow_watch_bookmarks=None, _preload_content=True):
+        """
+        :return: V1PodList
+        """
+        if watch:
+            self.calls.append(('watch', namespace, resource_version))
+            if self.gone:
+                return MockWatchResponse([{'type': 'ERROR', 'object': {'kind': 'Status', 'code': 410, 'message': 'too old'}}])
+            return MockWatchResponse(self.events)
+        self.calls.append(('list', namespace, limit))
+        pods = [client.V1Pod(metadata=client.V1ObjectMeta(name=name, namespace=namespace, resource_version='100'))
+                for name in self.names[:limit]]
+        return client.V1PodList(api_version='v1', kind='PodList', items=pods,
+                                metadata=client.V1ListMeta(resource_version=self.version))
+
+    def read_namespaced_pod(self, name, namespace, _preload_content=True):
+        self.calls.append(('read', name))
+        return None
+
+
+def pod_event(event_type, name, resource_version):
+    return {'type': event_type, 'object': {'apiVersion': 'v1', 'kind': 'Pod', 'metadata': {
+        'name': name, 'namespace': 'default', 'resourceVersion': resource_version}}}
+
+
+def test_get_kubernetes_watch_data(monkeypatch):
+    api_instance = MockWatchApi(['pod1', 'pod2', 'pod3'])
+    monkeypatch.setattr('processor.connector.snapshot_kubernetes.config_value', lambda section, key: None)
+    monkeypatch.setattr('processor.connector.snapshot_kubernetes.create_kube_apiserver_instance',
+                        lambda snapshot, node: api_instance)
+    from processor.connector.snapshot_kubernetes import get_kubernetes_watch_data, UNCHANGED
+    nodes = [pod_node('pod1'), pod_node('pod2'), pod_node('pod3')]
+    state = {}
+
+    # First run, the pods are listed and all the snapshots are saved
+    synced = {}
+    assert ['pod1', 'pod2', 'pod3'] == [get_kubernetes_watch_data(snapshot, node, synced, state)['metadata']['name']
+                                        for node in nodes]
+    assert '100' == state['pod/default']['resourceVersion']
+    assert [('list', 'default', 500)] == api_instance.calls
+
+    # The resource version of the cluster moved on without any event of the pods,
+    # the watch ends without changes and nothing is listed again.
+    api_instance.calls = []
+    api_instance.version = '105'
+    synced = {}
+    assert [UNCHANGED] * 3 == [get_kubernetes_watch_data(snapshot, node, synced, state) for node in nodes]
+    assert [('watch', 'default', '100')] == api_instance.calls
+    assert '100' == state['pod/default']['resourceVersion']
+
+    # Next run, only the modified pod is saved and the deleted pod is inactive. The
+    # watch is read till the first bookmark, not the later events.
+    api_instance.calls = []
+    api_instance.version = '110'
+    api_instance.events = [pod_event('MODIFIED', 'pod2', '105'), pod_event('DELETED', 'pod3', '106'),
+                           pod_event('BOOKMARK', '', '110'), pod_event('MODIFIED', 'pod1', '115')]
+    synced = {}
+    results = [get_kubernetes_watch_data(snapshot, node, synced, state) for node in nodes]
+    assert UNCHANGED is results[0]
+    assert '105' == results[1]['metadata']['resourceVersion']
+    assert 'Pod' == results[1]['kind']
+    assert {} == results[2]
+    assert '110' == state['pod/default']['resourceVersion']
+    assert ['pod1', 'pod2'] == sorted(state['pod/default']['objects'])
+    assert [('watch', 'default', '100')] == api_instance.calls
+
+    # The resource version is too old, the pods are listed again
+    api_instance.calls = []
+    api_instance.version = '130'
+    api_instance.gone = True
+    synced = {}
+    results = [get_kubernetes_watch_data(snapshot, node, synced, state) for node in nodes]
+    assert ['pod1', 'pod2', 'pod3'] == [result['metadata']['name'] for result in results]
+    assert [('watch', 'default', '110'), ('list', 'default', 500)] == api_instance.calls
+    assert '130' == state['pod/default']['resourceVersion']
+
+
+def test_sync_watch_kinds(monkeypatch):
+    api_instance = MockWatchApi(['pod1', 'pod2'])
+    monkeypatch.setattr('processor.connector.snapshot_kubernetes.config_value', lambda section, key: None)
+    monkeypatch.setattr('processor.connector.snapshot_kubernetes.create_kube_apiserver_instance',
+                        lambda snapshot, node: api_instance)
+    from processor.connector.snapshot_kubernetes import sync_watch_kinds, get_kubernetes_watch_data
+    nodes = [pod_node('pod1'), pod_node('pod2'), dict(pod_node('pod1'), snapshotId='ns1pod1',
+                                                      paths=['api/v1/namespaces/ns1/pods/pod1']),
+             dict(pod_node('pod1'), snapshotId='skipped', validate=False,
+                  paths=['api/v1/namespaces/ns2/pods/pod1']),
+             {'masterSnapshotId': 'master', 'type': 'pod', 'collection': 'pods'}]
+    synced = {}
+    state = {}
+    sync_watch_kinds(snapshot, nodes, synced, state)
+    assert ['pod/default', 'pod/ns1'] == sorted(synced)
+    assert ['pod/default', 'pod/ns1'] == sorted(state)
+    assert [('list', 'default', 500), ('list', 'ns1', 500)] == sorted(api_instance.calls)
+    assert 'pod2' == get_kubernetes_watch_data(snapshot, nodes[1], synced, state)['metadata']['name']
+    assert 2 == len(api_instance.calls)
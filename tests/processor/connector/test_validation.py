@@ -156,6 +156,7 @@ def test_get_snapshot_id_to_collection_dict1(monkeypatch):
 def test_run_validation_test(monkeypatch):
     monkeypatch.setattr('processor.comparison.interpreter.get_documents',
                         mock_get_documents)
+    monkeypatch.setattr('processor.comparison.snapshot_cache.get_documents', mock_get_documents)
     from processor.connector.validation import run_validation_test
     result = run_validation_test('0.1', 'mycontainer', 'validator', {}, {
         "testId": "4",
@@ -175,6 +176,7 @@ def test_run_file_validation_tests(create_temp_dir, create_temp_json, monkeypatc
     monkeypatch.setattr('processor.connector.validation.get_test_json_dir', mock_framework_dir)
     monkeypatch.setattr('processor.connector.validation.get_from_currentdata', mock_get_from_currentdata)
     monkeypatch.setattr('processor.comparison.interpreter.get_documents', mock_get_documents)
+    monkeypatch.setattr('processor.comparison.snapshot_cache.get_documents', mock_get_documents)
     from processor.connector.validation import run_file_validation_tests
     frameworkdir = create_temp_dir()
     newpath = frameworkdir
@@ -322,3 +324,46 @@ def test_run_container_validation_tests_database(monkeypatch):
     container = 'abcd'
     val = run_container_validation_tests_database(container)
     assert val == True
+
+
+def test_run_parallel_validation_tests(monkeypatch):
+    import random
+    import time
+    from processor.connector.validation import run_parallel_validation_tests, run_serial_validation_tests
+    from processor.comparison.interpreter import Comparator, RegoBatch
+
+    def mock_random_validate(self):
+        time.sleep(random.random() / 100)
+        return {"result": "passed", "order": self.comparator.testcase['testId']}
+
+    monkeypatch.setattr('processor.connector.validation.Comparator.validate', mock_random_validate)
+    testcases = [{"testId": str(idx), "snapshotId": "1", "attribute": "id", "comparison": "exist"}
+                 for idx in range(25)]
+    expected = []
+    for workers in [0, 1, 3, 8]:
+        comparators = [Comparator('0.1', 'mycontainer', 'validator', {}, testcase, {}, [])
+                       for testcase in testcases]
+        if workers:
+            results = run_parallel_validation_tests('0.1', 'mycontainer', 'validator', {}, testcases, {}, [],
+                                                    comparators, RegoBatch(comparators), workers)
+        else:
+            results = run_serial_validation_tests('0.1', 'mycontainer', 'validator', {}, testcases, {}, [],
+                                                  comparators, RegoBatch(comparators))
+        orders = [result['order'] for results in results for result in results]
+        if not expected:
+            expected = orders
+        assert expected == orders
+        assert [None] * len(testcases) == comparators
+    assert [str(idx) for idx in range(25)] == expected
+
+
+def test_validation_workers(monkeypatch):
+    currentdata = {}
+    monkeypatch.setattr('processor.connector.validation.get_from_currentdata', lambda key: currentdata.get(key))
+    monkeypatch.setattr('processor.connector.validation.config_value', lambda section, key, default=None: default)
+    from processor.connector.validation import validation_workers
+    assert (1, 'thread') == validation_workers()
+    currentdata.update({'workers': 4, 'workertype': 'process'})
+    assert (4, 'process') == validation_workers()
+    currentdata.update({'workers': -2, 'workertype': 'unknown'})
+    assert (1, 'thread') == validation_workers()
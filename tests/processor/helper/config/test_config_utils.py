@@ -104,3 +104,28 @@ def test_get_test_json_dir():
     os.chdir(get_test_json_dir())
     prod_curdir = os.getcwd()
     assert tests_curdir == prod_curdir
+
+
+def test_config_value_cache(monkeypatch):
+    import processor.helper.config.config_utils as config_utils
+    newpath = tempfile.mkdtemp()
+    configini = '%s/cached.ini' % newpath
+    with open(configini, 'w') as configfile:
+        configfile.write('[TESTS]\ndatabase = NONE\n')
+    parsed = []
+    get_config_data = config_utils.get_config_data
+
+    def mock_get_config_data(config_file):
+        parsed.append(config_file)
+        return get_config_data(config_file)
+
+    monkeypatch.setattr('processor.helper.config.config_utils.get_config_data', mock_get_config_data)
+    assert 'NONE' == config_value('TESTS', 'database', configfile=configini)
+    assert 'NONE' == config_value('TESTS', 'Database', configfile=configini)
+    assert 'no' == config_value('TESTS', 'containerFolder', configfile=configini, default='no')
+    assert 1 == len(parsed)
+    with open(configini, 'w') as configfile:
+        configfile.write('[TESTS]\ndatabase = SNAPSHOT\n')
+    os.utime(configini, (0, 0))
+    assert 'SNAPSHOT' == config_value('TESTS', 'database', configfile=configini)
+    assert 2 == len(parsed)
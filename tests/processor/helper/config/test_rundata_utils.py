@@ -1,7 +1,8 @@
 import os
+import json
 import shutil
 from processor.helper.config.rundata_utils import init_currentdata,\
-    put_in_currentdata, delete_from_currentdata, delete_currentdata
+    put_in_currentdata, delete_from_currentdata, delete_currentdata, checkpoint_currentdata
 from processor.helper.config.config_utils import framework_currentdata
 
 
@@ -22,6 +23,7 @@ set_tests_dir()
 def test_init_config():
     runcfg = framework_currentdata()
     rundir = os.path.dirname(runcfg)
+    checkpoint_currentdata()
     # if os.path.exists(rundir):
     #    shutil.rmtree(rundir)
     # assert False == os.path.exists(rundir)
@@ -42,14 +44,17 @@ def test_add_to_run_config(load_json_file):
     init_currentdata()
     assert True == os.path.exists(runcfg)
     put_in_currentdata('a', 'val1')
+    checkpoint_currentdata()
     runconfig = load_json_file(runcfg)
     result = True if runconfig and 'a' in runconfig and runconfig['a'] == 'val1' else False
     assert result == True
     put_in_currentdata('b', ['val1'])
+    checkpoint_currentdata()
     runconfig = load_json_file(runcfg)
     result = True if runconfig and 'b' in runconfig and runconfig['b'] == ['val1'] else False
     assert result == True
     put_in_currentdata('b', 'val2')
+    checkpoint_currentdata()
     runconfig = load_json_file(runcfg)
     result = True if runconfig and 'b' in runconfig and runconfig['b'] == ['val1', 'val2'] else False
     assert result == True
@@ -60,10 +65,12 @@ def test_delete_from_run_config(load_json_file):
     init_currentdata()
     assert True == os.path.exists(runcfg)
     put_in_currentdata('a', 'val1')
+    checkpoint_currentdata()
     runconfig = load_json_file(runcfg)
     result = True if runconfig and 'a' in runconfig and runconfig['a'] == 'val1' else False
     assert result == True
     delete_from_currentdata('a')
+    checkpoint_currentdata()
     runconfig = load_json_file(runcfg)
     result = False if runconfig and 'a' in runconfig else True
     assert result == True
@@ -76,3 +83,50 @@ def test_delete_run_config():
     put_in_currentdata('token', 'abcd')
     delete_currentdata()
     assert False == os.path.exists(runcfg)
+
+
+def test_run_context_write_behind(load_json_file):
+    from processor.helper.config.rundata_utils import get_runcontext, get_from_currentdata
+    runcfg = framework_currentdata()
+    init_currentdata()
+    runctx = get_runcontext()
+    interval = runctx.interval
+    runctx.interval = 0
+    try:
+        put_in_currentdata('c', 'val1')
+        assert 'val1' == get_from_currentdata('c')
+        runconfig = load_json_file(runcfg)
+        assert 'c' not in runconfig
+        checkpoint_currentdata()
+        runconfig = load_json_file(runcfg)
+        assert 'val1' == runconfig['c']
+        # Changes written by another process are merged at the checkpoint.
+        runconfig['d'] = 'val2'
+        with open(runcfg, 'w') as f:
+            json.dump(runconfig, f)
+        delete_from_currentdata('c')
+        checkpoint_currentdata()
+        runconfig = load_json_file(runcfg)
+        assert 'c' not in runconfig
+        assert 'val2' == runconfig['d']
+        assert 'val2' == get_from_currentdata('d')
+    finally:
+        runctx.interval = interval
+
+
+def test_run_context_get_copy():
+    from processor.helper.config.rundata_utils import get_from_currentdata
+    init_currentdata()
+    put_in_currentdata('resources', [])
+    resource = {'id': '/a'}
+    put_in_currentdata('resources', resource)
+    resource['id'] = '/changed'
+    resources = get_from_currentdata('resources')
+    resources.append({'id': '/a/child'})
+    resources[0]['id'] = '/b'
+    assert [{'id': '/a'}] == get_from_currentdata('resources')
+    put_in_currentdata('exclusion', {'paths': ['/a']})
+    get_from_currentdata('exclusion')['paths'].extend(['/b'])
+    assert {'paths': ['/a']} == get_from_currentdata('exclusion')
+    delete_from_currentdata('resources')
+    delete_from_currentdata('exclusion')
@@ -0,0 +1,51 @@
+""" Tests for the fan-out engine of the REST connectors"""
+import threading
+import time
+
+
+def test_run_all_order(monkeypatch):
+    monkeypatch.setattr('processor.helper.httpapi.fetch_engine.config_value', lambda section, key: None)
+    from processor.helper.httpapi.fetch_engine import run_all
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def call(index):
+        with lock:
+            running.append(index)
+            peak.append(len(running))
+        time.sleep(0.01 * (index % 3))
+        with lock:
+            running.remove(index)
+        return index * 2
+
+    assert [] == run_all([])
+    assert [index * 2 for index in range(20)] == run_all([lambda index=index: call(index) for index in range(20)], 4)
+    assert 4 == max(peak)
+
+
+def test_run_all_error(monkeypatch):
+    monkeypatch.setattr('processor.helper.httpapi.fetch_engine.config_value', lambda section, key: None)
+    from processor.helper.httpapi.fetch_engine import run_all
+
+    def failed():
+        raise ValueError('Test')
+
+    try:
+        run_all([lambda: 1, failed])
+        assert False
+    except ValueError:
+        pass
+
+
+def test_fetch_all(monkeypatch):
+    monkeypatch.setattr('processor.helper.httpapi.fetch_engine.config_value',
+                        lambda section, key: {'fetchconcurrency': '2'}.get(key))
+    from processor.helper.httpapi.fetch_engine import fetch_all
+    requests = [('http://a.b.c/%d' % index, {'Authorization': 'Bearer abc'}) for index in range(5)]
+
+    def fetch(url, headers, name=None):
+        return 200, {'url': url, 'name': name}
+
+    results = fetch_all(requests, fetch=fetch, name='RESOURCE')
+    assert [(200, {'url': url, 'name': 'RESOURCE'}) for url, _ in requests] == results
@@ -0,0 +1,77 @@
+""" Tests for the rate limiter of the cloud API calls"""
+from urllib.error import HTTPError
+from botocore.exceptions import ClientError
+
+
+def throttling_error(code='Throttling', retry_after=None):
+    headers = {'retry-after': retry_after} if retry_after else {}
+    return ClientError({'Error': {'Code': code, 'Message': 'Rate exceeded'},
+                        'ResponseMetadata': {'HTTPStatusCode': 400, 'HTTPHeaders': headers}}, 'ListRoles')
+
+
+def test_throttle_error():
+    from processor.helper.httpapi.rate_limiter import throttle_error
+    assert (True, None) == throttle_error(throttling_error())
+    assert (True, 3) == throttle_error(throttling_error('RequestLimitExceeded', '3'))
+    assert (False, None) == throttle_error(throttling_error('AccessDenied'))
+    assert (True, 2) == throttle_error(HTTPError('http://a.b.c', 429, 'Too many requests', {'Retry-After': '2'}, None))
+    assert (False, None) == throttle_error(HTTPError('http://a.b.c', 404, 'not found', {}, None))
+    assert (False, None) == throttle_error(Exception('Test'))
+
+
+def test_url_rate_limiter(monkeypatch):
+    monkeypatch.setattr('processor.helper.httpapi.rate_limiter.RATE_LIMITERS', {})
+    from processor.helper.httpapi.rate_limiter import url_rate_limiter
+    limiter = url_rate_limiter('https://management.azure.com/subscriptions?api-version=2020-01-01')
+    assert 'azure:management.azure.com' == limiter.name
+    assert limiter is url_rate_limiter('https://management.azure.com/providers')
+    assert 'google:compute.googleapis.com' == url_rate_limiter('https://compute.googleapis.com/compute/v1').name
+    assert 'http:a.b.c' == url_rate_limiter('http://a.b.c:8080/path').name
+
+
+def test_rate_limited_call(monkeypatch):
+    throttles = {}
+    monkeypatch.setattr('processor.helper.httpapi.rate_limiter.THROTTLES', {})
+    monkeypatch.setattr('processor.helper.httpapi.rate_limiter.backoff', lambda attempt: 0)
+    monkeypatch.setattr('processor.helper.httpapi.rate_limiter.config_value',
+                        lambda section, key: {'retries': '2'}.get(key))
+    monkeypatch.setattr('processor.helper.httpapi.rate_limiter.put_in_currentdata',
+                        lambda key, value: throttles.update({key: value}))
+    from processor.helper.httpapi.rate_limiter import RateLimiter, rate_limited_call
+    calls = []
+
+    def list_roles(**kwargs):
+        calls.append(kwargs)
+        if len(calls) < 3:
+            raise throttling_error()
+        return {'Roles': []}
+
+    limiter = RateLimiter('aws:iam', rate=800, max_rate=1000)
+    assert {'Roles': []} == rate_limited_call(limiter, list_roles, MaxItems=10)
+    assert 3 == len(calls)
+    assert 200.5 == limiter.rate
+    assert {'throttles': {'aws:iam': 2}} == throttles
+
+    def always_throttled():
+        raise throttling_error()
+
+    try:
+        rate_limited_call(limiter, always_throttled)
+        assert False
+    except ClientError:
+        pass
+    assert 25.0625 == limiter.rate
+    assert 5 == throttles['throttles']['aws:iam']
+
+
+def test_rate_limited_response(monkeypatch):
+    from unittest.mock import Mock
+    monkeypatch.setattr('processor.helper.httpapi.rate_limiter.THROTTLES', {})
+    monkeypatch.setattr('processor.helper.httpapi.rate_limiter.config_value', lambda section, key: None)
+    monkeypatch.setattr('processor.helper.httpapi.rate_limiter.put_in_currentdata', lambda key, value: None)
+    from processor.helper.httpapi.rate_limiter import RateLimiter, rate_limited_call
+    responses = [Mock(status_code=429, headers={'Retry-After': '0.01'}), Mock(status_code=200, headers={})]
+    limiter = RateLimiter('azure:management.azure.com')
+    response = rate_limited_call(limiter, responses.pop, 0)
+    assert 200 == response.status_code
+    assert not responses
@@ -0,0 +1,63 @@
+""" Tests for the cache of the Google access tokens"""
+from collections import namedtuple
+
+AccessTokenInfo = namedtuple('AccessTokenInfo', ['access_token', 'expires_in'])
+
+
+class MockCredentials:
+    issued = []
+
+    def __init__(self, email='test@project.iam.gserviceaccount.com', expires_in=3600):
+        self.service_account_email = email
+        self._private_key_id = 'keyid'
+        self._scopes = 'https://www.googleapis.com/auth/cloud-platform'
+        self.expires_in = expires_in
+        self.access_token = None
+
+    def get_access_token(self):
+        if not self.access_token:
+            MockCredentials.issued.append(self.service_account_email)
+            self.access_token = 'token%d' % len(MockCredentials.issued)
+        return AccessTokenInfo(self.access_token, self.expires_in)
+
+
+def patch_tokens(monkeypatch, stats):
+    monkeypatch.setattr('processor.helper.httpapi.restapi_google.GOOGLE_TOKENS', {})
+    monkeypatch.setattr('processor.helper.httpapi.restapi_google.TOKEN_LOCKS', {})
+    monkeypatch.setattr('processor.helper.httpapi.restapi_google.TOKEN_REFRESHES', {})
+    monkeypatch.setattr('processor.helper.httpapi.restapi_google.config_value', lambda section, key: None)
+    monkeypatch.setattr('processor.helper.httpapi.restapi_google.put_in_currentdata',
+                        lambda key, value: stats.update({key: value}))
+    monkeypatch.setattr(MockCredentials, 'issued', [])
+
+
+def test_get_google_access_token(monkeypatch):
+    stats = {}
+    patch_tokens(monkeypatch, stats)
+    from processor.helper.httpapi.restapi_google import get_google_access_token
+    assert 'token1' == get_google_access_token(MockCredentials())
+    # New credentials of the same service account use the cached token
+    assert 'token1' == get_google_access_token(MockCredentials())
+    assert 'token2' == get_google_access_token(MockCredentials('other@project.iam.gserviceaccount.com'))
+    assert {'googleTokenRefreshes': {'test@project.iam.gserviceaccount.com': 1,
+                                     'other@project.iam.gserviceaccount.com': 1}} == stats
+
+
+def test_get_google_access_token_refresh(monkeypatch):
+    stats = {}
+    patch_tokens(monkeypatch, stats)
+    from processor.helper.httpapi.restapi_google import get_google_access_token
+    credentials = MockCredentials(expires_in=200)
+    assert 'token1' == get_google_access_token(credentials)
+    # The token expires in less than the refresh margin, a new token is fetched.
+    assert 'token2' == get_google_access_token(credentials)
+    assert {'googleTokenRefreshes': {'test@project.iam.gserviceaccount.com': 2}} == stats
+
+
+def test_get_google_access_token_no_service_account(monkeypatch):
+    stats = {}
+    patch_tokens(monkeypatch, stats)
+    from processor.helper.httpapi.restapi_google import get_google_access_token
+    credentials = MockCredentials(email=None)
+    assert 'token1' == get_google_access_token(credentials)
+    assert {} == stats
@@ -0,0 +1,90 @@
+"""
+Benchmark of the merge of the resources crawled for the Azure master snapshot
+nodes, on a synthetic subscription. Compares the pairwise search of the paths,
+as done before the path index, with add_master_snapshot_nodes.
+
+    python utilities/benchmark_azure_master_snapshot.py --resources 50000
+"""
+import argparse
+import random
+import time
+from processor.connector.snapshot_azure import add_master_snapshot_nodes
+
+
+def synthetic_resources(count, masters, seed):
+    """The resources listed for each master snapshot node, a resource is crawled by one or more nodes."""
+    rand = random.Random(seed)
+    paths = ['/subscriptions/sub-id/resourceGroups/rg%d/providers/Microsoft.Compute/virtualMachines/vm%d'
+             % (idx % 100, idx) for idx in range(count)]
+    alldata = {}
+    for master in range(masters):
+        master_id = 'AZURE_MASTER_%d' % master
+        crawled = [path for path in paths if master == 0 or rand.random() < 0.3]
+        alldata[master_id] = [{'snapshotId': '%s%d' % (master_id, idx), 'path': path}
+                              for idx, path in enumerate(crawled)]
+    return alldata
+
+
+def pairwise_master_snapshot_nodes(node, alldata, snapshot_data, validate, sub_id):
+    """The search of every path in every list of snapshot_data, used before the path index."""
+    snapshot_data[node['masterSnapshotId']] = []
+    for data in alldata:
+        found_old_record = False
+        for _, snapshot_list in snapshot_data.items():
+            old_record = None
+            if isinstance(snapshot_list, list):
+                for item in snapshot_list:
+                    if item["path"] == data['path']:
+                        old_record = item
+                if old_record:
+                    found_old_record = True
+                    if node['masterSnapshotId'] not in old_record['masterSnapshotId']:
+                        old_record['masterSnapshotId'].append(node['masterSnapshotId'])
+        if not found_old_record:
+            snapshot_data[node['masterSnapshotId']].append({
+                'masterSnapshotId': [node['masterSnapshotId']],
+                'snapshotId': data['snapshotId'],
+                'path': data['path'],
+                'validate': validate,
+                'status': 'active',
+                'subscriptionId': sub_id
+            })
+
+
+def run_indexed(alldata):
+    snapshot_data, path_index = {}, {}
+    for master_id, resources in alldata.items():
+        add_master_snapshot_nodes({'masterSnapshotId': master_id}, resources, snapshot_data,
+                                  path_index, {}, False, True, 'sub-id')
+    return snapshot_data
+
+
+def run_pairwise(alldata):
+    snapshot_data = {}
+    for master_id, resources in alldata.items():
+        pairwise_master_snapshot_nodes({'masterSnapshotId': master_id}, resources, snapshot_data, True, 'sub-id')
+    return snapshot_data
+
+
+def main():
+    cmd_parser = argparse.ArgumentParser("Benchmark of the Azure master snapshot merge.")
+    cmd_parser.add_argument('--resources', type=int, default=50000, help='Resources in the subscription.')
+    cmd_parser.add_argument('--masters', type=int, default=3, help='Master snapshot nodes crawling the subscription.')
+    cmd_parser.add_argument('--seed', type=int, default=0)
+    cmd_parser.add_argument('--skip-pairwise', action='store_true', help='Only run the indexed merge.')
+    args = cmd_parser.parse_args()
+    alldata = synthetic_resources(args.resources, args.masters, args.seed)
+    print('Resources: %d, crawled nodes: %d' % (args.resources, sum(len(val) for val in alldata.values())))
+    start = time.time()
+    indexed = run_indexed(alldata)
+    print('Path index: %.2f seconds' % (time.time() - start))
+    if not args.skip_pairwise:
+        alldata = synthetic_resources(args.resources, args.masters, args.seed)
+        start = time.time()
+        pairwise = run_pairwise(alldata)
+        print('Pairwise:   %.2f seconds' % (time.time() - start))
+        print('Same result: %s' % (pairwise == indexed))
+
+
+if __name__ == '__main__':
+    main()
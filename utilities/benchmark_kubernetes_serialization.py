@@ -0,0 +1,90 @@
+"""
+Benchmark of the serialization of the Kubernetes list responses, on a synthetic
+list of pods. Compares the model objects of the kubernetes client serialized by
+todict or sanitize_for_serialization with the raw json of a call made with
+_preload_content=False, as read by the snapshot.
+
+    python utilities/benchmark_kubernetes_serialization.py --pods 5000
+"""
+import argparse
+import json
+import time
+from types import SimpleNamespace
+from kubernetes import client
+from processor.connector.snapshot_kubernetes import todict, kubernetes_json
+
+
+def synthetic_pod(idx):
+    """A pod with the fields of a usual deployment pod."""
+    name = 'app-%d-7d9f8c6b5-%05d' % (idx % 50, idx)
+    return {
+        'apiVersion': 'v1',
+        'kind': 'Pod',
+        'metadata': {
+            'name': name,
+            'namespace': 'ns-%d' % (idx % 20),
+            'uid': '0b6c3a9e-%012d' % idx,
+            'resourceVersion': str(100000 + idx),
+            'creationTimestamp': '2021-03-01T10:00:00Z',
+            'labels': {'app': 'app-%d' % (idx % 50), 'pod-template-hash': '7d9f8c6b5'},
+            'annotations': {'prometheus.io/scrape': 'true', 'prometheus.io/port': '9090'},
+            'ownerReferences': [{'apiVersion': 'apps/v1', 'kind': 'ReplicaSet', 'name': 'app-%d-7d9f8c6b5' % (idx % 50),
+                                 'uid': '5a1e%012d' % idx, 'controller': True, 'blockOwnerDeletion': True}]
+        },
+        'spec': {
+            'containers': [{
+                'name': 'app',
+                'image': 'registry.example.com/app:%d' % (idx % 7),
+                'ports': [{'containerPort': 8080, 'protocol': 'TCP'}, {'containerPort': 9090, 'protocol': 'TCP'}],
+                'env': [{'name': 'ENV_%d' % env, 'value': 'value-%d' % env} for env in range(5)],
+                'resources': {'limits': {'cpu': '500m', 'memory': '512Mi'}, 'requests': {'cpu': '100m', 'memory': '128Mi'}},
+                'volumeMounts': [{'name': 'config', 'mountPath': '/etc/app', 'readOnly': True}],
+                'securityContext': {'runAsNonRoot': True, 'readOnlyRootFilesystem': True,
+                                    'capabilities': {'drop': ['ALL']}},
+                'livenessProbe': {'httpGet': {'path': '/healthz', 'port': 8080, 'scheme': 'HTTP'},
+                                  'initialDelaySeconds': 10, 'periodSeconds': 10}
+            }],
+            'volumes': [{'name': 'config', 'configMap': {'name': 'app-config', 'defaultMode': 420}}],
+            'serviceAccountName': 'default',
+            'nodeName': 'node-%d' % (idx % 30),
+            'restartPolicy': 'Always'
+        },
+        'status': {
+            'phase': 'Running',
+            'podIP': '10.0.%d.%d' % (idx // 250 % 250, idx % 250),
+            'startTime': '2021-03-01T10:00:05Z',
+            'conditions': [{'type': kind, 'status': 'True', 'lastTransitionTime': '2021-03-01T10:00:10Z'}
+                           for kind in ['Initialized', 'Ready', 'ContainersReady', 'PodScheduled']],
+            'containerStatuses': [{'name': 'app', 'ready': True, 'restartCount': 0, 'image': 'app', 'imageID': 'sha',
+                                   'state': {'running': {'startedAt': '2021-03-01T10:00:08Z'}}}]
+        }
+    }
+
+
+def timed(label, function, rounds):
+    start = time.time()
+    for _ in range(rounds):
+        result = function()
+    print('%-40s %.3f seconds' % (label, (time.time() - start) / rounds))
+    return result
+
+
+def main():
+    cmd_parser = argparse.ArgumentParser("Benchmark of the Kubernetes serialization.")
+    cmd_parser.add_argument('--pods', type=int, default=5000, help='Pods in the list response.')
+    cmd_parser.add_argument('--rounds', type=int, default=3)
+    args = cmd_parser.parse_args()
+    body = json.dumps({'apiVersion': 'v1', 'kind': 'PodList', 'metadata': {'resourceVersion': '1'},
+                       'items': [synthetic_pod(idx) for idx in range(args.pods)]}).encode('utf-8')
+    api_client = client.ApiClient()
+    response = SimpleNamespace(data=body)
+    print('Pods: %d, response: %.1f MB' % (args.pods, len(body) / 1024.0 / 1024.0))
+    models = timed('Deserialize the models', lambda: api_client.deserialize(response, 'V1PodList'), args.rounds)
+    timed('todict of the models', lambda: todict(models), args.rounds)
+    timed('sanitize_for_serialization of the models', lambda: api_client.sanitize_for_serialization(models), args.rounds)
+    timed('Models and todict', lambda: todict(api_client.deserialize(response, 'V1PodList')), args.rounds)
+    timed('Raw json (_preload_content=False)', lambda: kubernetes_json(response), args.rounds)
+
+
+if __name__ == '__main__':
+    main()